@@ -3,29 +3,40 @@ from hashlib import sha256
 from cpos.core.transactions import TransactionList
 from time import time
 
-class Block:
+def lowest_proof_ticket(node_hash: bytes, last_ticket: int) -> int:
+    """The ticket in 0..last_ticket whose proof_hash is the lowest (the
+    first one, on ties)."""
+    # every proof_hash starts with node_hash, so it is only hashed once
+    prefix = sha256(node_hash)
+    best_ticket, best_hash = 0, None
+    for ticket in range(last_ticket + 1):
+        h = prefix.copy()
+        h.update(ticket.to_bytes(4, "little", signed=False))
+        proof_hash = h.digest()
+        if best_hash is None or proof_hash < best_hash:
+            best_ticket, best_hash = ticket, proof_hash
+    return best_ticket
+
+class BlockHeader:
     # TODO: document the following changes:
-    # - Use regular SHA-256 hashes instead of Merkle tree roots for transactions
     # - Use the node's pubkey as its ID
     # - When calculating the node hash, use the hash of the previous block instead
     #   of the epoch head
-    def __init__(self, parent_hash: bytes, transactionlist: TransactionList,
-                 owner_pubkey: bytes, signed_node_hash: bytes,
-                 round: int, index: int, ticket_number: int):
+    # Everything needed to validate a block and to compute its hash; the
+    # transactions themselves are only committed to by transaction_hash
+    def __init__(self, parent_hash: bytes, owner_pubkey: bytes, signed_node_hash: bytes,
+                 round: int, index: int, ticket_number: int, transaction_hash: bytes):
         self.parent_hash = parent_hash
         self.owner_pubkey = owner_pubkey
         self.signed_node_hash = signed_node_hash
         self.round = round
         self.index = index
-        self.transactions = transactionlist.transactions # Only string with transations
-        self.transaction_hash = transactionlist.get_hash()
+        self.transaction_hash = transaction_hash
         self.ticket_number = ticket_number
 
         self.update()
 
     def update(self):
-        # TODO: TransactionList should implement a get_hash() function
-        
         self.node_hash = self.calculate_node_hash()
         self.proof_hash = self.calculate_proof_hash()
         self.hash = self.calculate_hash()
@@ -46,12 +57,48 @@ class Block:
         return sha256(self.proof_hash + self.parent_hash + self.transaction_hash).digest()
 
     def __str__(self):
-        return f"Block(hash={self.hash.hex()[0:8]}, parent={self.parent_hash.hex()[0:8]}, owner={self.owner_pubkey.hex()[0:8]}, round={self.round}, index={self.index}, proof_hash={self.proof_hash.hex()[0:8]})"
+        return f"{type(self).__name__}(hash={self.hash.hex()[0:8]}, parent={self.parent_hash.hex()[0:8]}, owner={self.owner_pubkey.hex()[0:8]}, round={self.round}, index={self.index}, proof_hash={self.proof_hash.hex()[0:8]})"
 
     def __repr__(self):
         return self.__str__()
 
 
+class Block(BlockHeader):
+    def __init__(self, parent_hash: bytes, transactionlist: TransactionList,
+                 owner_pubkey: bytes, signed_node_hash: bytes,
+                 round: int, index: int, ticket_number: int):
+        self.transactions = transactionlist.transactions # Only string with transations
+        super().__init__(parent_hash=parent_hash,
+                         owner_pubkey=owner_pubkey,
+                         signed_node_hash=signed_node_hash,
+                         round=round,
+                         index=index,
+                         ticket_number=ticket_number,
+                         transaction_hash=transactionlist.get_hash())
+
+    @classmethod
+    def from_header(cls, header: BlockHeader, transactionlist: TransactionList) -> Block:
+        block = cls(parent_hash=header.parent_hash,
+                    transactionlist=transactionlist,
+                    owner_pubkey=header.owner_pubkey,
+                    signed_node_hash=header.signed_node_hash,
+                    round=header.round,
+                    index=header.index,
+                    ticket_number=header.ticket_number)
+        if block.hash != header.hash:
+            raise ValueError(f"body does not match header {header.hash.hex()[0:8]}")
+        return block
+
+    def header(self) -> BlockHeader:
+        return BlockHeader(parent_hash=self.parent_hash,
+                           owner_pubkey=self.owner_pubkey,
+                           signed_node_hash=self.signed_node_hash,
+                           round=self.round,
+                           index=self.index,
+                           ticket_number=self.ticket_number,
+                           transaction_hash=self.transaction_hash)
+
+
 class GenesisBlock(Block):
     def __init__(self, timestamp=None):
         self.hash = b"\x00"
@@ -1,41 +1,32 @@
 import base64
 import datetime
 import hashlib
-import mysql.connector
 import numpy as np
 import os
 import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from time import sleep
-from cpos.core.block import Block, GenesisBlock
+from cpos.core.block import Block, BlockHeader, GenesisBlock
 from cpos.core.transactions import TransactionList, MockTransactionList
-from cpos.core.sortition import fork_threshold, run_sortition, confirmation_threshold
+from cpos.core.sortition import run_sortition, ThresholdTable
+from cpos.core.chainindex import ChainIndex, ROW_ARRIVE_TIME, ROW_HASH, ROW_NUM_SUC
+from cpos.core.storage import BlockStorage, MariaDBStorage
 from time import time
 from typing import Optional
 from collections import OrderedDict
+from contextlib import contextmanager
 import logging
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 from cryptography.exceptions import InvalidSignature
 
 
-HOST = "localhost"
-USER = "CPoS"
-PASSWORD = "CPoSPW"
-DATABASE = "localBlockchain"
 PROGRAM_INTERRUPTED = False
-
-try:
-    connection = mysql.connector.connect(
-        host=HOST,
-        user=USER,
-        password=PASSWORD,
-        database=DATABASE
-    )
-
-    if connection.is_connected():
-        print("Connected to the MariaDB database!")
-
-except mysql.connector.Error as err:
-    print(f"Error: {err}")
+# how many verified sortition proofs each node remembers
+VALIDATION_CACHE_SIZE = 4096
+# the block locator lists this many consecutive blocks from the tip
+# before it starts doubling the distance between entries
+LOCATOR_DENSE_BLOCKS = 10
 
 def sighandler(*args):
     global PROGRAM_INTERRUPTED 
@@ -52,23 +43,56 @@ class BlockChainParameters:
 
 class BlockChain:
 
-    def __init__(self, parameters: BlockChainParameters, genesis: Optional[GenesisBlock] = None, node_id: bytes = None):
+    def __init__(self, parameters: BlockChainParameters, genesis: Optional[GenesisBlock] = None, node_id: bytes = None,
+                 storage: Optional[BlockStorage] = None, validation_workers: Optional[int] = None):
         logger = logging.getLogger(__name__)
         handler = logging.StreamHandler()
-        formatter = logging.Formatter(f"[%(asctime)s][%(levelname)s] {__name__}: [{node_id.hex()[0:8]}] %(message)s")
+        node_tag = node_id.hex()[0:8] if node_id is not None else "--------"
+        formatter = logging.Formatter(f"[%(asctime)s][%(levelname)s] {__name__}: [{node_tag}] %(message)s")
         logger.setLevel(logging.INFO)
         handler.setFormatter(formatter)
         logger.addHandler(handler)
         self.logger = logger
         
         self.parameters: BlockChainParameters = parameters
+        # confirmation/fork thresholds only depend on the parameters, so
+        # they are looked up instead of recomputed every round
+        self.thresholds = ThresholdTable(parameters.total_stake, parameters.tau)
+        # (owner_pubkey, signed_node_hash, node_hash, stake, p) -> winning
+        # tickets, or None if the signature did not verify; all tickets of a
+        # proof (and every re-broadcast of a block) share the same entry
+        self.validation_cache: OrderedDict[tuple, Optional[int]] = OrderedDict()
+        self.validation_lock = threading.Lock()
+        # signature checks release the GIL, so batches are verified on a
+        # thread pool (created on first use)
+        self.validation_workers = validation_workers or os.cpu_count() or 1
+        self.validation_pool: Optional[ThreadPoolExecutor] = None
 
         if genesis is not None:
             self.genesis: GenesisBlock = genesis
         else:
             self.genesis: GenesisBlock = GenesisBlock()
-        
-        self.insert_genesis_block(genesis, 0, 1) # TODO CHECK ARRIVE TIME OF GENESIS BLOCK, genesis block is altomatically confirmed
+
+        # durable copy of the chain; defaults to the MariaDB server that
+        # the demo containers run next to every node
+        self.storage: BlockStorage = storage if storage is not None else MariaDBStorage()
+
+        # write-through cache of the active chain; every read on the
+        # insertion path is answered from here instead of the database
+        self.chain_index = ChainIndex()
+        if not self.storage.is_empty() and not self.stored_genesis_matches():
+            # a chain built on another genesis is of no use to this network
+            self.logger.warning("stored chain has a different genesis block, discarding it")
+            with self.storage.transaction():
+                self.storage.delete_since(0)
+        if self.storage.is_empty():
+            # the genesis block is automatically confirmed; its arrive time
+            # is its timestamp, so a stored chain can be matched against it
+            self.insert_genesis_block(self.genesis, int(self.genesis.timestamp), 1)
+        else:
+            # pick up the chain that a previous run left in the storage
+            self.chain_index = ChainIndex.from_rows(self.storage.all_rows())
+            self.logger.info(f"resuming stored chain of {len(self.chain_index)} blocks")
         # TODO: this stores the number of successful sortitions that have
         # a certain block into the foreign blockchain view; document/find
         # better naming later
@@ -80,6 +104,11 @@ class BlockChain:
         self.confirmation_delays = []
         self.update_round()
 
+    def stored_genesis_matches(self) -> bool:
+        row = self.storage.row_at(0)
+        return (row is not None and row[ROW_HASH] == self.genesis.hash.hex()
+                and row[ROW_ARRIVE_TIME] == int(self.genesis.timestamp))
+
     def update_round(self):
         current_time = time()
         genesis_time = self.genesis.timestamp
@@ -90,6 +119,11 @@ class BlockChain:
             return
 
         self.current_round = round
+        # numSuc is only kept in memory while blocks are received, so
+        # persist it once per round; in group-commit mode this is also the
+        # only point where the writes of the previous round reach the disk
+        self.storage.set_num_suc(self.chain_index.unconfirmed_num_suc())
+        self.storage.flush()
 
         self.logger.info(f"starting round {round}")
         self._dump_block_hashes()
@@ -104,47 +138,43 @@ class BlockChain:
         if last_confirmed_block_id == self.last_block_id(): 
             return
         
-        block_confirmed = True
-
-        while block_confirmed:
-            oldest_index, oldest_id, oldest_numSuc, oldest_round = self.oldest_unconfirmed_block()
-            delta_r = round - oldest_round - 1
-
-            if delta_r > 0 and oldest_index > 0:
-                successful_avg = oldest_numSuc / delta_r
-                self.logger.info(f"oldest unconfirmed block: {oldest_id}, delta_r: {delta_r}, s: {successful_avg}")
-
-                # TODO: make the epsilon threshold variable
-                conf_thresh = confirmation_threshold(total_stake=self.parameters.total_stake,
-                                    tau=self.parameters.tau,
-                                    delta_r=delta_r,
-                                    threshold=1e-6)
-                self.logger.info(f"s_min: {conf_thresh}")
-
-                if successful_avg > conf_thresh:
-                    self.logger.info(f"confirmed block {oldest_id}")
-                    self.confirm_block(oldest_id)
-                    self.confirmation_delays.append([oldest_id, oldest_index, self.current_round - oldest_round]) # measured in rounds
-                    self.last_confirmation_delay = self.current_round - last_confirmed_block_round
+        # all confirmations of a round are committed together
+        with self._mutation():
+            block_confirmed = True
+
+            while block_confirmed:
+                oldest_index, oldest_id, oldest_numSuc, oldest_round = self.oldest_unconfirmed_block()
+                delta_r = round - oldest_round - 1
+
+                if delta_r > 0 and oldest_index > 0:
+                    successful_avg = oldest_numSuc / delta_r
+                    self.logger.info(f"oldest unconfirmed block: {oldest_id}, delta_r: {delta_r}, s: {successful_avg}")
+
+                    # TODO: make the epsilon threshold variable
+                    conf_thresh = self.thresholds.confirmation_threshold(delta_r=delta_r, threshold=1e-6)
+                    self.logger.info(f"s_min: {conf_thresh}")
+
+                    if successful_avg > conf_thresh:
+                        self.logger.info(f"confirmed block {oldest_id}")
+                        self.confirm_block(oldest_id)
+                        self.confirmation_delays.append([oldest_id, oldest_index, self.current_round - oldest_round]) # measured in rounds
+                        self.last_confirmation_delay = self.current_round - last_confirmed_block_round
                 
+                    else:
+                        block_confirmed = False
+
                 else:
                     block_confirmed = False
 
-            else:
-                block_confirmed = False
-
         if delta_r > 0 and oldest_index > 0:
-            fork_thresh = fork_threshold(total_stake=self.parameters.total_stake,
-                                    tau=self.parameters.tau,
-                                    delta_r=delta_r,
-                                    threshold=0.95)
+            fork_thresh = self.thresholds.fork_threshold(delta_r=delta_r, threshold=0.95)
 
             if successful_avg < fork_thresh:
                 self.fork_detected = True
                 self.forks_detected += 1
                 self.logger.info(f"fork detected!")
 
-    def _log_failed_verification(self, block: Block, reason: str):
+    def _log_failed_verification(self, block: BlockHeader, reason: str):
         self.logger.debug(f"failed to verify block {block.hash.hex()} ({reason})")
 
     # TODO: these two are stubs, we need to implement an actual search
@@ -154,7 +184,7 @@ class BlockChain:
     def lookup_total_stake(self) -> int:
         return self.parameters.total_stake
 
-    def validate_block(self, block: Block) -> Optional[int]:
+    def _verify_proof(self, block: BlockHeader, stake: int, success_probability: float) -> Optional[int]:
         pubkey = None
         try:
             pubkey = Ed25519PublicKey.from_public_bytes(block.owner_pubkey)
@@ -168,71 +198,176 @@ class BlockChain:
             self._log_failed_verification(block, "bad node_hash signature")
             return None
 
+        winning_tickets = run_sortition(block.signed_node_hash, stake, success_probability)
+        self.logger.debug(f"ran sortition for block {block.hash.hex()[0:7]} (p = {success_probability}); result = {winning_tickets}") 
+        return winning_tickets
+
+    def _proof_key(self, block: BlockHeader) -> tuple:
         stake = self.lookup_node_stake(block.owner_pubkey)
         total_stake = self.lookup_total_stake()
         success_probability = self.parameters.tau / total_stake
-        winning_tickets = run_sortition(block.signed_node_hash, stake, success_probability)
-        self.logger.debug(f"ran sortition for block {block.hash.hex()[0:7]} (p = {success_probability}); result = {winning_tickets}") 
+        # node_hash is part of the key so that a valid signature can't be
+        # replayed on a block with a different parent or round
+        return (block.owner_pubkey, block.signed_node_hash, block.node_hash, stake, success_probability)
+
+    def _cached_proof(self, key: tuple) -> tuple[bool, Optional[int]]:
+        with self.validation_lock:
+            if key not in self.validation_cache:
+                return False, None
+            self.validation_cache.move_to_end(key)
+            return True, self.validation_cache[key]
+
+    def _cache_proof(self, key: tuple, winning_tickets: Optional[int]):
+        with self.validation_lock:
+            self.validation_cache[key] = winning_tickets
+            self.validation_cache.move_to_end(key)
+            if len(self.validation_cache) > VALIDATION_CACHE_SIZE:
+                self.validation_cache.popitem(last=False)
+
+    def validate_block(self, block: BlockHeader) -> Optional[int]:
+        key = self._proof_key(block)
+        hit, winning_tickets = self._cached_proof(key)
+        if not hit:
+            _, _, _, stake, success_probability = key
+            winning_tickets = self._verify_proof(block, stake, success_probability)
+            self._cache_proof(key, winning_tickets)
+
+        if winning_tickets is None:
+            self._log_failed_verification(block, "invalid proof")
+            return None
         if winning_tickets == 0 or winning_tickets < block.ticket_number:
             self._log_failed_verification(block, "sortition failed")
             return None
         
         return winning_tickets
 
-    def _log_failed_insertion(self, block: Block, reason: str):
+    def validate_blocks(self, blocks: list[Block]) -> list[Optional[int]]:
+        """Same as calling validate_block on each block, but the proofs
+        that are not cached yet are verified concurrently."""
+        pending: dict[tuple, Block] = {}
+        for block in blocks:
+            key = self._proof_key(block)
+            if key not in pending and not self._cached_proof(key)[0]:
+                pending[key] = block
+
+        if len(pending) > 1:
+            executor = self._validation_executor()
+            futures = [executor.submit(self._verify_and_cache, block, key) for key, block in pending.items()]
+            for future in futures:
+                future.result()
+
+        # everything is cached by now, so this only checks the tickets
+        return [self.validate_block(block) for block in blocks]
+
+    def _validation_executor(self) -> ThreadPoolExecutor:
+        if self.validation_pool is None:
+            self.validation_pool = ThreadPoolExecutor(max_workers=self.validation_workers,
+                                                      thread_name_prefix="cpos-validation")
+        return self.validation_pool
+
+    def _verify_and_cache(self, block: BlockHeader, key: tuple) -> Optional[int]:
+        winning_tickets = self._verify_proof(block, key[3], key[4])
+        self._cache_proof(key, winning_tickets)
+        return winning_tickets
+
+    def prevalidate(self, block: BlockHeader) -> Future:
+        """Verifies the block's sortition proof on the validation pool, so
+        that a later validate_block (or insert) only hits the cache. The
+        returned future is already done if the proof was cached."""
+        key = self._proof_key(block)
+        hit, winning_tickets = self._cached_proof(key)
+        if hit:
+            future = Future()
+            future.set_result(winning_tickets)
+            return future
+        return self._validation_executor().submit(self._verify_and_cache, block, key)
+
+    def _log_failed_insertion(self, block: BlockHeader, reason: str):
         self.logger.info(f"discarding block {block.hash.hex()} ({reason})")
 
     def set_genesis_block(self, genesis: GenesisBlock) -> bool: # UNUSED
-        cursor = connection.cursor()
-        CHECK_NON_EMPTY_TABLE_QUERY = "SELECT EXISTS (SELECT 1 FROM localChains)" # returns (1,) or (0,)
-        cursor.execute(CHECK_NON_EMPTY_TABLE_QUERY)
-        for i in cursor: # Can be more clear with cursor.fetchone
-            if (i==(1,)): # already a block in the blockchain
-                self.logger.error(f"refusing to insert new genesis block")
-                return False
+        if not self.storage.is_empty(): # already a block in the blockchain
+            self.logger.error(f"refusing to insert new genesis block")
+            return False
         self.insert_genesis_block(genesis, 0, 1) # TODO CHECK ARRIVE TIME OF GENESIS BLOCK
-        connection.commit()
-        cursor.close()
 
         return True 
     
+    @contextmanager
+    def _mutation(self):
+        # every logical change to the chain is a single storage transaction;
+        # if one fails halfway, the chain index is rebuilt from what the
+        # storage rolled back to
+        try:
+            with self.storage.transaction():
+                yield
+        except Exception:
+            self.chain_index = ChainIndex.from_rows(self._with_current_num_suc(self.storage.all_rows()))
+            raise
+
+    def flush(self):
+        self.storage.flush()
+
     # try to insert a block at the end of the chain
     def insert(self, block: Block) -> bool:
+        with self._mutation():
+            return self._insert(block)
 
+    # runs every insertion check on the header alone; returns whether
+    # the block would be inserted and its number of winning tickets (if
+    # its sortition proof is valid)
+    def _check_insertion(self, block: BlockHeader) -> tuple[bool, Optional[int]]:
         if self.block_in_blockchain(block):
             self._log_failed_insertion(block, "already in local chain")
-            return False
+            return False, None
 
         if block.index == 0:
             self._log_failed_insertion(block, "new genesis block")
-            return False
+            return False, None
         
         if block.index > self.number_of_blocks():
             self._log_failed_insertion(block, "gap in local chain")
-            return False
+            return False, None
 
         if not self.has_correct_parent(block):
             self._log_failed_insertion(block, f"parent mismatch")
-            return False
+            return False, None
 
         winning_tickets = self.validate_block(block)
         if not winning_tickets:
             self._log_failed_insertion(block, "validation failed")
-            return False
-        else:
-            self.update_successfull_sortition(block.index, winning_tickets)
+            return False, None
 
         # in case there is already a block present at block.index
         if self.number_of_blocks() > block.index:
             if block.proof_hash <= self.get_proof_hash_of_block(block.index):
                 self._log_failed_insertion(block, f"smaller proof_hash")
-                return False
+                return False, winning_tickets
         
         # reject block if it was added in the same round as the parent
         parent_idx = block.index - 1
 
         if block.round <= self.get_round_of_block(parent_idx):
             self._log_failed_insertion(block, "same round as parent")
+            return False, winning_tickets
+
+        return True, winning_tickets
+
+    # whether insert() would accept the block with this header, i.e.
+    # whether its body is worth fetching
+    def accepts_header(self, header: BlockHeader) -> bool:
+        accepted, winning_tickets = self._check_insertion(header)
+        # a rejected block still counts as a successful sortition, just
+        # as in _insert; accepted ones are counted once they are inserted
+        if winning_tickets and not accepted:
+            self.update_successfull_sortition(header.index, winning_tickets)
+        return accepted
+
+    def _insert(self, block: Block) -> bool:
+        accepted, winning_tickets = self._check_insertion(block)
+        if winning_tickets:
+            self.update_successfull_sortition(block.index, winning_tickets)
+        if not accepted:
             return False
         
         self.logger.info(f"inserting {block}")
@@ -241,6 +376,10 @@ class BlockChain:
         return True
 
     def merge(self, foreign_blocks: list[Block]) -> bool:
+        with self._mutation():
+            return self._merge(foreign_blocks)
+
+    def _merge(self, foreign_blocks: list[Block]) -> bool:
         self.logger.info(f"starting merge process with fork: {foreign_blocks}")
         first_foreign_block = foreign_blocks[0]
 
@@ -253,6 +392,9 @@ class BlockChain:
         id, idx = id_and_idx
 
         self.logger.info(f"found common ancestor: {id}")  
+        # verify the whole fork up front, in parallel; the insertions
+        # below then only hit the validation cache
+        self.validate_blocks(foreign_blocks)
         # temporarily remove local fork from the chain
         # TODO from this point this function seems very optimizable
         original_local_subchain = self.blocks_since_index(idx + 1)
@@ -273,39 +415,22 @@ class BlockChain:
         return True
 
     def _dump_state(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT * FROM localChains ORDER BY block_index ASC")
-        for block in cursor:
+        for block in self.storage.all_rows():
             print(block)
-        connection.commit()
-        cursor.close()
 
     def _dump_indexes(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT block_index FROM localChains ORDER BY block_index ASC")
-        for index in cursor:
-            print(index)
-        connection.commit()
-        cursor.close()
+        for entry in self.chain_index.entries:
+            print((entry.index,))
     
     def _dump_block_hashes(self):
-        block_hashes = []
-        cursor = connection.cursor()
-        cursor.execute("SELECT hash FROM localChains ORDER BY block_index ASC")
-        for hash in cursor:
-            block_hashes.append(hash[0][0:min(len(hash[0]),8)])
-        connection.commit()
-        cursor.close()
+        block_hashes = [entry.hash.hex()[0:8] for entry in self.chain_index.entries]
         self.logger.info(f"current chain: {block_hashes}")
 
     def insert_block(self, block: Block, arrive_time: int, confirmed: int):
         database_atributes = [block.index, block.hash.hex(), block.round, block.parent_hash.hex(), block.hash.hex(), block.owner_pubkey.hex(), block.signed_node_hash.hex(), block.transaction_hash.hex(), block.ticket_number,
-                            block.transactions, arrive_time, 0, confirmed, 0, block.proof_hash.hex(), 0, 0] # TODO hash as id? TODO implement real merkle tree
-        cursor = connection.cursor()
-        INSERT_QUERY = "INSERT INTO localChains (block_index, id, round, parent_hash, hash, owner_pubkey, signed_node_hash, merkle_root, ticket_number, transactions, arrive_time, fork, confirmed, subuser, proof_hash, numSuc, round_stable) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        cursor.execute(INSERT_QUERY, database_atributes)
-        connection.commit()
-        cursor.close()
+                            block.transactions, arrive_time, 0, confirmed, 0, block.proof_hash.hex(), 0, 0] # TODO hash as id?
+        self.storage.insert_rows([database_atributes])
+        self.chain_index.append_row(database_atributes)
 
     def compose_block(self, block_info):
         # Receives a line from the database containing block info and returns a block with that info
@@ -322,155 +447,124 @@ class BlockChain:
 
     def insert_genesis_block(self, block: Block, arrive_time: int, confirmed: int):
         database_atributes = [block.index, block.hash.hex(), block.round, block.parent_hash.hex(), block.hash.hex(), block.owner_pubkey.hex(), block.signed_node_hash.hex(), block.transaction_hash.hex(), block.ticket_number,
-                              str([]), arrive_time, 0, confirmed, 0, block.proof_hash.hex(), 0, 0] # TODO hash as id? TODO implement real merkle tree
-        cursor = connection.cursor()
+                              str([]), arrive_time, 0, confirmed, 0, block.proof_hash.hex(), 0, 0] # TODO hash as id?
         self.logger.info(str(int.from_bytes(block.hash)))
-        INSERT_QUERY = "INSERT INTO localChains (block_index, id, round, parent_hash, hash, owner_pubkey, signed_node_hash, merkle_root, ticket_number, transactions, arrive_time, fork, confirmed, subuser, proof_hash, numSuc, round_stable) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        cursor.execute(INSERT_QUERY, database_atributes)
-        connection.commit()
-        cursor.close()
+        self.storage.insert_rows([database_atributes])
+        self.chain_index.append_row(database_atributes)
     
-    def block_in_blockchain(self, block: Block):
-        FIND_BLOCK_QUERY = "SELECT * FROM localChains WHERE id = %s LIMIT 1" # TODO hash as id?
-        cursor = connection.cursor()
-        cursor.execute(FIND_BLOCK_QUERY, [block.hash.hex()])
-        element = cursor.fetchone()
-        block_in_blockchain = (element != None)
-        cursor.close()
-        return block_in_blockchain
+    # The accessors below are answered by the in-memory chain index; only
+    # mutations (and full-row reads) go to the storage backend
+
+    def block_in_blockchain(self, block: BlockHeader):
+        return self.chain_index.contains(block.hash)
     
     def number_of_blocks(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) FROM localChains")
-        count = cursor.fetchone()[0]
-        cursor.close()
-        return count
-
-    def has_correct_parent(self, block: Block):
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT hash FROM localChains WHERE block_index = {block.index - 1}")
-        hash = bytes.fromhex(cursor.fetchone()[0])
-        cursor.close()
-        return hash == block.parent_hash
+        return len(self.chain_index)
+
+    def has_correct_parent(self, block: BlockHeader):
+        parent = self.chain_index.at(block.index - 1)
+        return parent is not None and parent.hash == block.parent_hash
 
     def delete_blocks_since(self, index: int):
-        cursor = connection.cursor()
-        cursor.execute(f"DELETE FROM localChains WHERE block_index >= {index}")
-        connection.commit()
-        cursor.close()
+        self.storage.delete_since(index)
+        self.chain_index.truncate(index)
     
     def last_confirmed_block_info(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT block_index, id, round FROM localChains WHERE confirmed = 1 ORDER BY block_index DESC LIMIT 1")
-        block_index, id, round = cursor.fetchone()
-        cursor.close()
-        id = bytes.fromhex(id)
-        return block_index, id, round
+        entry = self.chain_index.last_confirmed()
+        return entry.index, entry.hash, entry.round
     
     def last_block_id(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT id FROM localChains ORDER BY block_index DESC LIMIT 1")
-        id = bytes.fromhex(cursor.fetchone()[0])
-        cursor.close()
-        return id
+        return self.chain_index.last().hash
     
     def oldest_unconfirmed_block(self):
-        cursor = connection.cursor()
-        cursor.execute("SELECT block_index, id, numSuc, round FROM localChains WHERE confirmed = 0 ORDER BY block_index ASC LIMIT 1")
-        block_index, id, numSuc, round = cursor.fetchone()
-        id = bytes.fromhex(id)
-        cursor.close()
-        return block_index, id, numSuc, round
+        entry = self.chain_index.oldest_unconfirmed()
+        return entry.index, entry.hash, self.chain_index.num_suc(entry), entry.round
     
     def confirm_block(self, id):
-        cursor = connection.cursor()
-        cursor.execute(f'UPDATE localChains SET confirmed = 1 WHERE id = "{id.hex()}"')
-        connection.commit()
-        cursor.close()
+        entry = self.chain_index.confirm(id)
+        self.storage.confirm(id)
+        if entry is not None:
+            self.storage.set_num_suc([(entry.index, entry.num_suc)])
 
     def update_successfull_sortition(self, index, winning_tickets):
-        cursor = connection.cursor()
-        cursor.execute(f"UPDATE localChains SET numSuc = numSuc + {winning_tickets} WHERE block_index < {index} AND confirmed = 0")
-        connection.commit()
-        cursor.close()
+        # the numSuc column is written lazily (on confirmation and once per round)
+        self.chain_index.add_successful_sortition(index, winning_tickets)
+
+    def _with_current_num_suc(self, rows):
+        # the stored numSuc may lag behind the chain index; patch it in
+        rows = [list(row) for row in rows]
+        for row in rows:
+            entry = self.chain_index.of_hash(bytes.fromhex(row[ROW_HASH]))
+            if entry is not None:
+                row[ROW_NUM_SUC] = self.chain_index.num_suc(entry)
+        return rows
 
     def get_proof_hash_of_block(self, index):
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT proof_hash FROM localChains WHERE block_index = {index}")
-        proof_hash = bytes.fromhex(cursor.fetchone()[0])
-        cursor.close()
-        return proof_hash
+        return self.chain_index.at(index).proof_hash
     
     def get_round_of_block(self, index):
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT round FROM localChains WHERE block_index = {index}")
-        block_round = cursor.fetchone()[0]
-        cursor.close()
-        return block_round
+        return self.chain_index.at(index).round
     
-    def contains_in_db(self, block: Block): # TODO hash as id? OPTIMIZABLE WITH SQL COMMAND
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT hash FROM localChains")
-        for h in cursor:
-            hash = bytes.fromhex(h)
-            if hash == block.hash:
-                cursor.close()
-                return True
-        cursor.close()
-        return False
+    def contains_in_db(self, block: Block): # TODO hash as id?
+        return self.chain_index.contains(block.hash)
     
     def get_last_block_hash(self): # TODO hash as id?
-        cursor = connection.cursor()
-        cursor.execute("SELECT hash FROM localChains ORDER BY block_index DESC LIMIT 1")
-        block_hash = bytes.fromhex(cursor.fetchone()[0])
-        cursor.close()
-        return block_hash
+        return self.chain_index.last().hash
     
     def block_of_hash(self, hash):
         # Returns a two element list in format [id, block_index] or None
-        cursor = connection.cursor()
-        BLOCK_OF_HASH_QUERY = f'SELECT id, block_index FROM localChains WHERE hash = "{hash.hex()}" ORDER BY block_index ASC LIMIT 1'
-        cursor.execute(BLOCK_OF_HASH_QUERY)
-        info = cursor.fetchone()
-        if info != None:
-            info = list(info)
-            info[0] = bytes.fromhex(info[0])
-        cursor.close()
-        return info
+        entry = self.chain_index.of_hash(hash)
+        if entry is None:
+            return None
+        return [entry.hash, entry.index]
     
-    def blocks_since_index(self, index):
-        cursor = connection.cursor()
-        blocks_info = []
-        cursor.execute(f"SELECT * FROM localChains WHERE block_index >= {index} ORDER BY block_index")
-        for i in cursor:
-            blocks_info.append(i)
-        cursor.close()
-        return blocks_info
+    def blocks_since_index(self, index, count=None):
+        return self._with_current_num_suc(self.storage.rows_since(index, count))
+
+    def blocks_in_range(self, start_index: int, count: int) -> tuple[int, list[Block]]:
+        # Returns the absolute index of the first block and up to `count`
+        # blocks from there on; the genesis block is never included
+        if start_index < 0:
+            start_index = self.number_of_blocks() + start_index
+        start_index = max(start_index, 1)
+        if count <= 0:
+            return start_index, []
+        return start_index, [self.compose_block(block_info) for block_info in self.blocks_since_index(start_index, count)]
     
+    def block_locator(self) -> list[bytes]:
+        # Hashes of the last blocks of the chain, sparser the further back
+        # they go (as in Bitcoin's getblocks), always ending in the genesis
+        locator = []
+        step = 1
+        index = self.number_of_blocks() - 1
+        while index > 0:
+            locator.append(self.chain_index.at(index).hash)
+            if len(locator) >= LOCATOR_DENSE_BLOCKS:
+                step *= 2
+            index -= step
+        locator.append(self.chain_index.at(0).hash)
+        return locator
+
+    def find_common_ancestor(self, locator: list[bytes]) -> Optional[int]:
+        # Index of the most recent block of the locator that we also have
+        for hash in locator:
+            entry = self.chain_index.of_hash(hash)
+            if entry is not None:
+                return entry.index
+        return None
+
     def reintroduce_blocks(self, list_of_blocks_data):
-        cursor = connection.cursor()
+        self.storage.insert_rows(list_of_blocks_data)
         for block_data in list_of_blocks_data:
-            INSERT_QUERY = "INSERT INTO localChains (block_index, id, round, parent_hash, hash, owner_pubkey, signed_node_hash, merkle_root, ticket_number, transactions, arrive_time, fork, confirmed, subuser, proof_hash, numSuc, round_stable) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-            cursor.execute(INSERT_QUERY, block_data)
-        connection.commit()
-        cursor.close()
+            self.chain_index.append_row(block_data)
     
     def last_n_blocks(self, n):
         # Returns in the form of a list of blocks
-        cursor = connection.cursor()
-        block_list = []
-        cursor.execute(f"SELECT * FROM localChains ORDER BY block_index ASC LIMIT {n}")
-        for block_info in cursor:
-            block_list.append(self.compose_block(block_info))
-        cursor.close()
-        return block_list
+        return [self.compose_block(block_info) for block_info in self.storage.first_rows(n)]
 
     def block_by_index(self, block_index):
         # Returns in the form of a Block class
         if block_index < 0:
             block_index = self.number_of_blocks() + block_index
-        cursor = connection.cursor()
-        cursor.execute(f"SELECT * FROM localChains WHERE block_index = {block_index}")
-        block_info = cursor.fetchone()
-        cursor.close()
+        block_info = self.storage.row_at(block_index)
         return self.compose_block(block_info)
\ No newline at end of file
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from typing import Optional
+from cpos.util.fenwick import FenwickTree
+
+# column positions of a localChains row (see cpos/db/localBlockchain.sql)
+ROW_INDEX = 0
+ROW_ID = 1
+ROW_ROUND = 2
+ROW_PARENT_HASH = 3
+ROW_HASH = 4
+ROW_ARRIVE_TIME = 10
+ROW_CONFIRMED = 12
+ROW_PROOF_HASH = 14
+ROW_NUM_SUC = 15
+
+class ChainEntry:
+    """Subset of a localChains row that is needed to answer the hot-path
+    queries made by BlockChain (hashes are kept as raw bytes)."""
+
+    def __init__(self, index: int, hash: bytes, round: int, parent_hash: bytes,
+                 proof_hash: bytes, confirmed: int, num_suc: int):
+        self.index = index
+        self.hash = hash
+        self.round = round
+        self.parent_hash = parent_hash
+        self.proof_hash = proof_hash
+        self.confirmed = confirmed
+        # for confirmed blocks this is the final numSuc; for unconfirmed
+        # ones the live value is kept by ChainIndex (see ChainIndex.num_suc)
+        self.num_suc = num_suc
+        self.num_suc_base = 0
+
+    @classmethod
+    def from_row(cls, row) -> ChainEntry:
+        return cls(index=row[ROW_INDEX],
+                   hash=bytes.fromhex(row[ROW_HASH]),
+                   round=row[ROW_ROUND],
+                   parent_hash=bytes.fromhex(row[ROW_PARENT_HASH]),
+                   proof_hash=bytes.fromhex(row[ROW_PROOF_HASH]),
+                   confirmed=row[ROW_CONFIRMED],
+                   num_suc=row[ROW_NUM_SUC])
+
+    def __str__(self):
+        return f"ChainEntry(index={self.index}, hash={self.hash.hex()[0:8]}, round={self.round}, confirmed={self.confirmed}, numSuc={self.num_suc})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ChainIndex:
+    """In-memory view of the active chain, indexed both by block index and
+    by block hash. BlockChain writes through it on every mutation, so reads
+    never need to hit the database.
+
+    numSuc of the unconfirmed blocks is tracked with a Fenwick tree over a
+    difference array: a successful sortition for a block at index i adds
+    k to every block below i, which is recorded as +k at position 0 and
+    -k at position i. The numSuc of the block at index j is then the
+    prefix sum up to j, minus whatever the prefix sum already was when
+    that block joined the chain (num_suc_base). Both the update and the
+    query cost O(log n), regardless of how many blocks are unconfirmed.
+    """
+
+    def __init__(self):
+        self.entries: list[ChainEntry] = []
+        self.by_hash: dict[bytes, int] = {}
+        # blocks are confirmed oldest-first, so the confirmed blocks always
+        # form a prefix of the chain; this points right past that prefix
+        self.first_unconfirmed: int = 0
+        self.successes = FenwickTree()
+
+    @classmethod
+    def from_rows(cls, rows) -> ChainIndex:
+        index = cls()
+        for row in rows:
+            index.append_row(row)
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, entry: ChainEntry):
+        if entry.index != len(self.entries):
+            raise ValueError(f"chain index out of sync: appending block {entry.index} to a chain of length {len(self.entries)}")
+        if not entry.confirmed:
+            entry.num_suc_base = self.successes.prefix_sum(entry.index) - entry.num_suc
+        self.entries.append(entry)
+        # keep the lowest index in case the same hash shows up twice
+        self.by_hash.setdefault(entry.hash, entry.index)
+        if entry.confirmed and self.first_unconfirmed == entry.index:
+            self.first_unconfirmed += 1
+
+    def append_row(self, row):
+        self.append(ChainEntry.from_row(row))
+
+    def truncate(self, index: int):
+        index = max(index, 0)
+        for entry in self.entries[index:]:
+            if self.by_hash.get(entry.hash) == entry.index:
+                del self.by_hash[entry.hash]
+        del self.entries[index:]
+        self.first_unconfirmed = min(self.first_unconfirmed, len(self.entries))
+
+    def at(self, index: int) -> Optional[ChainEntry]:
+        if index < 0 or index >= len(self.entries):
+            return None
+        return self.entries[index]
+
+    def of_hash(self, hash: bytes) -> Optional[ChainEntry]:
+        index = self.by_hash.get(hash)
+        if index is None:
+            return None
+        return self.entries[index]
+
+    def contains(self, hash: bytes) -> bool:
+        return hash in self.by_hash
+
+    def last(self) -> ChainEntry:
+        return self.entries[-1]
+
+    def last_confirmed(self) -> Optional[ChainEntry]:
+        return self.at(self.first_unconfirmed - 1)
+
+    def oldest_unconfirmed(self) -> Optional[ChainEntry]:
+        return self.at(self.first_unconfirmed)
+
+    def num_suc(self, entry: ChainEntry) -> int:
+        if entry.confirmed:
+            return entry.num_suc
+        return self.successes.prefix_sum(entry.index) - entry.num_suc_base
+
+    def confirm(self, hash: bytes) -> Optional[ChainEntry]:
+        entry = self.of_hash(hash)
+        if entry is None:
+            return None
+        # freeze the counter; later sortitions no longer apply to it
+        entry.num_suc = self.num_suc(entry)
+        entry.confirmed = 1
+        while self.first_unconfirmed < len(self.entries) and self.entries[self.first_unconfirmed].confirmed:
+            self.first_unconfirmed += 1
+        return entry
+
+    def add_successful_sortition(self, index: int, winning_tickets: int):
+        # same semantics as "numSuc = numSuc + k WHERE block_index < index AND confirmed = 0"
+        self.successes.add(0, winning_tickets)
+        self.successes.add(index, -winning_tickets)
+
+    def unconfirmed_num_suc(self) -> list[tuple[int, int]]:
+        """(block_index, numSuc) of every unconfirmed block, for persisting."""
+        return [(entry.index, self.num_suc(entry)) for entry in self.entries[self.first_unconfirmed:]]
@@ -0,0 +1,143 @@
+from __future__ import annotations
+import heapq
+import itertools
+import threading
+from typing import Optional
+
+class TransactionState:
+    PENDING = 0x01
+    CHOSEN = 0x02
+
+# size of a transaction inside TransactionList.transactions, i.e. of its
+# repr in the str() of the list of rows
+def transaction_size(row: dict) -> int:
+    return len(repr(row).encode("utf-8"))
+
+# size of str(rows) given the sizes of the rows: brackets plus ", "
+# between rows
+def transactions_size(row_sizes: int, count: int) -> int:
+    return 2 + row_sizes + 2 * max(0, count - 1)
+
+class _Entry:
+    __slots__ = ("row", "value", "size", "state", "seq")
+
+    def __init__(self, row: dict, size: int, seq: int):
+        self.row = row
+        self.value = row["value"]
+        self.size = size
+        self.state = TransactionState.PENDING
+        self.seq = seq
+
+class Mempool:
+    """In-process pool of pending transactions (rows shaped like the ones in
+    the mempool database's transactions table).
+
+    Pending transactions are indexed by value in a max-heap, to fill blocks
+    with the most valuable ones, and in a min-heap, to evict the least
+    valuable one when the pool is full. Both heaps use lazy deletion: an
+    entry that was chosen, dropped or re-added is left in place and skipped
+    once it reaches the top, so every operation is O(log n) amortized.
+
+    reserve() marks the transactions of a block as chosen; they are then
+    either committed (dropped for good) or released back to the pending
+    set. All of it is guarded by a lock, so transactions can be added from
+    another thread."""
+
+    def __init__(self, capacity: int = 100000):
+        self.capacity = capacity
+        self.entries: dict[object, _Entry] = {}
+        self.pending_count = 0
+        self.by_value: list[tuple] = []
+        self.by_lowest_value: list[tuple] = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.pending_count
+
+    def __contains__(self, transaction_id) -> bool:
+        return transaction_id in self.entries
+
+    def _push(self, transaction_id, entry: _Entry):
+        entry.seq = next(self.counter)
+        heapq.heappush(self.by_value, (-entry.value, entry.seq, transaction_id))
+        heapq.heappush(self.by_lowest_value, (entry.value, entry.seq, transaction_id))
+
+    def _is_live(self, seq: int, transaction_id) -> bool:
+        entry = self.entries.get(transaction_id)
+        return entry is not None and entry.seq == seq and entry.state == TransactionState.PENDING
+
+    def _top(self, heap: list[tuple]) -> Optional[tuple]:
+        while heap and not self._is_live(heap[0][1], heap[0][2]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def add(self, row: dict) -> bool:
+        """Adds a pending transaction; returns False if it is already in the
+        pool or if the pool is full of more valuable ones."""
+        transaction_id = row["transaction_id"]
+        with self.lock:
+            if transaction_id in self.entries:
+                return False
+            if self.pending_count >= self.capacity:
+                lowest = self._top(self.by_lowest_value)
+                if lowest is None or lowest[0] >= row["value"]:
+                    return False
+                heapq.heappop(self.by_lowest_value)
+                del self.entries[lowest[2]]
+                self.pending_count -= 1
+            entry = _Entry(row, transaction_size(row), 0)
+            self.entries[transaction_id] = entry
+            self._push(transaction_id, entry)
+            self.pending_count += 1
+            self._compact()
+            return True
+
+    # keeps the heaps from filling up with stale entries
+    def _compact(self):
+        if max(len(self.by_value), len(self.by_lowest_value)) <= 2 * len(self.entries) + 64:
+            return
+        self.by_value = [(-e.value, e.seq, i) for i, e in self.entries.items() if e.state == TransactionState.PENDING]
+        self.by_lowest_value = [(e.value, e.seq, i) for i, e in self.entries.items() if e.state == TransactionState.PENDING]
+        heapq.heapify(self.by_value)
+        heapq.heapify(self.by_lowest_value)
+
+    def reserve(self, block_size: int) -> list[dict]:
+        """Marks the most valuable pending transactions that fit (as the
+        str() of their list) in `block_size` bytes as chosen, and returns
+        them; selection stops at the first one that doesn't fit."""
+        selected = []
+        row_sizes = 0
+        with self.lock:
+            while True:
+                top = self._top(self.by_value)
+                if top is None:
+                    break
+                entry = self.entries[top[2]]
+                if transactions_size(row_sizes + entry.size, len(selected) + 1) > block_size:
+                    break
+                heapq.heappop(self.by_value)
+                entry.state = TransactionState.CHOSEN
+                self.pending_count -= 1
+                row_sizes += entry.size
+                selected.append(entry.row)
+        return selected
+
+    def commit(self, transaction_ids: list):
+        """Drops chosen transactions that made it into the chain."""
+        with self.lock:
+            for transaction_id in transaction_ids:
+                entry = self.entries.get(transaction_id)
+                if entry is not None and entry.state == TransactionState.CHOSEN:
+                    del self.entries[transaction_id]
+
+    def release(self, transaction_ids: list):
+        """Makes chosen transactions pending again."""
+        with self.lock:
+            for transaction_id in transaction_ids:
+                entry = self.entries.get(transaction_id)
+                if entry is not None and entry.state == TransactionState.CHOSEN:
+                    entry.state = TransactionState.PENDING
+                    self.pending_count += 1
+                    self._push(transaction_id, entry)
+            self._compact()
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import random
+from collections import OrderedDict
+from typing import Optional
+from cpos.core.block import BlockHeader
+
+class MissedBlockStore:
+    """Blocks that could not be inserted into the local chain, and the
+    peers that sent them (candidates to resync with once a fork is
+    detected).
+
+    Each block is stored once, however many peers sent it, and each peer
+    is stored once, however many blocks it sent. Blocks are dropped once
+    they are more than `max_age` rounds old or when there are more than
+    `capacity` of them (oldest first); a peer goes away along with the
+    last of its blocks, or when it is picked for a resync."""
+
+    def __init__(self, capacity: int = 1024, max_age: int = 50, seed: Optional[int] = None):
+        self.capacity = capacity
+        self.max_age = max_age
+        # block hash -> (block, ids of the peers that sent it), in
+        # insertion order (which is roughly round order)
+        self.blocks: OrderedDict[bytes, tuple[BlockHeader, set[bytes]]] = OrderedDict()
+        # peer id -> number of stored blocks it sent; the ids of the peers
+        # that can still be picked are also kept in a list (along with
+        # their positions) for O(1) random picks
+        self.peer_blocks: dict[bytes, int] = {}
+        self.peers: list[bytes] = []
+        self.peer_position: dict[bytes, int] = {}
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, hash: bytes) -> bool:
+        return hash in self.blocks
+
+    def has_peers(self) -> bool:
+        return bool(self.peers)
+
+    def _add_peer(self, peer_id: bytes):
+        if peer_id not in self.peer_position:
+            self.peer_position[peer_id] = len(self.peers)
+            self.peers.append(peer_id)
+
+    def _remove_peer(self, peer_id: bytes):
+        position = self.peer_position.pop(peer_id, None)
+        if position is None:
+            return
+        # move the last peer into the freed slot
+        last = self.peers.pop()
+        if last != peer_id:
+            self.peers[position] = last
+            self.peer_position[last] = position
+
+    def add(self, block: BlockHeader, peer_id: bytes):
+        entry = self.blocks.get(block.hash)
+        if entry is None:
+            entry = (block, set())
+            self.blocks[block.hash] = entry
+        senders = entry[1]
+        if peer_id not in senders:
+            senders.add(peer_id)
+            self.peer_blocks[peer_id] = self.peer_blocks.get(peer_id, 0) + 1
+            self._add_peer(peer_id)
+        while len(self.blocks) > self.capacity:
+            self._evict_oldest()
+
+    def _evict_oldest(self):
+        _, (_, senders) = self.blocks.popitem(last=False)
+        for peer_id in senders:
+            count = self.peer_blocks.get(peer_id, 0) - 1
+            if count > 0:
+                self.peer_blocks[peer_id] = count
+            else:
+                self.peer_blocks.pop(peer_id, None)
+                self._remove_peer(peer_id)
+
+    def expire(self, current_round: int):
+        # blocks arrive roughly in round order, so the stale ones are
+        # (nearly all) at the front
+        while self.blocks:
+            block, _ = next(iter(self.blocks.values()))
+            if block.round >= current_round - self.max_age:
+                break
+            self._evict_oldest()
+
+    def pop_random_peer(self) -> Optional[bytes]:
+        """Picks a random peer that sent a missed block; it won't be
+        picked again unless it sends another one."""
+        if not self.peers:
+            return None
+        peer_id = self.peers[self.random.randrange(len(self.peers))]
+        self._remove_peer(peer_id)
+        return peer_id
+
+    def clear(self):
+        self.blocks.clear()
+        self.peer_blocks.clear()
+        self.peers.clear()
+        self.peer_position.clear()
@@ -0,0 +1,84 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Optional
+
+class PendingRequests:
+    """Blocks (or block bodies) asked from a peer that didn't arrive yet,
+    along with every other peer that offered them.
+
+    A request that isn't answered within `timeout` seconds (or that the
+    peer fails to answer) moves on to the next peer that offered the
+    block; once no peer is left, the request is dropped, so that the next
+    offer starts a new one. At most `capacity` requests are kept (oldest
+    dropped first)."""
+
+    def __init__(self, capacity: int = 1024, timeout: float = 1.0):
+        self.capacity = capacity
+        self.timeout = timeout
+        # hash -> [item, peer asked, peers left to ask, time of the request],
+        # in order of request time
+        self.requests: OrderedDict[bytes, list] = OrderedDict()
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __contains__(self, hash: bytes) -> bool:
+        return hash in self.requests
+
+    def request(self, hash: bytes, peer_id: bytes, now: float, item: Any = None):
+        self.requests[hash] = [item, peer_id, [], now]
+        self.requests.move_to_end(hash)
+        while len(self.requests) > self.capacity:
+            self.requests.popitem(last=False)
+
+    def add_source(self, hash: bytes, peer_id: bytes) -> bool:
+        """Records another peer that offered the block; returns False if
+        the block isn't being requested."""
+        entry = self.requests.get(hash)
+        if entry is None:
+            return False
+        if peer_id != entry[1] and peer_id not in entry[2]:
+            entry[2].append(peer_id)
+        return True
+
+    def get(self, hash: bytes) -> Optional[tuple[Any, bytes]]:
+        """The item of a request and the peer that was asked last."""
+        entry = self.requests.get(hash)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def pop(self, hash: bytes) -> Optional[tuple[Any, bytes]]:
+        """Removes an answered request; returns its item and the peer that
+        was asked."""
+        entry = self.requests.pop(hash, None)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    def fail(self, hash: bytes, now: float) -> Optional[tuple[Any, bytes]]:
+        """Moves the request on to the next peer that offered the block,
+        returning its item and that peer, or drops it if none is left."""
+        entry = self.requests.get(hash)
+        if entry is None:
+            return None
+        if not entry[2]:
+            del self.requests[hash]
+            return None
+        entry[1] = entry[2].pop(0)
+        entry[3] = now
+        self.requests.move_to_end(hash)
+        return entry[0], entry[1]
+
+    def expire(self, now: float) -> list[tuple[bytes, Any, bytes]]:
+        """Moves every request older than the timeout on to its next peer;
+        returns (hash, item, peer) for each request to send again."""
+        retries = []
+        while self.requests:
+            hash, entry = next(iter(self.requests.items()))
+            if now - entry[3] < self.timeout:
+                break
+            retry = self.fail(hash, now)
+            if retry is not None:
+                retries.append((hash, *retry))
+        return retries
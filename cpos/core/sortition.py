@@ -1,4 +1,11 @@
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import accumulate
+import json
+import math
+import os
+import numpy as np
 from hashlib import sha256
 from cpos.core.block import GenesisBlock, Block
 from cpos.core.transactions import TransactionList
@@ -16,13 +23,73 @@ def binomial(n: int, p: int):
         denominator *= i
     return numerator/denominator
 
+def _check_probability(p: float):
+    if not 0.0 <= p <= 1.0:
+        raise ValueError(f"Invalid success probability: {p}")
+
+# The binomial PMF is evaluated in log space (through log-gamma), so
+# that neither the coefficient nor p^k (1-p)^(n-k) over/underflow for
+# stakes in the hundreds of thousands
+def log_binomial_pmf(n: int, k: int, p: float) -> float:
+    _check_probability(p)
+    if k < 0 or k > n:
+        return -math.inf
+    if p == 0.0:
+        return 0.0 if k == 0 else -math.inf
+    if p == 1.0:
+        return 0.0 if k == n else -math.inf
+    return (math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+            + k * math.log(p) + (n - k) * math.log1p(-p))
+
+def binomial_pmf(n: int, k: int, p: float) -> float:
+    return math.exp(log_binomial_pmf(n, k, p))
+
 def cumulative_binom_dist(n: int, k: int, p: float) -> float:
-    # TODO: handle overflow errors here
     sum = 0
-    for i in range(0, k+1):
-        sum += binomial(n, i) * (p ** i) * ((1-p) ** (n-i))
+    for i in range(0, min(k, n)+1):
+        sum += binomial_pmf(n, i, p)
     return sum
 
+def binomial_cdf(n: int, p: float) -> np.ndarray:
+    """Returns the whole CDF of Binomial(n, p) as an array of n+1 values,
+    computed in a single vectorized pass."""
+    _check_probability(p)
+    k = np.arange(n + 1)
+    if p == 0.0 or p == 1.0:
+        pmf = np.zeros(n + 1)
+        pmf[0 if p == 0.0 else n] = 1.0
+        return np.cumsum(pmf)
+    # log(i!) for i = 0..n
+    log_factorial = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, n + 1)))))
+    log_pmf = (log_factorial[n] - log_factorial[k] - log_factorial[n - k]
+               + k * math.log(p) + (n - k) * math.log1p(-p))
+    return np.cumsum(np.exp(log_pmf))
+
+def _cdf_at(cdf: np.ndarray, k: int) -> float:
+    if k < 0:
+        return 0.0
+    return float(cdf[min(k, len(cdf) - 1)])
+
+# CDF of Binomial(stake, p) as a tuple of partial sums. Every node has to
+# draw the same number of tickets for the same hash, so the terms are the
+# exact products binomial(n, i) * p^i * (1-p)^(n-i) the sortition always
+# used, added in the same order; only the terms whose coefficient doesn't
+# fit in a float (where that product used to overflow) come from log space
+@lru_cache(maxsize=1024)
+def _sortition_cdf(stake: int, p: float) -> tuple[float, ...]:
+    _check_probability(p)
+    terms = []
+    coefficient = 1
+    for i in range(stake + 1):
+        if i > 0:
+            coefficient = coefficient * (stake - i + 1) // i
+        try:
+            # float() of the exact coefficient rounds like binomial() does
+            terms.append(float(coefficient) * (p ** i) * ((1-p) ** (stake-i)))
+        except OverflowError:
+            terms.append(binomial_pmf(stake, i, p))
+    return tuple(accumulate(terms))
+
 """Runs a sortition.
 
 Args:
@@ -43,22 +110,19 @@ def run_sortition(signed_node_hash: bytes, stake: int,
     q = numerical_hash / (1 << bit_length)
     # print(q)
 
-    i = 0
-    while q > cumulative_binom_dist(stake, i, success_probability):
-        # print(f"i = {i}, q > cumulative_binom_dist({stake}, {i}, {success_probability}) = {cumulative_binom_dist(stake, i , success_probability)}")
-        i += 1
-
-    # print(f"result: {i}")
-    return i
+    # smallest i such that q <= cumulative_binom_dist(stake, i, p), found by
+    # binary search over the cached CDF; the CDF may fall short of 1.0 by
+    # rounding, so never go past the stake
+    cdf = _sortition_cdf(stake, success_probability)
+    return min(bisect_left(cdf, q), stake)
 
 def confirmation_threshold(total_stake: int, tau: int, delta_r: int, threshold: float):
-    # TODO: When the stake is high (1e4 or 1e5 for example), cumulative_binom_dist() can break, because in the funciton binomial() the numbers get too big. Deal with that somehow. 
-    # This doesnt seem to be an edge case. With a big network we might have to deal with stakes in the thousands
     s = 1
     p = tau / total_stake
+    cdf = binomial_cdf(total_stake*delta_r, p)
     while True:
         k = min(((2*delta_r) * s) - 1, total_stake*delta_r)
-        chance = 1 - cumulative_binom_dist(total_stake*delta_r, k, p)
+        chance = 1 - _cdf_at(cdf, k)
         # print(f"s = {s} => fork chance = {chance}")
 
         if chance <= threshold:
@@ -70,13 +134,14 @@ def confirmation_threshold(total_stake: int, tau: int, delta_r: int, threshold:
 def fork_threshold(total_stake: int, tau: int, delta_r: int, threshold: float = 0.95):
     a = tau
     p = tau / total_stake
+    cdf = binomial_cdf(total_stake * delta_r, p)
     while True:
         # We want to be 95% sure that the average number of successful draws is >= a
         # a * delta_r => we expect a * delta_r successful draws in W * delta_r draws => average of a draws per round
         # Probability of having at least a * delta_r successful draws in total_stake * delta_r draws
         # Pr(successful draws >= a * delta_r) = 1 - Pr(successful draws < a * delta_r - 1)
         k = min((a) * delta_r - 1, total_stake * delta_r)
-        chance = 1 - cumulative_binom_dist(total_stake * delta_r, k, p)
+        chance = 1 - _cdf_at(cdf, k)
         # print(f"chance: {chance}")
         
         if chance >= threshold:
@@ -85,6 +150,67 @@ def fork_threshold(total_stake: int, tau: int, delta_r: int, threshold: float =
             a -= 1
     return a
 
+class ThresholdTable:
+    """Memoized confirmation/fork thresholds for a given (total_stake, tau).
+
+    Both thresholds only depend on (total_stake, tau, delta_r, epsilon),
+    so each value is computed at most once. Entries are filled lazily
+    (or eagerly with precompute()) and can be saved to and loaded from a
+    JSON file, so that restarted nodes skip the numeric search altogether.
+    """
+
+    def __init__(self, total_stake: int, tau: int):
+        self.total_stake = total_stake
+        self.tau = tau
+        self.confirmation: dict[tuple[int, float], int] = {}
+        self.fork: dict[tuple[int, float], int] = {}
+        self.dirty = False
+
+    def confirmation_threshold(self, delta_r: int, threshold: float) -> int:
+        key = (delta_r, threshold)
+        if key not in self.confirmation:
+            self.confirmation[key] = confirmation_threshold(self.total_stake, self.tau, delta_r, threshold)
+            self.dirty = True
+        return self.confirmation[key]
+
+    def fork_threshold(self, delta_r: int, threshold: float = 0.95) -> int:
+        key = (delta_r, threshold)
+        if key not in self.fork:
+            self.fork[key] = fork_threshold(self.total_stake, self.tau, delta_r, threshold)
+            self.dirty = True
+        return self.fork[key]
+
+    def precompute(self, max_delta_r: int, confirmation_epsilon: float = 1e-6, fork_epsilon: float = 0.95):
+        for delta_r in range(1, max_delta_r + 1):
+            self.confirmation_threshold(delta_r, confirmation_epsilon)
+            self.fork_threshold(delta_r, fork_epsilon)
+
+    def save(self, path: str):
+        data = {
+            "total_stake": self.total_stake,
+            "tau": self.tau,
+            "confirmation": [[delta_r, eps, s] for (delta_r, eps), s in self.confirmation.items()],
+            "fork": [[delta_r, eps, a] for (delta_r, eps), a in self.fork.items()],
+        }
+        with open(path, "w") as file:
+            json.dump(data, file)
+        self.dirty = False
+
+    def load(self, path: str) -> bool:
+        """Merge a table saved by save(); returns False (and loads nothing)
+        if the file is missing or was computed for other parameters."""
+        if not os.path.exists(path):
+            return False
+        with open(path) as file:
+            data = json.load(file)
+        if data.get("total_stake") != self.total_stake or data.get("tau") != self.tau:
+            return False
+        for delta_r, eps, s in data.get("confirmation", []):
+            self.confirmation[(delta_r, eps)] = s
+        for delta_r, eps, a in data.get("fork", []):
+            self.fork[(delta_r, eps)] = a
+        return True
+
 def main():
     total_stake = 8
     tau = 4
@@ -0,0 +1,317 @@
+from __future__ import annotations
+import os
+import sqlite3
+import mysql.connector
+from contextlib import contextmanager
+from typing import Optional
+from cpos.core.chainindex import ROW_INDEX, ROW_ID, ROW_CONFIRMED, ROW_NUM_SUC
+
+HOST = "localhost"
+USER = "CPoS"
+PASSWORD = "CPoSPW"
+DATABASE = "localBlockchain"
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "db", "localBlockchain.sql")
+COLUMNS = ("block_index", "id", "round", "parent_hash", "hash", "owner_pubkey", "signed_node_hash", "merkle_root", "ticket_number",
+           "transactions", "arrive_time", "fork", "confirmed", "subuser", "proof_hash", "numSuc", "round_stable")
+
+class StorageError(Exception):
+    pass
+
+class BlockStorage:
+    """Durable storage for the rows of the localChains table.
+
+    Rows are sequences laid out as in COLUMNS. BlockChain only talks to
+    this interface, so the backing engine can be swapped per node.
+
+    Writes issued inside transaction() are applied atomically. Outside
+    of one, every write is committed on its own. With group_commit set,
+    nothing is committed until flush() is called (BlockChain does it
+    once per round), so a whole round costs a single fsync.
+    """
+
+    group_commit: bool = False
+    _depth: int = 0
+
+    @contextmanager
+    def transaction(self):
+        # nested calls simply join the outermost transaction
+        outermost = self._depth == 0
+        if outermost:
+            self._begin()
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if outermost:
+                self._rollback()
+            raise
+        self._depth -= 1
+        if outermost:
+            self._end()
+            if not self.group_commit:
+                self.flush()
+
+    def _after_write(self):
+        if self._depth == 0 and not self.group_commit:
+            self.flush()
+
+    def _begin(self):
+        pass
+
+    def _end(self):
+        pass
+
+    def _rollback(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def insert_rows(self, rows: list):
+        raise NotImplementedError
+
+    def delete_since(self, index: int):
+        raise NotImplementedError
+
+    def confirm(self, id: bytes):
+        raise NotImplementedError
+
+    def set_num_suc(self, values: list[tuple[int, int]]):
+        """Store the given (block_index, numSuc) pairs."""
+        raise NotImplementedError
+
+    def row_at(self, index: int) -> Optional[tuple]:
+        raise NotImplementedError
+
+    def rows_since(self, index: int, limit: Optional[int] = None) -> list[tuple]:
+        raise NotImplementedError
+
+    def first_rows(self, n: int) -> list[tuple]:
+        raise NotImplementedError
+
+    def all_rows(self) -> list[tuple]:
+        return self.rows_since(0)
+
+    def is_empty(self) -> bool:
+        return self.row_at(0) is None
+
+    def close(self):
+        self.flush()
+
+
+class SQLStorage(BlockStorage):
+    """Shared implementation for DB-API engines; subclasses only provide
+    the connection and the parameter placeholder used by the driver.
+
+    A logical mutation is wrapped in a savepoint, so a failure rolls back
+    that mutation alone even when earlier ones are still waiting for the
+    group commit."""
+
+    placeholder = "%s"
+    SAVEPOINT = "cpos_mutation"
+
+    def __init__(self, connection, group_commit: bool = False):
+        self.connection = connection
+        self.group_commit = group_commit
+        values = ", ".join([self.placeholder] * len(COLUMNS))
+        self.insert_query = f"INSERT INTO localChains ({', '.join(COLUMNS)}) VALUES ({values})"
+
+    def _raw(self, query: str):
+        cursor = self.connection.cursor()
+        cursor.execute(query)
+        cursor.close()
+
+    def _begin(self):
+        self._raw(f"SAVEPOINT {self.SAVEPOINT}")
+
+    def _end(self):
+        self._raw(f"RELEASE SAVEPOINT {self.SAVEPOINT}")
+
+    def _rollback(self):
+        self._raw(f"ROLLBACK TO SAVEPOINT {self.SAVEPOINT}")
+        self._raw(f"RELEASE SAVEPOINT {self.SAVEPOINT}")
+
+    def flush(self):
+        self.connection.commit()
+
+    def _execute(self, query: str, params=()):
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        cursor.close()
+        self._after_write()
+
+    def _fetch(self, query: str, params=()) -> list[tuple]:
+        cursor = self.connection.cursor()
+        cursor.execute(query, params)
+        rows = [tuple(row) for row in cursor.fetchall()]
+        cursor.close()
+        return rows
+
+    def insert_rows(self, rows: list):
+        cursor = self.connection.cursor()
+        cursor.executemany(self.insert_query, [tuple(row) for row in rows])
+        cursor.close()
+        self._after_write()
+
+    def delete_since(self, index: int):
+        self._execute(f"DELETE FROM localChains WHERE block_index >= {self.placeholder}", (index,))
+
+    def confirm(self, id: bytes):
+        self._execute(f"UPDATE localChains SET confirmed = 1 WHERE id = {self.placeholder}", (id.hex(),))
+
+    def set_num_suc(self, values: list[tuple[int, int]]):
+        if not values:
+            return
+        cursor = self.connection.cursor()
+        cursor.executemany(f"UPDATE localChains SET numSuc = {self.placeholder} WHERE block_index = {self.placeholder}",
+                           [(num_suc, index) for index, num_suc in values])
+        cursor.close()
+        self._after_write()
+
+    def row_at(self, index: int) -> Optional[tuple]:
+        rows = self._fetch(f"SELECT * FROM localChains WHERE block_index = {self.placeholder}", (index,))
+        return rows[0] if rows else None
+
+    def rows_since(self, index: int, limit: Optional[int] = None) -> list[tuple]:
+        query = f"SELECT * FROM localChains WHERE block_index >= {self.placeholder} ORDER BY block_index"
+        if limit is None:
+            return self._fetch(query, (index,))
+        return self._fetch(f"{query} LIMIT {self.placeholder}", (index, limit))
+
+    def first_rows(self, n: int) -> list[tuple]:
+        return self._fetch(f"SELECT * FROM localChains ORDER BY block_index ASC LIMIT {self.placeholder}", (n,))
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class MariaDBStorage(SQLStorage):
+    def __init__(self, host: str = HOST, user: str = USER, password: str = PASSWORD, database: str = DATABASE,
+                 group_commit: bool = False):
+        try:
+            connection = mysql.connector.connect(
+                host=host,
+                user=user,
+                password=password,
+                database=database
+            )
+        except mysql.connector.Error as err:
+            raise StorageError(f"failed to connect to the MariaDB database: {err}") from err
+
+        if connection.is_connected():
+            print("Connected to the MariaDB database!")
+        super().__init__(connection, group_commit)
+
+
+class SQLiteStorage(SQLStorage):
+    placeholder = "?"
+
+    def __init__(self, path: str = ":memory:", group_commit: bool = False):
+        connection = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets readers (e.g. data dumps) proceed while the node writes
+        # and only fsyncs on checkpoints instead of on every commit
+        if path != ":memory:":
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        with open(SCHEMA_PATH) as schema:
+            connection.executescript(schema.read())
+        super().__init__(connection, group_commit)
+
+    def _begin(self):
+        # a savepoint opened outside of a transaction would commit on
+        # release, so make sure there is an enclosing one
+        if not self.connection.in_transaction:
+            self._raw("BEGIN")
+        super()._begin()
+
+
+class MemoryStorage(BlockStorage):
+    """Non-durable storage, mostly useful for simulations and tests.
+
+    Transactions keep an undo log: the chain length when they began and
+    a copy of every older row the first time it is changed or deleted,
+    so rolling back costs as much as the transaction itself."""
+
+    def __init__(self, group_commit: bool = False):
+        self.rows: list[list] = []
+        self.group_commit = group_commit
+        self._saved_length = 0
+        self._saved_rows: Optional[dict[int, list]] = None
+
+    def _begin(self):
+        self._saved_length = len(self.rows)
+        self._saved_rows = {}
+
+    def _end(self):
+        self._saved_rows = None
+
+    def _rollback(self):
+        del self.rows[self._saved_length:]
+        for index in range(len(self.rows), self._saved_length):
+            self.rows.append(self._saved_rows[index])
+        for index, row in self._saved_rows.items():
+            self.rows[index] = row
+        self._saved_rows = None
+
+    # keeps the original of a row about to be changed, if in a transaction
+    def _save(self, index: int):
+        if self._saved_rows is not None and index < self._saved_length and index not in self._saved_rows:
+            self._saved_rows[index] = list(self.rows[index])
+
+    def insert_rows(self, rows: list):
+        for row in rows:
+            row = list(row)
+            if row[ROW_INDEX] != len(self.rows):
+                raise StorageError(f"cannot insert block {row[ROW_INDEX]} into a chain of length {len(self.rows)}")
+            self.rows.append(row)
+
+    def delete_since(self, index: int):
+        index = max(index, 0)
+        for i in range(index, min(len(self.rows), self._saved_length)):
+            self._save(i)
+        del self.rows[index:]
+
+    def confirm(self, id: bytes):
+        id = id.hex()
+        for i, row in enumerate(self.rows):
+            if row[ROW_ID] == id:
+                self._save(i)
+                row[ROW_CONFIRMED] = 1
+
+    def set_num_suc(self, values: list[tuple[int, int]]):
+        for index, num_suc in values:
+            if index < len(self.rows):
+                self._save(index)
+                self.rows[index][ROW_NUM_SUC] = num_suc
+
+    def row_at(self, index: int) -> Optional[tuple]:
+        if index < 0 or index >= len(self.rows):
+            return None
+        return tuple(self.rows[index])
+
+    def rows_since(self, index: int, limit: Optional[int] = None) -> list[tuple]:
+        index = max(index, 0)
+        stop = index + limit if limit is not None else None
+        return [tuple(row) for row in self.rows[index:stop]]
+
+    def first_rows(self, n: int) -> list[tuple]:
+        return [tuple(row) for row in self.rows[:n]]
+
+
+STORAGE_BACKENDS = ("mariadb", "sqlite", "memory")
+
+def create_storage(backend: str, node_id: Optional[bytes] = None, path: Optional[str] = None,
+                   group_commit: bool = False) -> BlockStorage:
+    if backend == "mariadb":
+        return MariaDBStorage(group_commit=group_commit)
+    if backend == "sqlite":
+        if path is None:
+            suffix = f"_{node_id.hex()[0:8]}" if node_id is not None else ""
+            path = f"localBlockchain{suffix}.db"
+        return SQLiteStorage(path, group_commit=group_commit)
+    if backend == "memory":
+        return MemoryStorage(group_commit=group_commit)
+    raise ValueError(f"unknown storage backend: {backend} (expected one of {STORAGE_BACKENDS})")
@@ -1,23 +1,122 @@
 from __future__ import annotations
-import base64
 import mysql.connector
 import pickle
+import re
 import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from mysql.connector.pooling import MySQLConnectionPool
+from hashlib import sha256
+from typing import Optional
+from cpos.core.mempool import Mempool
+from cpos.util.merkle import IncrementalMerkleTree
+
+# hash of a transaction as committed to by the Merkle root, from its
+# repr (which is how it appears in TransactionList.transactions)
+def transaction_leaf(transaction_repr: str) -> bytes:
+    return sha256(transaction_repr.encode("utf-8")).digest()
+
+# characters that matter when splitting a list of transactions
+_SPLIT_TOKENS = re.compile(r"""[\[\](){},'"]""")
+
+# the reprs of the transactions in the str() of a list of transactions,
+# or None if it isn't one; this only tracks quotes and brackets in a
+# single pass (no parser, no recursion), so any string a peer sends is
+# split in linear time, the same way on every node
+def split_transactions(transactions: str) -> Optional[list[str]]:
+    if len(transactions) < 2 or transactions[0] != "[" or transactions[-1] != "]":
+        return None
+    items = []
+    depth = 0
+    start = 1
+    position = 0
+    while True:
+        match = _SPLIT_TOKENS.search(transactions, position)
+        if match is None:
+            return None
+        token = match.group()
+        position = match.end()
+        if token in "'\"":
+            # skip to the closing quote (one that isn't escaped)
+            while True:
+                close = transactions.find(token, position)
+                if close < 0:
+                    return None
+                backslashes = 0
+                while transactions[close - 1 - backslashes] == "\\":
+                    backslashes += 1
+                position = close + 1
+                if backslashes % 2 == 0:
+                    break
+        elif token in "[({":
+            depth += 1
+        elif token in "])}":
+            depth -= 1
+            if depth == 0:
+                # the outer list has to end the string
+                if position != len(transactions):
+                    return None
+                break
+        elif depth == 1:
+            items.append(transactions[start:match.start()])
+            start = position
+    last = transactions[start:-1]
+    if items or last.strip():
+        items.append(last)
+    # str() separates the elements with ", "
+    return [item[1:] if item.startswith(" ") else item for item in items]
+
+# leaf hashes of the transactions in the str() of a list of transactions;
+# the elements are cut out of the text rather than evaluated, so that any
+# repr (e.g. of datetimes from the database) hashes the same on every
+# node; anything but a list counts as a single transaction
+def transaction_leaves(transactions: str) -> list[bytes]:
+    items = split_transactions(transactions)
+    if items is None:
+        return [transaction_leaf(transactions)]
+    return [transaction_leaf(item) for item in items]
 
 class TransactionList:
+    """Transactions of a block, kept as the str() of a list of
+    transactions; get_hash() is the Merkle root over their hashes (or
+    b"\x00" if there are none)."""
+
     def __init__(self):
         self.data = b""
         self.transactions = str([])
+        self.tree: Optional[IncrementalMerkleTree] = None
         pass
     def serialize(self) -> bytes:
         pass
     @classmethod
     def deserialize(cls, raw: bytes) -> TransactionList:
         pass
+    def _set_rows(self, rows: list):
+        self.transactions = str(rows)
+        self.tree = IncrementalMerkleTree(transaction_leaf(repr(row)) for row in rows)
+    def _merkle_tree(self) -> IncrementalMerkleTree:
+        # built on first use, since the received lists only need the root
+        if getattr(self, "tree", None) is None:
+            self.tree = IncrementalMerkleTree(transaction_leaves(self.transactions))
+        return self.tree
     def get_hash(self) -> bytes:
-        return b"\x00"
+        tree = self._merkle_tree()
+        return tree.root() if len(tree) else b"\x00"
     def set_transactions(self, transactions: str):
         self.transactions = transactions
+        self.tree = None
+    def append(self, transaction):
+        tree = self._merkle_tree()
+        transaction_repr = repr(transaction)
+        if len(tree):
+            self.transactions = self.transactions[:-1] + ", " + transaction_repr + "]"
+        else:
+            self.transactions = "[" + transaction_repr + "]"
+        tree.append(transaction_leaf(transaction_repr))
+    def proof(self, index: int) -> list[bytes]:
+        """Inclusion proof of the index-th transaction against get_hash()
+        (see IncrementalMerkleTree.verify)."""
+        return self._merkle_tree().proof(index)
 
 # generating random bytes: https://bobbyhadz.com/blog/python-generate-random-bytes
 # encoding binary data with base64: https://stackabuse.com/encoding-and-decoding-base64-strings-in-python/
@@ -32,47 +131,114 @@ DATABASE = "mempool"
 RETRIEVE_QUERY = "SELECT * FROM transactions WHERE committed = 0 and chosen = 0 ORDER BY value DESC LIMIT 200"
 BLOCK_SIZE = 199000     # 200kb - ~1kB of header
 
-class MockTransactionList(TransactionList):
-    def __init__(self):
-        try:
-            connection = mysql.connector.connect(
-                host=HOST,
-                user=USER,
-                password=PASSWORD,
-                database=DATABASE
-            )
-            cursor = connection.cursor(dictionary=True, buffered=True)
-            cursor.execute(RETRIEVE_QUERY)
+# picks the most valuable transactions (rows come ordered by value) that
+# fit in a block
+def select_transactions(rows: list[dict], block_size: int = BLOCK_SIZE) -> list[dict]:
+    selected = []
+    totalSize = 0
+    for row in rows:
+        totalSize += sum([sys.getsizeof(row[tuplePosition]) for tuplePosition in row.keys()])
+        if totalSize > block_size:
+            break
+        selected.append(row)
+    return selected
 
-            self.transactions_list = []
-            transaction_ids = []
-            totalSize = 0
+class MempoolClient:
+    """Long-lived access to the mempool database.
 
-            result_set = cursor.fetchall()
+    Connections come from a pool that is created once (on first use), and
+    the candidates for the next block are fetched in the background: every
+    take() hands out a block's worth of the prefetched transactions, then
+    marks them as chosen and fetches the next candidates on a worker
+    thread, so building a transaction list doesn't wait on the database.
+    The candidates are therefore as old as the previous take()."""
 
-            for row in result_set:
-                totalSize += sum([sys.getsizeof(row[tuplePosition]) for tuplePosition in row.keys()])
-                if totalSize > BLOCK_SIZE:
-                    break
-                self.transactions_list.append(row)
-                transaction_ids.append(row['transaction_id'])
+    def __init__(self, host: str = HOST, user: str = USER, password: str = PASSWORD, database: str = DATABASE,
+                 pool_size: int = 2, block_size: int = BLOCK_SIZE):
+        self.config = dict(host=host, user=user, password=password, database=database)
+        self.pool_size = pool_size
+        self.block_size = block_size
+        self.pool: Optional[MySQLConnectionPool] = None
+        self.pool_lock = threading.Lock()
+        # a single worker keeps the updates and the prefetches in order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cpos-mempool")
+        self.prefetched: Optional[Future] = None
+        # transactions handed out but not marked as chosen in the database
+        # yet; they are sent along with every fetch until one goes through
+        self.unmarked_ids: list = []
 
-            format_strings = ','.join(['%s'] * len(transaction_ids))
-            PATCH_QUERY = f"UPDATE transactions SET chosen = 1 WHERE transaction_id IN ({format_strings})"
-            cursor.execute(PATCH_QUERY, transaction_ids)
-            connection.commit()
+    def _connect(self):
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = MySQLConnectionPool(pool_name=f"cpos-mempool-{id(self)}", pool_size=self.pool_size, **self.config)
+        return self.pool.get_connection()
 
+    # marks the given transactions as chosen, then returns the candidates
+    # for the next block
+    def _fetch(self, chosen_ids: list) -> list[dict]:
+        connection = self._connect()
+        try:
+            cursor = connection.cursor(dictionary=True, buffered=True)
+            if chosen_ids:
+                format_strings = ','.join(['%s'] * len(chosen_ids))
+                PATCH_QUERY = f"UPDATE transactions SET chosen = 1 WHERE transaction_id IN ({format_strings})"
+                cursor.execute(PATCH_QUERY, chosen_ids)
+                connection.commit()
+            cursor.execute(RETRIEVE_QUERY)
+            rows = cursor.fetchall()
             cursor.close()
+            return rows
+        finally:
+            # returns the connection to the pool
+            connection.close()
 
-            self.transactions = str(self.transactions_list)
+    def prefetch(self):
+        if self.prefetched is None:
+            self.prefetched = self.executor.submit(self._fetch, self.unmarked_ids)
 
+    def take(self) -> list[dict]:
+        """Hands out the most valuable transactions that fit in a block;
+        they won't be handed out again."""
+        self.prefetch()
+        try:
+            rows = self.prefetched.result()
         except mysql.connector.Error as err:
             print(f"Error: {err}")
-    
-        finally:
-            if 'connection' in locals():
-                connection.close()
-                print("Connection closed!")
+            self.prefetched = None
+            return []
+        selected = select_transactions(rows, self.block_size)
+        self.unmarked_ids = [row['transaction_id'] for row in selected]
+        self.prefetched = self.executor.submit(self._fetch, self.unmarked_ids)
+        return selected
+
+    def close(self):
+        """Waits for the pending update (if any) and stops the worker."""
+        self.executor.shutdown(wait=True)
+
+_default_client: Optional[MempoolClient] = None
+
+def default_mempool_client() -> MempoolClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = MempoolClient()
+    return _default_client
+
+class MempoolTransactionList(TransactionList):
+    """Transactions reserved from an in-process Mempool; the node commits
+    or releases them depending on whether its block made it in."""
+
+    def __init__(self, mempool: Mempool, block_size: int = BLOCK_SIZE):
+        self.data = b""
+        self.transactions_list = mempool.reserve(block_size)
+        self.transaction_ids = [row['transaction_id'] for row in self.transactions_list]
+        self._set_rows(self.transactions_list)
+
+class MockTransactionList(TransactionList):
+    def __init__(self, client: Optional[MempoolClient] = None):
+        if client is None:
+            client = default_mempool_client()
+        self.transactions_list = client.take()
+        self._set_rows(self.transactions_list)
 
     def serialize(self) -> bytes:
         tx_raw = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
@@ -81,17 +247,6 @@ class MockTransactionList(TransactionList):
     @classmethod
     def deserialize(cls, raw: bytes) -> TransactionList:
         return pickle.loads(raw)
-    
-    def set_transactions(self, transactions: str):
-        self.transactions = transactions
 
-    #TODO: get hash of all transactions (probably using Merkle tree)
-    def get_hash(self) -> bytes:
-        return b"\x00" # TODO Provisory, code below does not work
-        if self.transactions:
-            hash_bytes = bytes.fromhex(self.transactions[0]["transaction_hash"])
-            return base64.b64encode(hash_bytes)
-        else:
-            return b"\x00"
     
     
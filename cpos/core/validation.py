@@ -0,0 +1,45 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Iterator, Optional
+from cpos.core.block import BlockHeader
+from cpos.core.blockchain import BlockChain
+
+class ValidationPipeline:
+    """Verifies incoming blocks on the chain's validation pool while the
+    caller keeps receiving, and hands them back in arrival order.
+
+    Only the expensive, stateless part (signature check and sortition)
+    runs on the pool; the caller inserts the blocks returned by ready()
+    itself, so the chain is only ever mutated from a single thread.
+    Since the proofs end up in the chain's validation cache, inserting
+    a verified block doesn't verify it again."""
+
+    def __init__(self, bc: BlockChain):
+        self.bc = bc
+        # (future, block, whatever the caller needs to handle it later)
+        self.queue: deque[tuple[Future, BlockHeader, Any]] = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def submit(self, block: BlockHeader, context: Any = None):
+        self.queue.append((self.bc.prevalidate(block), block, context))
+
+    def head(self) -> Optional[Future]:
+        """The future of the oldest block, which has to be verified
+        before anything else can be handed back."""
+        return self.queue[0][0] if self.queue else None
+
+    def ready(self, wait: bool = False) -> Iterator[tuple[BlockHeader, Any]]:
+        """Yields the blocks whose proofs were verified, oldest first,
+        stopping at the first one that is still pending (unless `wait`
+        is set, in which case every queued block is yielded)."""
+        while self.queue:
+            future, block, context = self.queue[0]
+            if not (wait or future.done()):
+                return
+            # re-raises anything that went wrong in the worker
+            future.result()
+            self.queue.popleft()
+            yield block, context
@@ -5,18 +5,41 @@ import random
 import os
 import pickle
 import random 
+from collections import OrderedDict
 
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
-from cpos.core.block import Block, GenesisBlock
+from cpos.core.block import Block, BlockHeader, GenesisBlock, lowest_proof_ticket
 from cpos.core.blockchain import BlockChain, BlockChainParameters
-from cpos.core.transactions import TransactionList, MockTransactionList
+from cpos.core.missed import MissedBlockStore
+from cpos.core.pending import PendingRequests
+from cpos.core.storage import create_storage
+from cpos.core.validation import ValidationPipeline
+from cpos.core.mempool import Mempool
+from cpos.core.transactions import TransactionList, MockTransactionList, MempoolClient, MempoolTransactionList
 from cpos.p2p.network import Network
+from cpos.runtime import AsyncNodeRuntime
+from cpos.util.seen import SeenFilter
 
-from cpos.protocol.messages import BlockBroadcast, Hello, Message, ResyncRequest, ResyncResponse, PeerForgetRequest
+from cpos.protocol.messages import peek_block_hash, BlockBroadcast, Hello, Message, MessageParseError, ResyncRequest, ResyncResponse, ResyncRangeRequest, ResyncRangeResponse, \
+    LocatorRequest, LocatorResponse, HeaderBroadcast, BodyRequest, BodyResponse, InventoryAnnounce, InventoryRequest, \
+    PeerForgetRequest
 
 from cpos.p2p.peer import Peer
 
 
+# how many recently seen blocks are kept around to answer body requests
+RECENT_BLOCKS_SIZE = 256
+# how many block hashes are remembered as known by each peer
+PEER_INVENTORY_SIZE = 1024
+# how many handled blocks are remembered to drop duplicates early
+SEEN_BLOCKS_SIZE = 8192
+# how long (in ms) the loop waits for messages while blocks are being
+# verified, so that they are inserted soon after their proofs are checked
+VALIDATION_POLL_TIMEOUT = 5
+# how long (in s) a peer has to answer a block request before the block is
+# asked from another peer that has it
+REQUEST_TIMEOUT = 1.0
+
 class NodeConfig:
     def __init__(self, **kwargs):
         self.port: int = kwargs.get("port", 8888)
@@ -42,6 +65,19 @@ class Node:
         use_mock_transactions = os.environ.get("MOCK_TRANSACTIONS", "false")
         use_mock_transactions = use_mock_transactions in ("true")
         self.use_mock_transactions = use_mock_transactions
+        # mock transactions come either from the mempool database ("mariadb",
+        # through a client that keeps its connections and the next
+        # candidates around) or from an in-process mempool ("memory")
+        self.mempool_client: Optional[MempoolClient] = None
+        self.mempool: Optional[Mempool] = None
+        # transactions of the block we generated this round
+        self.reserved_transactions: list = []
+        if self.use_mock_transactions:
+            if os.environ.get("MEMPOOL_BACKEND", "mariadb") == "memory":
+                self.mempool = Mempool(int(os.environ.get("MEMPOOL_SIZE", "100000")))
+            else:
+                self.mempool_client = MempoolClient()
+                self.mempool_client.prefetch()
 
         broadcast_created_block = os.environ.get("BROADCAST_CREATED_BLOCK", "true")
         self.broadcast_created_block = broadcast_created_block in ("true")
@@ -49,9 +85,28 @@ class Node:
         broadcast_received_block = os.environ.get("BROADCAST_RECEIVED_BLOCK", "true")
         self.broadcast_received_block = broadcast_received_block in ("true")
 
+        # "loop" runs the node in Node.loop(); "asyncio" uses AsyncNodeRuntime
+        self.runtime = os.environ.get("NODE_RUNTIME", "loop")
+
         self.maximum_num_peers = int(os.environ.get("MAXIMUM_NUM_PEERS", "8"))
         self.minimum_num_peers = int(os.environ.get("MINIMUM_NUM_PEERS", "4"))
 
+        # "full" gossips whole blocks; with "header" only headers are
+        # gossiped and peers fetch the bodies of the blocks they accept;
+        # with "announce" only hashes are gossiped and peers pull the
+        # blocks they don't have yet
+        self.gossip_mode = os.environ.get("GOSSIP_MODE", "full")
+
+        # how many blocks are requested/served per resync round-trip
+        self.resync_batch_size = int(os.environ.get("RESYNC_BATCH_SIZE", "16"))
+
+        # how many queued messages are read at once
+        self.read_batch_size = int(os.environ.get("READ_BATCH_SIZE", "64"))
+
+        # with VALIDATION_WORKERS > 0, received blocks are verified on a
+        # pool of that many threads instead of inline in the receive loop
+        self.validation_workers = int(os.environ.get("VALIDATION_WORKERS", "0"))
+
         if self.config.privkey is not None:
             self.privkey = Ed25519PrivateKey.from_private_bytes(self.config.privkey)
         else:
@@ -91,10 +146,42 @@ class Node:
 
         self.logger.info("PARAMETERS:    " + f" STAKE: {total_stake}      TAU: {tau}     RT:{round_time}     MIN_PEER: {self.minimum_num_peers}     MAX_PEER:{self.maximum_num_peers}    CREATED: {self.broadcast_created_block}     RECEIVED: {self.broadcast_received_block}")
         params = BlockChainParameters(round_time=round_time, tolerance=tolerance, tau=tau, total_stake=total_stake)
-        self.bc: BlockChain = BlockChain(params, genesis=genesis, node_id=self.id)
+        # where the local chain is persisted: "mariadb", "sqlite" or "memory"
+        storage_backend = os.getenv("STORAGE_BACKEND", "mariadb")
+        # with GROUP_COMMIT=true chain writes are only committed once per round
+        group_commit = os.getenv("GROUP_COMMIT", "false") in ("true")
+        storage = create_storage(storage_backend, node_id=self.id, path=os.getenv("STORAGE_PATH"), group_commit=group_commit)
+        self.bc: BlockChain = BlockChain(params, genesis=genesis, node_id=self.id, storage=storage,
+                                         validation_workers=self.validation_workers or None)
+        self.validation: Optional[ValidationPipeline] = None
+        if self.validation_workers > 0:
+            self.validation = ValidationPipeline(self.bc)
+        # optional on-disk cache of the confirmation/fork threshold table
+        self.threshold_table_path = os.getenv("THRESHOLD_TABLE_PATH")
+        if self.threshold_table_path is not None and self.bc.thresholds.load(self.threshold_table_path):
+            self.logger.info(f"loaded threshold table from {self.threshold_table_path}")
         self.state = State.LISTENING
-        self.missed_blocks: list[tuple[Block, bytes]] = []
-        self.received_resync_blocks: list[Block] = []
+        # blocks we couldn't insert, kept for at most MISSED_BLOCKS_MAX_AGE
+        # rounds (and MISSED_BLOCKS_SIZE blocks) along with who sent them
+        self.missed_blocks = MissedBlockStore(capacity=int(os.environ.get("MISSED_BLOCKS_SIZE", "1024")),
+                                              max_age=int(os.environ.get("MISSED_BLOCKS_MAX_AGE", "50")))
+        # blocks that peers may ask the body of, and the headers whose
+        # body we asked for (along with the peers that announced them)
+        self.recent_blocks: OrderedDict[bytes, Block] = OrderedDict()
+        self.pending_bodies = PendingRequests(RECENT_BLOCKS_SIZE, REQUEST_TIMEOUT)
+        # announce mode: hashes each peer is known to have (because it sent
+        # or announced them, or we did), and blocks we already asked for
+        # (along with the other peers that announced them)
+        self.peer_inventory: dict[bytes, OrderedDict[bytes, None]] = {}
+        self.requested_blocks = PendingRequests(PEER_INVENTORY_SIZE, REQUEST_TIMEOUT)
+        # hashes of the blocks (and headers) that were already handled, so
+        # that copies relayed by other peers are dropped before decoding
+        self.seen_blocks = SeenFilter(SEEN_BLOCKS_SIZE)
+        # peer we are resyncing with, the height of its chain and whether
+        # any of its blocks made it into ours so far
+        self.resync_peer: Optional[bytes] = None
+        self.resync_height: int = 0
+        self.resync_merged: bool = False
         
         self.message_count = 0
         self.total_message_bytes = 0
@@ -134,7 +221,7 @@ class Node:
                 self.network.connect(peer.ip, peer.port, peer.id)
 
     def send_message(self, dest_peer_id: bytes, msg: Message):
-        if isinstance(msg, BlockBroadcast):
+        if isinstance(msg, (BlockBroadcast, HeaderBroadcast)):
             self.logger.debug(f"broadcasting {msg}")
         else:
             self.logger.debug(f"sending {msg} to peer {dest_peer_id.hex()[0:8]}")
@@ -144,7 +231,11 @@ class Node:
         raw = self.network.read()
         if raw is None:
             return None
-        return Message.deserialize(raw)
+        try:
+            return Message.deserialize(raw)
+        except MessageParseError as e:
+            self.logger.warning(f"dropping malformed message: {e}")
+            return None
 
     def broadcast_message(self, msg: Message, invalid_peers: list):
         for peer in self.network.known_peers:
@@ -156,7 +247,7 @@ class Node:
             msg = Hello(self.id, self.config.port)
             self.send_message(peer_id, msg)
 
-    def sign_block(self, block: Block):
+    def sign_block(self, block: BlockHeader):
         block.signed_node_hash = self.privkey.sign(block.node_hash)
         block.update()
 
@@ -166,203 +257,482 @@ class Node:
     #       of indexing manually like we're doing now
     def generate_block(self) -> Optional[Block]:
         stake = self.bc.lookup_node_stake(self.id)
-        candidate: Optional[Block] = None
-        for i in range(0, stake):
-            if self.use_mock_transactions:
-                tx = MockTransactionList()
-            else:
-                tx = TransactionList()
-
-            block = Block(parent_hash=self.bc.get_last_block_hash(),
+        if stake <= 0:
+            return None
+        owner_pubkey = self.pubkey.public_bytes_raw()
+        # only ticket_number (and so proof_hash) differs between the
+        # candidates, so the signature and sortition are shared by all of
+        # them; the transactions are only fetched if we actually win
+        header = BlockHeader(parent_hash=self.bc.get_last_block_hash(),
+                             owner_pubkey=owner_pubkey,
+                             signed_node_hash=b"",
+                             round=self.bc.current_round,
+                             index=self.bc.number_of_blocks(),
+                             ticket_number=0,
+                             transaction_hash=b"\x00")
+        self.sign_block(header)
+
+        winning_tickets = self.bc.validate_block(header)
+        if not winning_tickets:
+            return None
+        # tickets 0..winning_tickets pass validation
+        ticket_number = lowest_proof_ticket(header.node_hash, min(stake - 1, winning_tickets))
+
+        if self.mempool is not None:
+            tx = MempoolTransactionList(self.mempool)
+            self.reserved_transactions = tx.transaction_ids
+        elif self.use_mock_transactions:
+            tx = MockTransactionList(self.mempool_client)
+        else:
+            tx = TransactionList()
+        candidate = Block(parent_hash=header.parent_hash,
                           transactionlist=tx,
-                          owner_pubkey=self.pubkey.public_bytes_raw(),
-                          signed_node_hash=b"",
-                          round=self.bc.current_round,
-                          index=self.bc.number_of_blocks(),
-                          ticket_number=i)
-            self.sign_block(block)
-            block.ticket_number = i
-
-            if not self.bc.validate_block(block):
-                continue
-
-            self.logger.debug(f"block candidate: {block}")
-            
-            if candidate is None or block.proof_hash < candidate.proof_hash:
-                candidate = block
+                          owner_pubkey=owner_pubkey,
+                          signed_node_hash=header.signed_node_hash,
+                          round=header.round,
+                          index=header.index,
+                          ticket_number=ticket_number)
 
-        if candidate is not None:
-            self.logger.info(f"successfully generated a block: {candidate}")
+        self.logger.info(f"successfully generated a block: {candidate}")
         return candidate
 
-    def handle_new_block(self, block: Block, peer_id: bytes):
+    def announce_block(self, block: Block, invalid_peers: list):
+        own_id = self.id if not None else self.config.id
+        if self.gossip_mode == "announce":
+            self.remember_block(block)
+            for peer_id in self.network.known_peers:
+                if peer_id in invalid_peers or self.peer_knows(peer_id, block.hash):
+                    continue
+                self.mark_known(peer_id, block.hash)
+                self.send_message(peer_id, InventoryAnnounce(own_id, [block.hash]))
+        elif self.gossip_mode == "header":
+            self.remember_block(block)
+            self.broadcast_message(HeaderBroadcast(block.header(), own_id), invalid_peers)
+        else:
+            self.broadcast_message(BlockBroadcast(block, own_id), invalid_peers)
+
+    def remember_block(self, block: Block):
+        self.recent_blocks[block.hash] = block
+        self.recent_blocks.move_to_end(block.hash)
+        if len(self.recent_blocks) > RECENT_BLOCKS_SIZE:
+            self.recent_blocks.popitem(last=False)
+
+    def mark_known(self, peer_id: bytes, hash: bytes):
+        inventory = self.peer_inventory.setdefault(peer_id, OrderedDict())
+        inventory[hash] = None
+        inventory.move_to_end(hash)
+        if len(inventory) > PEER_INVENTORY_SIZE:
+            inventory.popitem(last=False)
+
+    def peer_knows(self, peer_id: bytes, hash: bytes) -> bool:
+        return hash in self.peer_inventory.get(peer_id, ())
+
+    def handle_inventory_announce(self, msg: InventoryAnnounce):
+        wanted = []
+        for hash in msg.hashes:
+            self.mark_known(msg.peer_id, hash)
+            # already asked for: ask this peer if the first one doesn't answer
+            if self.requested_blocks.add_source(hash, msg.peer_id):
+                continue
+            if hash in self.seen_blocks or hash in self.recent_blocks:
+                continue
+            if self.bc.block_of_hash(hash) is not None or hash in self.missed_blocks:
+                continue
+            self.requested_blocks.request(hash, msg.peer_id, time())
+            wanted.append(hash)
+        if wanted:
+            self.send_message(msg.peer_id, InventoryRequest(self.id, wanted))
+
+    # asks again for the blocks (and bodies) whose request went unanswered,
+    # this time from another peer that announced them
+    def retry_requests(self):
+        for hash, _, peer_id in self.requested_blocks.expire(time()):
+            self.logger.info(f"re-requesting block {hash.hex()[0:8]} from {peer_id.hex()[0:8]}")
+            self.send_message(peer_id, InventoryRequest(self.id, [hash]))
+        for hash, _, peer_id in self.pending_bodies.expire(time()):
+            self.logger.info(f"re-requesting body of {hash.hex()[0:8]} from {peer_id.hex()[0:8]}")
+            self.send_message(peer_id, BodyRequest(self.id, hash))
+
+    def handle_inventory_request(self, msg: InventoryRequest):
+        own_id = self.id if not None else self.config.id
+        for hash in msg.hashes:
+            block = self.recent_blocks.get(hash)
+            if block is None:
+                found = self.bc.block_of_hash(hash)
+                if found is None:
+                    continue
+                block = self.bc.block_by_index(found[1])
+            self.send_message(msg.peer_id, BlockBroadcast(block, own_id))
+
+    def should_discard(self, block: BlockHeader) -> bool:
         round = self.bc.current_round
         tolerance = self.bc.parameters.tolerance
         if block.round not in range(round, round + tolerance + 1):
             self.logger.info(f"discarding block {block.hash.hex()[0:8]} (outside of tolerance range)")
-            return False
+            return True
         if block.owner_pubkey == self.pubkey.public_bytes_raw():
             self.logger.info(f"discarding block {block.hash.hex()[0:8]} (produced by itself)")
+            return True
+        return False
+
+    def handle_new_header(self, header: BlockHeader, peer_id: bytes):
+        self.mark_known(peer_id, header.hash)
+        if self.should_discard(header):
+            return False
+        # the header is only marked as seen once we have its body, so that
+        # copies from other peers still reach us while it is being fetched
+        if self.pending_bodies.add_source(header.hash, peer_id):
+            return False
+        if header.hash in self.seen_blocks or header.hash in self.recent_blocks:
+            return False
+        if self.bc.block_in_blockchain(header) or header.hash in self.missed_blocks:
+            self.seen_blocks.add(header.hash)
             return False
+        self.received_blocks += 1
+        # only fetch the body if the block would make it into our chain
+        if self.bc.accepts_header(header):
+            self.pending_bodies.request(header.hash, peer_id, time(), header)
+            self.send_message(peer_id, BodyRequest(self.id, header.hash))
+        else:
+            self.seen_blocks.add(header.hash)
+            self.missed_blocks.add(header, peer_id)
+
+    # asks the next peer that announced the header for its body, if any
+    def retry_body_request(self, hash: bytes):
+        retry = self.pending_bodies.fail(hash, time())
+        if retry is not None:
+            self.send_message(retry[1], BodyRequest(self.id, hash))
+
+    def handle_body_request(self, msg: BodyRequest):
+        block = self.recent_blocks.get(msg.block_hash)
+        if block is None:
+            found = self.bc.block_of_hash(msg.block_hash)
+            if found is not None:
+                block = self.bc.block_by_index(found[1])
+        transactions = block.transactions if block is not None else None
+        self.send_message(msg.peer_id, BodyResponse(self.id, msg.block_hash, transactions))
+
+    def handle_body_response(self, msg: BodyResponse):
+        pending = self.pending_bodies.get(msg.block_hash)
+        # only the peer we asked last gets to answer (or to move the
+        # request on to the next one)
+        if pending is None or pending[1] != msg.peer_id:
+            return
+        if msg.transactions is None:
+            self.retry_body_request(msg.block_hash)
+            return
+        header, peer_id = pending
+        transactionlist = TransactionList()
+        transactionlist.set_transactions(msg.transactions)
+        try:
+            block = Block.from_header(header, transactionlist)
+        except ValueError as e:
+            self.logger.warning(f"discarding body of {header.hash.hex()[0:8]} ({e})")
+            self.retry_body_request(msg.block_hash)
+            return
+        self.pending_bodies.pop(msg.block_hash)
+        self.seen_blocks.add(block.hash)
         self.logger.info(f"trying to insert {block}")
+        if self.bc.insert(block):
+            # only relay what we accepted, so that we can serve its body
+            if self.broadcast_received_block:
+                self.announce_block(block, [peer_id, block.owner_pubkey])
+        else:
+            self.missed_blocks.add(block, peer_id)
+
+    def handle_new_block(self, block: Block, peer_id: bytes):
+        self.mark_known(peer_id, block.hash)
+        self.requested_blocks.pop(block.hash)
+        if self.should_discard(block):
+            return False
         self.received_blocks += 1
+        if not self.seen_blocks.add(block.hash):
+            return False
+        if self.validation is not None:
+            # inserted by process_validated_blocks once its proof is checked
+            self.validation.submit(block, peer_id)
+        else:
+            self.insert_received_block(block, peer_id)
+
+    def insert_received_block(self, block: Block, peer_id: bytes):
+        self.logger.info(f"trying to insert {block}")
         block_in_blockchain = self.bc.block_in_blockchain(block)
-        block_in_missed_blocks = any(tup[0].hash.hex() == block.hash.hex() for tup in self.missed_blocks)
+        block_in_missed_blocks = block.hash in self.missed_blocks
         if not (block_in_blockchain or block_in_missed_blocks):
-            own_id = self.id if not None else self.config.id
             if self.broadcast_received_block:
-                self.broadcast_message(BlockBroadcast(block, own_id), [peer_id, block.owner_pubkey])
+                self.announce_block(block, [peer_id, block.owner_pubkey])
                 # TODO: Blocks are retransmitted and stored without even checking if they are valid. This is ok in a simulation, but unsafe for real use.
             if not self.bc.insert(block):
                 if not block_in_blockchain:
-                    # TODO: missed_blocks grows infinetly for every block received from a peer. After a suficient number of rounds, it will grow too big.
-                    # It would be reosonable to have a limit to its size and start deleting old blocks, and maybe store peer_id and block seperatelly and without repetition
-                    self.missed_blocks.append((block, peer_id))
+                    self.missed_blocks.add(block, peer_id)
+
+    # inserts the received blocks whose proofs were verified, in the order
+    # they arrived; with `wait` set, waits for every pending one
+    def process_validated_blocks(self, wait: bool = False):
+        if self.validation is None:
+            return
+        for block, peer_id in self.validation.ready(wait):
+            self.insert_received_block(block, peer_id)
+
+    def request_resync(self, peer_id: bytes) -> bool:
+        # start by finding the latest block both chains have in common
+        self.resync_peer = peer_id
+        self.resync_height = 0
+        self.resync_merged = False
+        return self.send_message(peer_id, LocatorRequest(self.id, self.bc.block_locator()))
+
+    def resync_with_next_peer(self) -> bool:
+        # resync with a node that sent a random missed block
+        while self.missed_blocks.has_peers():
+            if self.request_resync(self.missed_blocks.pop_random_peer()):
+                return True
+        return False
+
+    def request_resync_range(self, start_index: int) -> bool:
+        count = min(self.resync_batch_size, self.resync_height - start_index)
+        if count <= 0:
+            return False
+        return self.send_message(self.resync_peer, ResyncRangeRequest(self.id, start_index, count))
+
+    def finish_resync(self, success: bool):
+        self.state = State.LISTENING
+        self.resync_peer = None
+        self.bc.fork_detected = False
+        if success:
+            self.missed_blocks.clear()
+            self.successfull_resyncs += 1
+            self.logger.info("resync completed!")
+        else:
+            self.logger.info("resync finished unsuccessfully!")
+
+    def handle_resync_message(self, msg: Message):
+        if isinstance(msg, LocatorResponse):
+            # fetch the peer's chain from right after the common ancestor
+            if msg.ancestor_index is not None:
+                self.resync_height = msg.height
+                if self.request_resync_range(msg.ancestor_index + 1):
+                    return
+        elif isinstance(msg, ResyncRangeResponse):
+            # the locator only gives an approximate fork point, so drop the
+            # blocks that we already have before merging the rest
+            blocks = list(msg.blocks)
+            while blocks and self.bc.block_in_blockchain(blocks[0]):
+                blocks.pop(0)
+            merged = bool(blocks) and self.bc.merge(blocks)
+            self.resync_merged = self.resync_merged or merged
+            # keep fetching as long as the peer's chain isn't worse than ours
+            if msg.blocks and (merged or not blocks):
+                if self.request_resync_range(msg.start_index + len(msg.blocks)):
+                    return
+            if self.resync_merged:
+                self.finish_resync(True)
+                return
+        else:
+            return
+
+        # If the peer doesn't have useful blocks, ask to another random peer
+        if not self.resync_with_next_peer():
+            self.finish_resync(False)
+
+    def handle_resync_request(self, msg: Message):
+        if isinstance(msg, LocatorRequest):
+            ancestor_index = self.bc.find_common_ancestor(msg.locator)
+            self.send_message(msg.peer_id, LocatorResponse(ancestor_index, self.bc.number_of_blocks()))
+        elif isinstance(msg, ResyncRangeRequest):
+            count = min(msg.count, self.resync_batch_size)
+            start_index, blocks = self.bc.blocks_in_range(msg.start_index, count)
+            self.send_message(msg.peer_id, ResyncRangeResponse(start_index, blocks))
+        elif isinstance(msg, ResyncRequest):
+            # make sure we only send stuff after the genesis block
+            # If there are blocks available at this index, send it
+            if self.bc.number_of_blocks() > abs(msg.block_index):
+                block_to_send = self.bc.block_by_index(msg.block_index)
+                self.send_message(msg.peer_id, ResyncResponse(block_to_send))
+            # Else, send None to signal there are no blocks that match the request
+            else:
+                self.send_message(msg.peer_id, ResyncResponse(None))
 
     def control_number_of_peers(self):
+        self.connect_peers(self.fetch_additional_peers())
+        self.trim_peers()
+
+    # blocks for a couple of seconds while waiting for the beacon, but
+    # doesn't touch the node's state
+    def fetch_additional_peers(self) -> Optional[list[Peer]]:
         if len(self.network.known_peers) < self.minimum_num_peers: 
             self.logger.info(f"Number of peers too low, asking more from beacon")
-            additional_peerlist = self.network.get_additional_peers_from_beacon() # peers are randomly selected by beacon and come in a random order
-            if additional_peerlist is not None:
-                for peer in additional_peerlist: # TODO maybe limit number of peers added here?
-                    if peer.id == self.id or peer.id in self.network.known_peers:
-                        continue
-                    self.network.connect(peer.ip, peer.port, peer.id)
+            return self.network.get_additional_peers_from_beacon() # peers are randomly selected by beacon and come in a random order
+        return None
 
+    def connect_peers(self, additional_peerlist: Optional[list[Peer]]):
+        if additional_peerlist is not None:
+            for peer in additional_peerlist: # TODO maybe limit number of peers added here?
+                if peer.id == self.id or peer.id in self.network.known_peers:
+                    continue
+                self.network.connect(peer.ip, peer.port, peer.id)
+
+    def trim_peers(self):
         while len(self.network.known_peers) > self.maximum_num_peers:
             random_peer_id = random.sample(self.network.known_peers, 1)[0]
             self.logger.info(f" Too many peers: {len(self.network.known_peers)}, forgetting peer: {random_peer_id.hex()[0:8]}")
             self.send_message(random_peer_id, PeerForgetRequest(self.id))
             self.network.forget_peer(random_peer_id)
 
+        # drop the inventory of peers we are no longer connected to
+        for peer_id in [peer_id for peer_id in self.peer_inventory if peer_id not in self.network.known_peers]:
+            del self.peer_inventory[peer_id]
+
+    def should_resync(self) -> bool:
+        return self.state == State.LISTENING and self.bc.fork_detected and self.missed_blocks.has_peers()
+
+    def start_resync(self) -> bool:
+        # blocks received before the fork was detected go in first
+        self.process_validated_blocks(wait=True)
+        # resync with a node that sent a random missed block
+        if not self.resync_with_next_peer():
+            return False
+        self.state = State.RESYNCING
+        self.resyncs += 1
+        self.logger.info("started resyncing")
+        return True
+
+    def reached_total_rounds(self, initial_round: int) -> bool:
+        return self.config.total_rounds is not None and self.bc.current_round >= initial_round + self.config.total_rounds
+
+    def on_new_round(self):
+        self.logger.debug(f"state: {self.state}")
+        self.network.notify_beacon() #  Notifies beacon this node is still alive and connected to the network
+        # TODO: make the log_dir configurable (and maybe
+        # don't log every single round...)
+        self.dump_data("demo/logs")
+        self.missed_blocks.expire(self.bc.current_round)
+        new_block = self.generate_block()
+        inserted = False
+        if new_block is not None and self.broadcast_created_block: # if dishonest node isnt going to broadcast block, it is also not going to insert in local blockchain
+            self.produced_blocks += 1
+            inserted = self.bc.insert(new_block)
+            self.seen_blocks.add(new_block.hash)
+            if self.broadcast_created_block:
+                self.announce_block(new_block, [])
+        self.settle_reserved_transactions(inserted)
+
+    # the transactions of our block leave the mempool if the block made it
+    # into our chain, and are pending again otherwise
+    def settle_reserved_transactions(self, inserted: bool):
+        if self.mempool is None or not self.reserved_transactions:
+            return
+        if inserted:
+            self.mempool.commit(self.reserved_transactions)
+        else:
+            self.mempool.release(self.reserved_transactions)
+        self.reserved_transactions = []
+
+    # returns False if the message was dropped without being handled
+    def handle_message(self, raw: bytes) -> bool:
+        self.message_count += 1
+        self.total_message_bytes += len(raw)
+
+        # duplicates of blocks we already handled are dropped before
+        # decoding them (or touching the chain)
+        block_hash = peek_block_hash(raw)
+        if block_hash is not None and block_hash in self.seen_blocks:
+            self.received_blocks += 1
+            return False
+
+        try:
+            msg = Message.deserialize(raw)
+        except MessageParseError as e:
+            self.logger.warning(f"dropping malformed message: {e}")
+            return False
+        self.logger.debug(f"new message: {msg}")
+
+        if self.state == State.LISTENING:
+            if isinstance(msg, BlockBroadcast):
+                self.handle_new_block(msg.block, msg.peer_id)    
+            if isinstance(msg, HeaderBroadcast):
+                self.handle_new_header(msg.header, msg.peer_id)
+            if isinstance(msg, BodyResponse):
+                self.handle_body_response(msg)
+            if isinstance(msg, InventoryAnnounce):
+                self.handle_inventory_announce(msg)
+            if isinstance(msg, (ResyncRequest, ResyncRangeRequest, LocatorRequest)):
+                self.handle_resync_request(msg)
+            if isinstance(msg, BodyRequest):
+                self.handle_body_request(msg)
+            if isinstance(msg, InventoryRequest):
+                self.handle_inventory_request(msg)
+            if isinstance(msg, PeerForgetRequest):
+                self.logger.info(f"Received forget request from: {msg.peer_id.hex()[0:8]}")
+                self.network.forget_peer(msg.peer_id)
+
+        elif self.state == State.RESYNCING:
+            if isinstance(msg, (LocatorResponse, ResyncRangeResponse)):
+                self.handle_resync_message(msg)
+                      
+            # we need to reply to resync requests in order to avoid a
+            # distributed deadlock
+            if isinstance(msg, (ResyncRequest, ResyncRangeRequest, LocatorRequest)):
+                self.handle_resync_request(msg)
+            if isinstance(msg, BodyRequest):
+                self.handle_body_request(msg)
+            if isinstance(msg, InventoryRequest):
+                self.handle_inventory_request(msg)
+
+        return True
+
+    def shutdown(self):
+        self.process_validated_blocks(wait=True)
+        self.bc.flush()
+        if self.mempool_client is not None:
+            self.mempool_client.close()
+        if self.threshold_table_path is not None and self.bc.thresholds.dirty:
+            self.bc.thresholds.save(self.threshold_table_path)
+        self.logger.error("halted")
+
     def loop(self):
         round = self.bc.genesis.timestamp
         initial_round = self.bc.current_round
         while True:
-            if self.config.total_rounds is not None and self.bc.current_round >= initial_round + self.config.total_rounds:
+            if self.reached_total_rounds(initial_round):
                 self.should_halt = True
 
             if self.should_halt:
-                self.logger.error("halted")
+                self.shutdown()
                 break
+
+            self.process_validated_blocks()
+            self.retry_requests()
             
             # if we detect a fork, resync with a node that sent a random missed block
-            if self.state == State.LISTENING and self.bc.fork_detected and self.missed_blocks:
-                stopResyncing = False
-                while True:
-                    if len(self.missed_blocks) == 0:
-                        stopResyncing = True
-                        break
-                    missed: tuple[Block, bytes] = random.choice(self.missed_blocks)
-                    self.missed_blocks.remove(missed)
-                    # Start by asking for its last block
-                    request_index = -1
-                    if self.send_message(missed[1], ResyncRequest(self.id, request_index)):
-                        break
-                if stopResyncing:
+            if self.should_resync():
+                if not self.start_resync():
                     continue
-                self.state = State.RESYNCING
-                self.resyncs += 1
-                self.logger.info("started resyncing")
 
             self.bc.update_round()
             # on round change:
             if round != self.bc.current_round:
-                self.logger.debug(f"state: {self.state}")
-                self.network.notify_beacon() #  Notifies beacon this node is still alive and connected to the network
-                # TODO: make the log_dir configurable (and maybe
-                # don't log every single round...)
-                self.dump_data("demo/logs")
                 round = self.bc.current_round
-                new_block = self.generate_block()
-                if new_block is not None and self.broadcast_created_block: # if dishonest node isnt going to broadcast block, it is also not going to insert in local blockchain
-                    self.produced_blocks += 1
-                    self.bc.insert(new_block)
-                    own_id = self.id if not None else self.config.id
-                    if self.broadcast_created_block:
-                        self.broadcast_message(BlockBroadcast(new_block, own_id), [])
+                self.on_new_round()
 
             # the 200ms timeout prevents us from busy-waiting
-            raw = self.network.read(timeout=200)
-            if raw is None:
-                continue
-
-            self.message_count += 1
-            self.total_message_bytes += len(raw)
+            timeout = VALIDATION_POLL_TIMEOUT if self.validation is not None and len(self.validation) else 200
+            messages = self.network.read_batch(timeout=timeout, max_messages=self.read_batch_size)
+            handled = False
+            for raw in messages:
+                handled = self.handle_message(raw) or handled
 
-            msg = Message.deserialize(raw)
-            self.logger.debug(f"new message: {msg}")
-
-            if self.state == State.LISTENING:
-                if isinstance(msg, BlockBroadcast):
-                    self.handle_new_block(msg.block, msg.peer_id)    
-                if isinstance(msg, ResyncRequest):
-                    peer_id = msg.peer_id
-                    # make sure we only send stuff after the genesis block
-                    # If there are blocks available at this index, send it
-                    if self.bc.number_of_blocks() > abs(msg.block_index):
-                        block_to_send = self.bc.block_by_index(msg.block_index)
-                        self.send_message(peer_id, ResyncResponse(block_to_send))
-                    # Else, send None to signal there are no blocks that match the request
-                    else:
-                        self.send_message(peer_id, ResyncResponse(None))
-                if isinstance(msg, PeerForgetRequest):
-                    self.logger.info(f"Received forget request from: {msg.peer_id.hex()[0:8]}")
-                    self.network.forget_peer(msg.peer_id)
-
-            if self.state == State.RESYNCING:
-                if isinstance(msg, ResyncResponse):
-                    # Store the received blocks
-                    self.received_resync_blocks.insert(0, msg.block_received)
-
-                    # If the peer doesn't have useful blocks, ask to another random peer
-                    if not msg.block_received:
-                        self.received_resync_blocks = []
-                        if self.missed_blocks:
-                            missed: tuple[Block, bytes] = random.choice(self.missed_blocks)
-                            self.missed_blocks.remove(missed)
-                            request_index = -1
-                            self.send_message(missed[1], ResyncRequest(self.id, request_index))
-                        else:
-                            self.state = State.LISTENING
-                            self.received_resync_blocks = []
-                            self.bc.fork_detected = False
-                            self.logger.info("resync finished unsuccessfully!")
-
-                    # If the resync is successful, finish the resync
-                    elif self.bc.merge(self.received_resync_blocks):
-                        self.state = State.LISTENING
-                        self.received_resync_blocks = []
-                        self.bc.fork_detected = False
-                        self.missed_blocks = []
-                        self.successfull_resyncs += 1
-                        self.logger.info("resync completed!")
-
-                    # If it is needed to request for more blocks
-                    else:
-                        request_index -= 1
-                        self.send_message(missed[1], ResyncRequest(self.id, request_index))
-                          
-                # we need to reply to ResyncRequest in order to avoid a
-                # distributed deadlock
-                if isinstance(msg, ResyncRequest):
-                    peer_id = msg.peer_id
-                    # make sure we only send stuff after the genesis block
-                    # If there are blocks available at this index, send it
-                    if self.bc.number_of_blocks() > abs(msg.block_index):
-                        block_to_send = self.bc.block_by_index(msg.block_index)
-                        self.send_message(peer_id, ResyncResponse(block_to_send))
-                    # Else, send None to signal there are no blocks that match the request
-                    else:
-                        self.send_message(peer_id, ResyncResponse(None))
-
-            self.control_number_of_peers()
+            # once per batch rather than per message
+            if handled:
+                self.control_number_of_peers()
 
     def start(self):
         self.should_halt = False
         self.logger.debug(f"peerlist: {sorted([i.hex()[0:8] for i in self.network.known_peers])}")
-        self.greet_peers()
-        self.loop()
+        if self.runtime == "asyncio":
+            AsyncNodeRuntime(self).run()
+        else:
+            self.greet_peers()
+            self.loop()
 
     def halt(self):
         self.logger.error(f"trying to halt...")
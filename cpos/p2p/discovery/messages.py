@@ -1,55 +1,135 @@
+from __future__ import annotations
 from typing import Self
-import pickle
 from cpos.p2p.peer import Peer
+from cpos.util.codec import Encoder, Decoder, CodecError
+
+# bumped whenever the layout of any message changes
+WIRE_VERSION = 0x1
 
 class MessageCode:
-    UNIMPLEMENTED = 0xFF,
-    HELLO = 0x0,
-    PEERLIST = 0x1,
-    PEER_LIST_REQUEST = 0x2,
-    NOTIFY_BEACON = 0x3,
+    UNIMPLEMENTED = 0xFF
+    HELLO = 0x0
+    PEERLIST = 0x1
+    PEER_LIST_REQUEST = 0x2
+    NOTIFY_BEACON = 0x3
+
+class MessageParseError(Exception):
+    pass
+
+def encode_peer(enc: Encoder, peer: Peer):
+    enc.short_str(peer.ip)
+    enc.u16(int(peer.port))
+    enc.short_bytes(peer.id)
+
+def decode_peer(dec: Decoder) -> Peer:
+    return Peer(dec.short_str(), dec.u16(), dec.short_bytes())
 
 class Message:
-    def __init__(self, code):
-        self.code = MessageCode.UNIMPLEMENTED
+    """Beacon messages, framed as [WIRE_VERSION: u8][code: u8][payload]."""
+
+    code = MessageCode.UNIMPLEMENTED
+    registry: dict[int, type[Message]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Message.registry[cls.code] = cls
+
+    def encode(self, enc: Encoder):
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> Self:
+        raise NotImplementedError
 
     def serialize(self) -> bytes:
-        msg_raw = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
-        return msg_raw
+        enc = Encoder()
+        enc.u8(WIRE_VERSION)
+        enc.u8(self.code)
+        self.encode(enc)
+        return enc.getvalue()
 
     @classmethod
     def deserialize(cls, raw) -> Self:
-        return pickle.loads(raw)
+        try:
+            dec = Decoder(raw)
+            version = dec.u8()
+            if version != WIRE_VERSION:
+                raise MessageParseError(f"unsupported wire version {version}")
+            code = dec.u8()
+            message_class = Message.registry.get(code)
+            if message_class is None:
+                raise MessageParseError(f"unknown message code {code}")
+            msg = message_class.decode(dec)
+            dec.finish()
+        except CodecError as e:
+            raise MessageParseError(str(e)) from e
+        if not isinstance(msg, cls):
+            raise MessageParseError(f"expected {cls.__name__}, got {message_class.__name__}")
+        return msg
 
 class Hello(Message):
+    code = MessageCode.HELLO
+
     def __init__(self, port: int, id: bytes, ip: str):
-        self.code = MessageCode.HELLO
         self.port = port
         self.id = id
         self.ip = ip
-    
+
+    def encode(self, enc: Encoder):
+        encode_peer(enc, Peer(self.ip, self.port, self.id))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> Hello:
+        peer = decode_peer(dec)
+        return cls(peer.port, peer.id, peer.ip)
+
     def __str__(self):
         return f"SelfIntroduction: (port={self.port}, id={self.id.hex()[0:8]}, ip={self.ip})"
 
 class PeerList(Message):
+    code = MessageCode.PEERLIST
+
     def __init__(self, peerlist: list[Peer]):
-        self.code = MessageCode.PEERLIST
         self.peers = peerlist
 
+    def encode(self, enc: Encoder):
+        enc.list(self.peers, lambda peer: encode_peer(enc, peer))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> PeerList:
+        return cls(dec.list(lambda: decode_peer(dec)))
+
     def __str__(self):
         return f"{self.peers}"
-    
+
     def __repr__(self):
         return self.__str__()
 
 class PeerListRequest(Message):
+    code = MessageCode.PEER_LIST_REQUEST
+
     def __init__(self, requester_id: bytes):
-        self.code = MessageCode.PEER_LIST_REQUEST
         self.requester_id = requester_id
 
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.requester_id)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> PeerListRequest:
+        return cls(dec.short_bytes())
+
 class NotifyBeacon(Message):
+    code = MessageCode.NOTIFY_BEACON
+
     def __init__(self, port: int, id: bytes, ip: str):
-        self.code = MessageCode.NOTIFY_BEACON
         self.port = port
         self.id = id
         self.ip = ip
+
+    def encode(self, enc: Encoder):
+        encode_peer(enc, Peer(self.ip, self.port, self.id))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> NotifyBeacon:
+        peer = decode_peer(dec)
+        return cls(peer.port, peer.id, peer.ip)
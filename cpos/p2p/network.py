@@ -74,7 +74,30 @@ class Network:
         # read from poller with a timeout (if it's 0, returns immediately)
         if not self.poller.poll(timeout):
             return None
-        peer_id, _, msg = self.socket.recv_multipart()
+        return self.accept(self.socket.recv_multipart())
+
+    def read_batch(self, timeout=0, max_messages=64) -> list[bytes]:
+        """Waits for a message like read(), then also returns whatever
+        else is already queued (up to `max_messages` in total), so that a
+        burst of messages only costs a single poll."""
+        if not self.poller.poll(timeout):
+            return []
+        return self.drain(max_messages)
+
+    # reads up to `max_messages` queued messages without blocking
+    def drain(self, max_messages: int) -> list[bytes]:
+        messages = []
+        while len(messages) < max_messages:
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            messages.append(self.accept(frames))
+        return messages
+
+    # unpacks the frames of a received message and registers its sender
+    def accept(self, frames: list[bytes]) -> bytes:
+        peer_id, _, msg = frames
         self.logger.debug(f"received message from peer {peer_id.hex()[0:8]}: {msg}")
         if peer_id not in self.known_peers:
             self.known_peers.append(peer_id)
@@ -1,11 +1,12 @@
 from __future__ import annotations
-import json
-from base64 import b64encode, b64decode
-import pickle
-from typing import Self
+from typing import Optional, Self
 
-from cpos.core.block import Block
+from cpos.core.block import Block, BlockHeader
 from cpos.core.transactions import TransactionList
+from cpos.util.codec import Encoder, Decoder, CodecError
+
+# bumped whenever the layout of any message changes
+WIRE_VERSION = 0x2
 
 class MessageCode:
     UNDEFINED = 0x0
@@ -14,67 +15,243 @@ class MessageCode:
     PEER_LIST_REQUEST = 0x3
     PEER_LIST = 0x4
     PEER_FORGET_REQUEST = 0x5
+    RESYNC_REQUEST = 0x6
+    RESYNC_RESPONSE = 0x7
+    RESYNC_RANGE_REQUEST = 0x8
+    RESYNC_RANGE_RESPONSE = 0x9
+    LOCATOR_REQUEST = 0xA
+    LOCATOR_RESPONSE = 0xB
+    HEADER_BROADCAST = 0xC
+    BODY_REQUEST = 0xD
+    BODY_RESPONSE = 0xE
+    INVENTORY_ANNOUNCE = 0xF
+    INVENTORY_REQUEST = 0x10
 
 class MessageParseError(Exception):
     pass
 
+def encode_block(enc: Encoder, block: Block):
+    # the hash goes first so that it can be read without decoding the rest
+    enc.short_bytes(block.hash)
+    enc.short_bytes(block.parent_hash)
+    enc.short_bytes(block.owner_pubkey)
+    enc.short_bytes(block.signed_node_hash)
+    enc.u32(block.round)
+    enc.u32(block.index)
+    enc.u32(block.ticket_number)
+    enc.str(block.transactions)
+
+def decode_block(dec: Decoder) -> Block:
+    hash = dec.short_view()
+    parent_hash = dec.short_bytes()
+    owner_pubkey = dec.short_bytes()
+    signed_node_hash = dec.short_bytes()
+    round = dec.u32()
+    index = dec.u32()
+    ticket_number = dec.u32()
+    transactionlist = TransactionList()
+    transactionlist.set_transactions(dec.str())
+    # the transactions come straight from a peer, so nothing that goes
+    # wrong while hashing them may escape as anything but a parse error
+    try:
+        block = Block(parent_hash=parent_hash,
+                      transactionlist=transactionlist,
+                      owner_pubkey=owner_pubkey,
+                      signed_node_hash=signed_node_hash,
+                      round=round,
+                      index=index,
+                      ticket_number=ticket_number)
+    except Exception as e:
+        raise MessageParseError(f"invalid block: {e!r}") from e
+    # every derived field is recomputed, so a block can't claim a hash
+    # that doesn't match its contents
+    if block.hash != hash:
+        raise MessageParseError(f"block hash mismatch: got {hash.hex()[0:8]}, computed {block.hash.hex()[0:8]}")
+    return block
+
+def encode_header(enc: Encoder, header: BlockHeader):
+    enc.short_bytes(header.hash)
+    enc.short_bytes(header.parent_hash)
+    enc.short_bytes(header.owner_pubkey)
+    enc.short_bytes(header.signed_node_hash)
+    enc.u32(header.round)
+    enc.u32(header.index)
+    enc.u32(header.ticket_number)
+    enc.short_bytes(header.transaction_hash)
+
+def decode_header(dec: Decoder) -> BlockHeader:
+    hash = dec.short_view()
+    header = BlockHeader(parent_hash=dec.short_bytes(),
+                         owner_pubkey=dec.short_bytes(),
+                         signed_node_hash=dec.short_bytes(),
+                         round=dec.u32(),
+                         index=dec.u32(),
+                         ticket_number=dec.u32(),
+                         transaction_hash=dec.short_bytes())
+    if header.hash != hash:
+        raise MessageParseError(f"header hash mismatch: got {hash.hex()[0:8]}, computed {header.hash.hex()[0:8]}")
+    return header
+
+def peek_block_hash(raw: bytes) -> Optional[memoryview]:
+    """Hash of the block (or header) carried by a BlockBroadcast or
+    HeaderBroadcast frame, read in place without decoding the message;
+    None for any other message."""
+    if len(raw) < 3 or raw[0] != WIRE_VERSION:
+        return None
+    if raw[1] not in (MessageCode.BLOCK_BROADCAST, MessageCode.HEADER_BROADCAST):
+        return None
+    size = raw[2]
+    if len(raw) < 3 + size:
+        return None
+    return memoryview(raw)[3:3 + size]
+
 class Message:
-    """Class that represents the protocol message frames."""
+    """Class that represents the protocol message frames.
+
+    On the wire every message is [WIRE_VERSION: u8][code: u8][payload],
+    where the payload is written by encode() and read back by decode()
+    of the class registered for that code."""
+
+    code = MessageCode.UNDEFINED
+    registry: dict[int, type[Message]] = {}
 
-    def __init__(self):
-        self.code = 0x0
-        pass
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Message.registry[cls.code] = cls
+
+    def encode(self, enc: Encoder):
+        raise NotImplementedError
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> Self:
+        raise NotImplementedError
 
     def serialize(self) -> bytes:
-        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        enc = Encoder()
+        enc.u8(WIRE_VERSION)
+        enc.u8(self.code)
+        self.encode(enc)
+        return enc.getvalue()
 
     @classmethod
     def deserialize(cls, raw) -> Self:
-        return pickle.loads(raw)
+        try:
+            dec = Decoder(raw)
+            version = dec.u8()
+            if version != WIRE_VERSION:
+                raise MessageParseError(f"unsupported wire version {version}")
+            code = dec.u8()
+            message_class = Message.registry.get(code)
+            if message_class is None:
+                raise MessageParseError(f"unknown message code {code}")
+            msg = message_class.decode(dec)
+            dec.finish()
+        except CodecError as e:
+            raise MessageParseError(str(e)) from e
+        if not isinstance(msg, cls):
+            raise MessageParseError(f"expected {cls.__name__}, got {message_class.__name__}")
+        return msg
 
 
 class Hello(Message):
+    code = MessageCode.HELLO
+
     def __init__(self, peer_id: bytes, peer_port: int | str):
-        self.code = MessageCode.HELLO
         self.peer_id = peer_id
         self.peer_port = peer_port
 
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.u16(int(self.peer_port))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> Hello:
+        return cls(dec.short_bytes(), dec.u16())
+
     def __str__(self):
         return f"Hello(id={self.peer_id.hex()[0:8]}, port={self.peer_port})"
 
 class BlockBroadcast(Message):
+    code = MessageCode.BLOCK_BROADCAST
+
     def __init__(self, block: Block, peer_id: bytes):
-        self.code = MessageCode.BLOCK_BROADCAST
         self.block = block
         self.peer_id = peer_id
 
+    def encode(self, enc: Encoder):
+        encode_block(enc, self.block)
+        enc.short_bytes(self.peer_id)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> BlockBroadcast:
+        return cls(decode_block(dec), dec.short_bytes())
+
     def __str__(self):
         return self.block.__str__()
-    
+
     def __repr__(self):
         return self.__str__()
 
 class PeerListRequest(Message):
+    code = MessageCode.PEER_LIST_REQUEST
+
     def __init__(self, node_id: bytes):
-        self.code = MessageCode.PEER_LIST_REQUEST
         self.node_id = node_id
 
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.node_id)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> PeerListRequest:
+        return cls(dec.short_bytes())
+
 class PeerForgetRequest(Message):
+    code = MessageCode.PEER_FORGET_REQUEST
+
     def __init__(self, peer_id: bytes):
         self.peer_id = peer_id
-        self.code = MessageCode.PEER_FORGET_REQUEST
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> PeerForgetRequest:
+        return cls(dec.short_bytes())
 
 class PeerList(Message):
+    code = MessageCode.PEER_LIST
+
     def __init__(self, peerlist: list[tuple[str, str | int, bytes]]):
-        self.code = MessageCode.PEER_LIST
         self.peerlist = peerlist
 
+    def encode(self, enc: Encoder):
+        def encode_peer(peer):
+            ip, port, id = peer
+            enc.short_str(ip)
+            enc.u16(int(port))
+            enc.short_bytes(id)
+        enc.list(self.peerlist, encode_peer)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> PeerList:
+        return cls(dec.list(lambda: (dec.short_str(), dec.u16(), dec.short_bytes())))
+
 # Ask for the last `block_count` blocks in peer's blockchain view
 class ResyncRequest(Message):
+    code = MessageCode.RESYNC_REQUEST
+
     def __init__(self, peer_id: bytes, block_index: int):
         self.peer_id = peer_id
         self.block_index = block_index
 
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.i64(self.block_index)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> ResyncRequest:
+        return cls(dec.short_bytes(), dec.i64())
+
     def __str__(self):
         return f"ResyncRequest(peer_id={self.peer_id})"
 
@@ -82,5 +259,208 @@ class ResyncRequest(Message):
         return self.__str__()
 
 class ResyncResponse(Message):
+    code = MessageCode.RESYNC_RESPONSE
+
     def __init__(self, block_received: Block):
         self.block_received = block_received
+
+    def encode(self, enc: Encoder):
+        enc.optional(self.block_received, lambda block: encode_block(enc, block))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> ResyncResponse:
+        return cls(dec.optional(lambda: decode_block(dec)))
+
+# Ask for up to `count` consecutive blocks starting at `start_index`;
+# negative indices count from the end of the peer's chain
+class ResyncRangeRequest(Message):
+    code = MessageCode.RESYNC_RANGE_REQUEST
+
+    def __init__(self, peer_id: bytes, start_index: int, count: int):
+        self.peer_id = peer_id
+        self.start_index = start_index
+        self.count = count
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.i64(self.start_index)
+        enc.u32(self.count)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> ResyncRangeRequest:
+        return cls(dec.short_bytes(), dec.i64(), dec.u32())
+
+    def __str__(self):
+        return f"ResyncRangeRequest(peer_id={self.peer_id.hex()[0:8]}, start_index={self.start_index}, count={self.count})"
+
+    def __repr__(self):
+        return self.__str__()
+
+# `start_index` is the absolute index of blocks[0]; an empty list means
+# the peer has no blocks in the requested range
+class ResyncRangeResponse(Message):
+    code = MessageCode.RESYNC_RANGE_RESPONSE
+
+    def __init__(self, start_index: int, blocks: list[Block]):
+        self.start_index = start_index
+        self.blocks = blocks
+
+    def encode(self, enc: Encoder):
+        enc.i64(self.start_index)
+        enc.list(self.blocks, lambda block: encode_block(enc, block))
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> ResyncRangeResponse:
+        return cls(dec.i64(), dec.list(lambda: decode_block(dec)))
+
+    def __str__(self):
+        return f"ResyncRangeResponse(start_index={self.start_index}, blocks={len(self.blocks)})"
+
+    def __repr__(self):
+        return self.__str__()
+
+# Block locator of the sender's chain, used to find the latest block that
+# both chains have in common (see BlockChain.block_locator)
+class LocatorRequest(Message):
+    code = MessageCode.LOCATOR_REQUEST
+
+    def __init__(self, peer_id: bytes, locator: list[bytes]):
+        self.peer_id = peer_id
+        self.locator = locator
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.list(self.locator, enc.short_bytes)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> LocatorRequest:
+        return cls(dec.short_bytes(), dec.list(dec.short_bytes))
+
+    def __str__(self):
+        return f"LocatorRequest(peer_id={self.peer_id.hex()[0:8]}, locator={len(self.locator)} hashes)"
+
+    def __repr__(self):
+        return self.__str__()
+
+# `ancestor_index` is None if none of the locator hashes is in the chain;
+# `height` is the number of blocks in the responding peer's chain
+class LocatorResponse(Message):
+    code = MessageCode.LOCATOR_RESPONSE
+
+    def __init__(self, ancestor_index: Optional[int], height: int):
+        self.ancestor_index = ancestor_index
+        self.height = height
+
+    def encode(self, enc: Encoder):
+        enc.optional(self.ancestor_index, enc.i64)
+        enc.i64(self.height)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> LocatorResponse:
+        return cls(dec.optional(dec.i64), dec.i64())
+
+    def __str__(self):
+        return f"LocatorResponse(ancestor_index={self.ancestor_index}, height={self.height})"
+
+    def __repr__(self):
+        return self.__str__()
+
+# Announces a block without its transactions; peers that would accept it
+# ask for the body with a BodyRequest
+class HeaderBroadcast(Message):
+    code = MessageCode.HEADER_BROADCAST
+
+    def __init__(self, header: BlockHeader, peer_id: bytes):
+        self.header = header
+        self.peer_id = peer_id
+
+    def encode(self, enc: Encoder):
+        encode_header(enc, self.header)
+        enc.short_bytes(self.peer_id)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> HeaderBroadcast:
+        return cls(decode_header(dec), dec.short_bytes())
+
+    def __str__(self):
+        return self.header.__str__()
+
+    def __repr__(self):
+        return self.__str__()
+
+class BodyRequest(Message):
+    code = MessageCode.BODY_REQUEST
+
+    def __init__(self, peer_id: bytes, block_hash: bytes):
+        self.peer_id = peer_id
+        self.block_hash = block_hash
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.short_bytes(self.block_hash)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> BodyRequest:
+        return cls(dec.short_bytes(), dec.short_bytes())
+
+    def __str__(self):
+        return f"BodyRequest(peer_id={self.peer_id.hex()[0:8]}, block_hash={self.block_hash.hex()[0:8]})"
+
+# `transactions` is None if the peer doesn't have the block (anymore)
+class BodyResponse(Message):
+    code = MessageCode.BODY_RESPONSE
+
+    def __init__(self, peer_id: bytes, block_hash: bytes, transactions: Optional[str]):
+        self.peer_id = peer_id
+        self.block_hash = block_hash
+        self.transactions = transactions
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.short_bytes(self.block_hash)
+        enc.optional(self.transactions, enc.str)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> BodyResponse:
+        return cls(dec.short_bytes(), dec.short_bytes(), dec.optional(dec.str))
+
+    def __str__(self):
+        return f"BodyResponse(peer_id={self.peer_id.hex()[0:8]}, block_hash={self.block_hash.hex()[0:8]}, found={self.transactions is not None})"
+
+# Hashes of blocks the sender has; peers pull the ones they lack with an
+# InventoryRequest and get them back as BlockBroadcasts
+class InventoryAnnounce(Message):
+    code = MessageCode.INVENTORY_ANNOUNCE
+
+    def __init__(self, peer_id: bytes, hashes: list[bytes]):
+        self.peer_id = peer_id
+        self.hashes = hashes
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.list(self.hashes, enc.short_bytes)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> InventoryAnnounce:
+        return cls(dec.short_bytes(), dec.list(dec.short_bytes))
+
+    def __str__(self):
+        return f"InventoryAnnounce(peer_id={self.peer_id.hex()[0:8]}, hashes={[hash.hex()[0:8] for hash in self.hashes]})"
+
+class InventoryRequest(Message):
+    code = MessageCode.INVENTORY_REQUEST
+
+    def __init__(self, peer_id: bytes, hashes: list[bytes]):
+        self.peer_id = peer_id
+        self.hashes = hashes
+
+    def encode(self, enc: Encoder):
+        enc.short_bytes(self.peer_id)
+        enc.list(self.hashes, enc.short_bytes)
+
+    @classmethod
+    def decode(cls, dec: Decoder) -> InventoryRequest:
+        return cls(dec.short_bytes(), dec.list(dec.short_bytes))
+
+    def __str__(self):
+        return f"InventoryRequest(peer_id={self.peer_id.hex()[0:8]}, hashes={[hash.hex()[0:8] for hash in self.hashes]})"
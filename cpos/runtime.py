@@ -0,0 +1,147 @@
+from __future__ import annotations
+import asyncio
+import logging
+from time import time
+from typing import TYPE_CHECKING
+import zmq.asyncio
+
+if TYPE_CHECKING:
+    from cpos.node import Node
+
+class AsyncNodeRuntime:
+    """Drives a Node from an asyncio event loop instead of Node.loop().
+
+    Rounds start on a timer aimed at the exact round boundary, and the
+    receive task wakes up as soon as a frame arrives and then drains
+    everything that is queued on the socket. Resync, peer maintenance and
+    block request retries run as tasks of their own. All of them share the
+    event loop thread, so the node's state is never touched concurrently;
+    the only blocking call (asking the beacon for more peers) runs in a
+    worker thread and doesn't touch the node."""
+
+    def __init__(self, node: Node, maintenance_interval: float = 1.0):
+        logger = logging.getLogger(__name__ + node.id.hex())
+        handler = logging.StreamHandler()
+        formatter = logging.Formatter(f"[%(asctime)s][%(levelname)s] {__name__}: [{node.id.hex()[0:8]}] %(message)s")
+        logger.setLevel(logging.INFO)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        self.logger = logger
+
+        self.node = node
+        self.maintenance_interval = maintenance_interval
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        node = self.node
+        # both sockets share the same underlying ZMQ socket: the shadow is
+        # used to wait for frames, the original one to drain the queue
+        self.socket = zmq.asyncio.Socket.shadow(node.network.socket.underlying)
+        self.halted = asyncio.Event()
+        self.wakeup_resync = asyncio.Event()
+        self.wakeup_validation = asyncio.Event()
+        self.initial_round = node.bc.current_round
+        node.greet_peers()
+
+        coroutines = [self.rounds(), self.receive(), self.resync(), self.maintain_peers(), self.retry_requests()]
+        if node.validation is not None:
+            coroutines.append(self.insert_validated())
+        tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+        for task in tasks:
+            task.add_done_callback(self.on_task_done)
+        try:
+            await self.halted.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            node.shutdown()
+
+    # the node can't keep running without any one of its tasks, so a
+    # failing task halts it right away
+    def on_task_done(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is None:
+            return
+        self.logger.error(f"task {task.get_coro().__name__} failed, halting", exc_info=task.exception())
+        self.halt()
+
+    def halt(self):
+        self.node.should_halt = True
+        self.halted.set()
+
+    async def rounds(self):
+        node = self.node
+        bc = node.bc
+        bc.update_round()
+        while True:
+            if node.reached_total_rounds(self.initial_round):
+                self.halt()
+                return
+            node.on_new_round()
+            self.wakeup_resync.set()
+
+            # sleep until the next round starts; update_round() derives the
+            # round from the clock, so retry if we woke up a bit too early
+            next_round = bc.current_round + 1
+            while bc.current_round < next_round:
+                start = bc.genesis.timestamp + next_round * bc.parameters.round_time
+                await asyncio.sleep(max(0.0, start - time()))
+                bc.update_round()
+
+    async def receive(self):
+        node = self.node
+        while True:
+            frames = await self.socket.recv_multipart()
+            node.handle_message(node.network.accept(frames))
+            # handle whatever else is queued, a batch at a time so that the
+            # other tasks still get to run during a burst
+            while messages := node.network.drain(node.read_batch_size):
+                for raw in messages:
+                    node.handle_message(raw)
+                self.wakeup_validation.set()
+                await asyncio.sleep(0)
+            self.wakeup_validation.set()
+            self.wakeup_resync.set()
+
+    async def insert_validated(self):
+        node = self.node
+        while True:
+            head = node.validation.head()
+            if head is None:
+                await self.wakeup_validation.wait()
+                self.wakeup_validation.clear()
+                continue
+            # wait for the oldest block to be verified, then insert it along
+            # with whatever else is ready
+            await asyncio.wrap_future(head)
+            node.process_validated_blocks()
+            self.wakeup_resync.set()
+
+    async def resync(self):
+        node = self.node
+        while True:
+            await self.wakeup_resync.wait()
+            self.wakeup_resync.clear()
+            # if we detect a fork, resync with a node that sent a random missed block
+            if node.should_resync():
+                node.start_resync()
+
+    async def maintain_peers(self):
+        node = self.node
+        while True:
+            # Node.halt() may be called from another thread
+            if node.should_halt:
+                self.halt()
+                return
+            additional_peers = await asyncio.to_thread(node.fetch_additional_peers)
+            node.connect_peers(additional_peers)
+            node.trim_peers()
+            await asyncio.sleep(self.maintenance_interval)
+
+    async def retry_requests(self):
+        node = self.node
+        while True:
+            await asyncio.sleep(node.requested_blocks.timeout / 2)
+            node.retry_requests()
@@ -0,0 +1,133 @@
+from __future__ import annotations
+import struct
+from typing import Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+
+class CodecError(ValueError):
+    pass
+
+class Encoder:
+    """Appends little-endian, fixed-width fields to a growing buffer.
+    Byte strings and text are prefixed with their length: one byte for
+    short ones (hashes, keys, signatures), four bytes otherwise."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def u8(self, value: int):
+        self.buffer += _U8.pack(value)
+
+    def u16(self, value: int):
+        self.buffer += _U16.pack(value)
+
+    def u32(self, value: int):
+        self.buffer += _U32.pack(value)
+
+    def i64(self, value: int):
+        self.buffer += _I64.pack(value)
+
+    def short_bytes(self, value: bytes):
+        if len(value) > 0xFF:
+            raise CodecError(f"short byte string too long ({len(value)} bytes)")
+        self.buffer += _U8.pack(len(value))
+        self.buffer += value
+
+    def bytes(self, value: bytes):
+        self.buffer += _U32.pack(len(value))
+        self.buffer += value
+
+    def str(self, value: str):
+        self.bytes(value.encode("utf-8"))
+
+    def short_str(self, value: str):
+        self.short_bytes(value.encode("utf-8"))
+
+    def optional(self, value: Optional[T], encode: Callable[[T], None]):
+        self.u8(value is not None)
+        if value is not None:
+            encode(value)
+
+    def list(self, values: list[T], encode: Callable[[T], None]):
+        self.u32(len(values))
+        for value in values:
+            encode(value)
+
+    def getvalue(self) -> bytes:
+        return bytes(self.buffer)
+
+
+class Decoder:
+    """Reads back what Encoder wrote. The input is only ever sliced
+    through a memoryview, so nothing is copied until a field is
+    materialized."""
+
+    def __init__(self, raw: bytes):
+        self.view = memoryview(raw)
+        self.offset = 0
+
+    def _take(self, size: int) -> memoryview:
+        end = self.offset + size
+        if end > len(self.view):
+            raise CodecError(f"truncated input: wanted {size} bytes at offset {self.offset}, got {len(self.view) - self.offset}")
+        chunk = self.view[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def _unpack(self, fmt: struct.Struct) -> int:
+        if self.offset + fmt.size > len(self.view):
+            raise CodecError(f"truncated input at offset {self.offset}")
+        value = fmt.unpack_from(self.view, self.offset)[0]
+        self.offset += fmt.size
+        return value
+
+    def u8(self) -> int:
+        return self._unpack(_U8)
+
+    def u16(self) -> int:
+        return self._unpack(_U16)
+
+    def u32(self) -> int:
+        return self._unpack(_U32)
+
+    def i64(self) -> int:
+        return self._unpack(_I64)
+
+    def short_view(self) -> memoryview:
+        return self._take(self.u8())
+
+    def view_bytes(self) -> memoryview:
+        return self._take(self.u32())
+
+    def short_bytes(self) -> bytes:
+        return bytes(self.short_view())
+
+    def bytes(self) -> bytes:
+        return bytes(self.view_bytes())
+
+    def str(self) -> str:
+        return self._text(self.view_bytes())
+
+    def short_str(self) -> str:
+        return self._text(self.short_view())
+
+    def _text(self, view: memoryview) -> str:
+        try:
+            return str(view, "utf-8")
+        except UnicodeDecodeError as e:
+            raise CodecError(f"invalid text field: {e}") from e
+
+    def optional(self, decode: Callable[[], T]) -> Optional[T]:
+        return decode() if self.u8() else None
+
+    def list(self, decode: Callable[[], T]) -> list[T]:
+        return [decode() for _ in range(self.u32())]
+
+    def finish(self):
+        if self.offset != len(self.view):
+            raise CodecError(f"{len(self.view) - self.offset} trailing bytes")
@@ -0,0 +1,39 @@
+# https://en.wikipedia.org/wiki/Fenwick_tree
+class FenwickTree:
+    """Binary indexed tree over a growable array of integers: point
+    updates and prefix sums in O(log n). Positions are 0-based."""
+
+    def __init__(self, capacity: int = 64):
+        self.values: list[int] = [0] * capacity
+        self.tree: list[int] = [0] * (capacity + 1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _grow(self, size: int):
+        capacity = max(size, 2 * len(self.values))
+        self.values += [0] * (capacity - len(self.values))
+        # rebuild in O(n) by pushing each node into its parent
+        self.tree = [0] + self.values.copy()
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                self.tree[parent] += self.tree[i]
+
+    def add(self, position: int, delta: int):
+        if position >= len(self.values):
+            self._grow(position + 1)
+        self.values[position] += delta
+        i = position + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, position: int) -> int:
+        """Sum of the values at positions 0..position (inclusive)."""
+        i = min(position + 1, len(self.values))
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
@@ -1,4 +1,10 @@
+from __future__ import annotations
+import mmap
+import os
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
+from typing import Iterable, Optional
 
 def _is_power_of_two(n: int) -> bool:
     return (n & (n-1)) == 0 and n != 0
@@ -11,24 +17,51 @@ def _calculate_padding(n: int):
         # TODO: could probably be done more efficiently with binary operations
         return (1 << n.bit_length()) - n
 
+_hashing_pool: Optional[ThreadPoolExecutor] = None
+
+# shared by every MerkleTree, created on first use
+def _get_hashing_pool() -> ThreadPoolExecutor:
+    global _hashing_pool
+    if _hashing_pool is None:
+        _hashing_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="cpos-merkle")
+    return _hashing_pool
+
 # https://github.com/bitcoin/bips/blob/master/bip-0098.mediawiki
 class MerkleTree:
-    def __init__(self, data: bytes, chunk_size: int = 8192):
+    """Merkle tree over the sha256 of each `chunk_size` bytes of data.
+
+    With `workers` > 1 the chunks are hashed in that many slices on a
+    shared thread pool; sha256 releases the GIL while hashing large
+    buffers, so this scales with cores for large inputs and chunks."""
+
+    def __init__(self, data: bytes, chunk_size: int = 8192, workers: int = 1):
         if not data:
             raise TypeError("MerkleTree input data cannot be empty")
         self.data = data
         self.chunk_size = chunk_size
+        self.workers = workers
         self.chunks = self._create_hashed_chunks()
+        self.leaf_count = len(self.chunks)
         self._insert_padding()
 
+    def _hash_chunks(self, view: memoryview, first: int, last: int) -> list[bytes]:
+        chunk_size = self.chunk_size
+        return [sha256(view[offset:offset + chunk_size]).digest()
+                for offset in range(first * chunk_size, last * chunk_size, chunk_size)]
+
     def _create_hashed_chunks(self) -> list[bytes]:
-        size = len(self.data)
+        # chunks are hashed out of a view instead of being copied out
+        view = memoryview(self.data).cast("B")
+        count = -(-len(view) // self.chunk_size)
+        if self.workers <= 1 or count < 2:
+            return self._hash_chunks(view, 0, count)
+        step = -(-count // self.workers)
+        pool = _get_hashing_pool()
+        futures = [pool.submit(self._hash_chunks, view, first, min(first + step, count))
+                   for first in range(0, count, step)]
         chunks = []
-        for offset in range(0, size, self.chunk_size):
-            start = offset
-            end = offset + self.chunk_size
-            chunk = sha256(self.data[start:end]).digest()
-            chunks.append(chunk)
+        for future in futures:
+            chunks += future.result()
         return chunks
 
     """
@@ -41,19 +74,220 @@ class MerkleTree:
             self.chunks += [bytes([0x00])] * padding
 
     def merkle_root(self) -> bytes:
-        def get_index(i: int, round: int):
-            return i * (1 << round)
-        size = len(self.chunks)
-        round = 0
-        t = self.chunks
-        while size > 1:
-            # somewhat ugly solution, could probably be improved
-            for i in range(0, size, 2):
-                first = get_index(i, round)
-                second = get_index(i+1, round)
-                hash = sha256(t[first] + t[second])
-                t[first]= hash.digest()
-                pass
-            size >>= 1  # size /= 2
-            round += 1
-        return t[0]
+        # every level is built in place at the front of a single buffer,
+        # preallocated for the leaves plus one slot of padding; the padding
+        # is never hashed, since a subtree of padding leaves always has the
+        # same root (_ZERO_HASHES)
+        count = self.leaf_count
+        nodes = self.chunks[:count] + [b""]
+        for height in range((len(self.chunks) - 1).bit_length()):
+            if count & 1:
+                nodes[count] = _ZERO_HASHES[height]
+                count += 1
+            # a parent only overwrites nodes that were already read
+            for i in range(0, count, 2):
+                h = sha256(nodes[i])
+                h.update(nodes[i + 1])
+                nodes[i >> 1] = h.digest()
+            count >>= 1
+        return nodes[0]
+
+# the root of a subtree of height `level` that only holds padding, for
+# the padding leaf b"\x00" used by MerkleTree
+def _zero_hashes(height: int) -> list[bytes]:
+    zeros = [bytes([0x00])]
+    for _ in range(height):
+        zeros.append(sha256(zeros[-1] + zeros[-1]).digest())
+    return zeros
+
+_ZERO_HASHES = _zero_hashes(64)
+
+class IncrementalMerkleTree:
+    """Merkle tree over a growing list of leaf hashes.
+
+    Leaves are padded with zeros up to the next power of two, just as in
+    MerkleTree, so both give the same root for the same leaves. Every
+    internal node is cached, so appending a leaf only rehashes the path
+    from it to the root, and inclusion proofs are read off the cache; both
+    are O(log n)."""
+
+    def __init__(self, leaves: Iterable[bytes] = ()):
+        # levels[0] holds the leaves and levels[l][i] the root of the
+        # subtree over levels[l - 1][2i] and levels[l - 1][2i + 1] (the
+        # latter being padding if it doesn't exist yet)
+        self.levels: list[list[bytes]] = [[]]
+        for leaf in leaves:
+            self.append(leaf)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def append(self, leaf: bytes):
+        self.levels[0].append(leaf)
+        index = len(self.levels[0]) - 1
+        level = 0
+        while len(self.levels[level]) > 1:
+            nodes = self.levels[level]
+            left = nodes[index & ~1]
+            right = nodes[index | 1] if index | 1 < len(nodes) else _ZERO_HASHES[level]
+            parent = sha256(left + right).digest()
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            index >>= 1
+            parents = self.levels[level + 1]
+            if index < len(parents):
+                parents[index] = parent
+            else:
+                parents.append(parent)
+            level += 1
+
+    def root(self) -> bytes:
+        if not self.levels[0]:
+            raise ValueError("empty Merkle tree has no root")
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> list[bytes]:
+        """The sibling of each node on the path from leaf `index` to the
+        root, bottom-up."""
+        if not 0 <= index < len(self):
+            raise IndexError(f"no leaf at index {index}")
+        proof = []
+        for level, nodes in enumerate(self.levels[:-1]):
+            sibling = index ^ 1
+            proof.append(nodes[sibling] if sibling < len(nodes) else _ZERO_HASHES[level])
+            index >>= 1
+        return proof
+
+    @staticmethod
+    def verify(leaf: bytes, index: int, proof: list[bytes], root: bytes) -> bool:
+        return verify_proof(leaf, index, proof, root)
+
+# checks an inclusion proof (the siblings on the path from the leaf to the
+# root, bottom-up) produced by IncrementalMerkleTree or MerkleBuilder
+def verify_proof(leaf: bytes, index: int, proof: list[bytes], root: bytes) -> bool:
+    node = leaf
+    for sibling in proof:
+        if index & 1:
+            node = sha256(sibling + node).digest()
+        else:
+            node = sha256(node + sibling).digest()
+        index >>= 1
+    return index == 0 and node == root
+
+class MerkleBuilder:
+    """Builds the same root as MerkleTree, but from data that arrives in
+    pieces (see update(), from_iterable() and from_file()), without ever
+    holding more than one chunk of it.
+
+    Chunks are hashed as soon as they are complete, and only the roots of
+    the complete subtrees seen so far are kept (at most one per height,
+    so O(log n) of them). Inclusion proofs are only kept for the chunk
+    indices passed as `track`, since the other nodes are discarded."""
+
+    def __init__(self, chunk_size: int = 8192, track: Iterable[int] = ()):
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.leaf_count = 0
+        # (height, index of the first leaf, hash) of each complete
+        # subtree, by decreasing height
+        self.pending: list[tuple[int, int, bytes]] = []
+        self.tracked = sorted(set(track))
+        self.proofs: dict[int, list[bytes]] = {index: [] for index in self.tracked}
+        self._root: Optional[bytes] = None
+
+    @classmethod
+    def from_iterable(cls, pieces: Iterable[bytes], chunk_size: int = 8192, track: Iterable[int] = ()) -> MerkleBuilder:
+        builder = cls(chunk_size, track)
+        for piece in pieces:
+            builder.update(piece)
+        builder.finish()
+        return builder
+
+    @classmethod
+    def from_file(cls, path: str, chunk_size: int = 8192, track: Iterable[int] = ()) -> MerkleBuilder:
+        # mapped pages are read in as they are hashed, and can be dropped
+        # again by the OS afterwards
+        builder = cls(chunk_size, track)
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size > 0:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with memoryview(mapped) as view:
+                        for offset in range(0, len(view), chunk_size):
+                            builder.update(view[offset:offset + chunk_size])
+        builder.finish()
+        return builder
+
+    def update(self, data: bytes):
+        if self._root is not None:
+            raise ValueError("MerkleBuilder was already finished")
+        view = memoryview(data).cast("B")
+        offset = 0
+        if self.buffer:
+            offset = min(len(view), self.chunk_size - len(self.buffer))
+            self.buffer += view[:offset]
+            if len(self.buffer) < self.chunk_size:
+                return
+            self._add_leaf(sha256(self.buffer).digest())
+            self.buffer.clear()
+        # whole chunks are hashed straight out of the input
+        while len(view) - offset >= self.chunk_size:
+            self._add_leaf(sha256(view[offset:offset + self.chunk_size]).digest())
+            offset += self.chunk_size
+        self.buffer += view[offset:]
+
+    def _tracked_in(self, start: int, end: int) -> list[int]:
+        return self.tracked[bisect_left(self.tracked, start):bisect_left(self.tracked, end)]
+
+    # joins two sibling subtrees of the given height, recording each one
+    # in the proofs of the tracked leaves under the other
+    def _join(self, height: int, start: int, left: bytes, right: bytes) -> bytes:
+        middle = start + (1 << height)
+        for index in self._tracked_in(start, middle):
+            self.proofs[index].append(right)
+        for index in self._tracked_in(middle, middle + (1 << height)):
+            self.proofs[index].append(left)
+        return sha256(left + right).digest()
+
+    def _add_leaf(self, leaf: bytes):
+        height, start, node = 0, self.leaf_count, leaf
+        self.leaf_count += 1
+        while self.pending and self.pending[-1][0] == height:
+            _, start, left = self.pending.pop()
+            node = self._join(height, start, left, node)
+            height += 1
+        self.pending.append((height, start, node))
+
+    def finish(self) -> bytes:
+        """Hashes the last (partial) chunk and returns the root."""
+        if self._root is not None:
+            return self._root
+        if self.buffer:
+            self._add_leaf(sha256(self.buffer).digest())
+            self.buffer.clear()
+        if not self.pending:
+            raise ValueError("MerkleBuilder input data cannot be empty")
+        # pad the smallest subtrees with zeros until they can be joined to
+        # the next larger one, as if the leaves were padded up to a power
+        # of two
+        height, start, node = self.pending.pop()
+        while self.pending:
+            if height == self.pending[-1][0]:
+                _, start, left = self.pending.pop()
+                node = self._join(height, start, left, node)
+            else:
+                node = self._join(height, start, node, _ZERO_HASHES[height])
+            height += 1
+        self._root = node
+        return node
+
+    def root(self) -> bytes:
+        if self._root is None:
+            raise ValueError("MerkleBuilder wasn't finished yet")
+        return self._root
+
+    def proof(self, index: int) -> list[bytes]:
+        if index not in self.proofs:
+            raise KeyError(f"leaf {index} wasn't tracked")
+        if self._root is None or index >= self.leaf_count:
+            raise IndexError(f"no leaf at index {index}")
+        return self.proofs[index]
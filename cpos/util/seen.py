@@ -0,0 +1,31 @@
+from collections import OrderedDict
+
+class SeenFilter:
+    """Remembers the last `capacity` keys (e.g. block hashes) added to it.
+
+    Membership is a single lookup in an LRU dict; hashing a 32-byte key
+    is already cheaper than any pre-check in front of it would be.
+
+    Keys may be bytes or memoryviews over bytes, so a hash can be looked
+    up straight out of a received frame without copying it."""
+
+    def __init__(self, capacity: int = 8192):
+        self.capacity = capacity
+        self.lru: OrderedDict[bytes, None] = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key in self.lru
+
+    def __len__(self):
+        return len(self.lru)
+
+    def add(self, key) -> bool:
+        """Adds the key; returns False if it was already present."""
+        key = bytes(key)
+        if key in self.lru:
+            self.lru.move_to_end(key)
+            return False
+        self.lru[key] = None
+        if len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+        return True
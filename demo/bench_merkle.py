@@ -0,0 +1,59 @@
+import argparse
+import os
+from hashlib import sha256
+from time import perf_counter
+
+from cpos.util.merkle import MerkleTree, _is_power_of_two, _calculate_padding
+
+# the MerkleTree implementation before parallel hashing, kept as a
+# reference for both the roots and the timings
+class ReferenceMerkleTree:
+    def __init__(self, data: bytes, chunk_size: int = 8192):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.chunks = [sha256(data[offset:offset + chunk_size]).digest() for offset in range(0, len(data), chunk_size)]
+        if not _is_power_of_two(len(self.chunks)):
+            self.chunks += [bytes([0x00])] * _calculate_padding(len(self.chunks))
+
+    def merkle_root(self) -> bytes:
+        size = len(self.chunks)
+        round = 0
+        t = self.chunks
+        while size > 1:
+            for i in range(0, size, 2):
+                first = i * (1 << round)
+                second = (i + 1) * (1 << round)
+                t[first] = sha256(t[first] + t[second]).digest()
+            size >>= 1
+            round += 1
+        return t[0]
+
+def measure(build, repeat: int) -> tuple[float, bytes]:
+    best = float("inf")
+    root = b""
+    for _ in range(repeat):
+        start = perf_counter()
+        root = build().merkle_root()
+        best = min(best, perf_counter() - start)
+    return best, root
+
+def main():
+    parser = argparse.ArgumentParser(description="compare MerkleTree against the serial reference implementation")
+    parser.add_argument("--size", help="payload size in MiB", type=int, default=256)
+    parser.add_argument("--chunk-size", help="chunk size in bytes", type=int, default=8192)
+    parser.add_argument("--workers", help="worker counts to try", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--repeat", help="runs per configuration (the best one is reported)", type=int, default=3)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size * 1024 * 1024)
+    print(f"payload: {args.size} MiB, chunk size: {args.chunk_size} B, cpus: {os.cpu_count()}")
+
+    reference_time, reference_root = measure(lambda: ReferenceMerkleTree(data, args.chunk_size), args.repeat)
+    print(f"{'reference':>12}: {reference_time * 1000:9.1f} ms  {args.size / reference_time:8.1f} MiB/s")
+    for workers in sorted(set(args.workers)):
+        elapsed, root = measure(lambda: MerkleTree(data, args.chunk_size, workers=workers), args.repeat)
+        assert root == reference_root, f"root mismatch with {workers} workers"
+        print(f"{f'{workers} workers':>12}: {elapsed * 1000:9.1f} ms  {args.size / elapsed:8.1f} MiB/s  ({reference_time / elapsed:.2f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ import time
 
 from cpos.node import Node, NodeConfig
 from cpos.protocol.messages import Hello
-from demo.populate_mempool import populate_mempool
+from demo.populate_mempool import populate_mempool, populate_memory_mempool
 from demo.send_data import send_data
 
 def main():
@@ -37,7 +37,10 @@ def main():
     signal.signal(signal.SIGTERM, sighandler)
 
     # Separate thread for mempool populator
-    thread = threading.Thread(target=populate_mempool)
+    if node.mempool is not None:
+        thread = threading.Thread(target=populate_memory_mempool, args=(node.mempool,))
+    else:
+        thread = threading.Thread(target=populate_mempool)
     thread.start()
 
     try:
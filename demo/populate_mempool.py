@@ -12,6 +12,7 @@ HOST = "localhost"
 USER = "CPoS"
 PASSWORD = "CPoSPW"
 DATABASE = "mempool"
+COLUMNS = ("transaction_id", "value", "input_address", "output_address", "committed", "chosen", "transaction_hash", "data", "timestamp")
 INSERT_QUERY = "INSERT INTO transactions (transaction_id, value, input_address, output_address, committed, chosen, transaction_hash, data, timestamp) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
 
 PROGRAM_INTERRUPTED = False
@@ -104,6 +105,15 @@ def populate_mempool() -> None:
             print("Connection closed!")
 
 
+def populate_memory_mempool(mempool) -> None:
+    # same transactions as populate_mempool, added to a node's in-process
+    # cpos.core.mempool.Mempool instead
+    generator = RandomTransactionGenerator()
+    while not PROGRAM_INTERRUPTED:
+        mempool.add(dict(zip(COLUMNS, generator.generate_random_transactions())))
+        # without a database round-trip per insert, don't hog the GIL
+        sleep(0.001)
+
 
 if __name__ == "__main__":
     populate_mempool()
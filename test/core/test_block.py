@@ -1 +1,47 @@
 from cpos.core.block import Block
+from cpos.core.block import BlockHeader, lowest_proof_ticket
+from cpos.core.transactions import TransactionList
+import pytest
+
+def make_block() -> Block:
+    transactions = TransactionList()
+    transactions.set_transactions(str([{"transaction_id": 1}]))
+    return Block(parent_hash=bytes(32),
+                 transactionlist=transactions,
+                 owner_pubkey=b"owner",
+                 signed_node_hash=b"signature",
+                 round=3,
+                 index=2,
+                 ticket_number=1)
+
+def test_header_hash_matches_block():
+    block = make_block()
+    header = block.header()
+    assert isinstance(header, BlockHeader) and not isinstance(header, Block)
+    assert header.hash == block.hash
+    assert header.proof_hash == block.proof_hash
+    assert header.node_hash == block.node_hash
+
+def test_block_from_header():
+    block = make_block()
+    transactions = TransactionList()
+    transactions.set_transactions(block.transactions)
+    assert Block.from_header(block.header(), transactions).hash == block.hash
+
+    # the body must match the transaction_hash the header commits to
+    header = block.header()
+    header.transaction_hash = b"\x01"
+    header.update()
+    with pytest.raises(ValueError):
+        Block.from_header(header, transactions)
+
+def test_lowest_proof_ticket():
+    block = make_block()
+    proof_hashes = []
+    for ticket in range(20):
+        block.ticket_number = ticket
+        block.update()
+        proof_hashes.append(block.proof_hash)
+    for last_ticket in (0, 1, 5, 19):
+        expected = min(range(last_ticket + 1), key=lambda ticket: proof_hashes[ticket])
+        assert lowest_proof_ticket(block.node_hash, last_ticket) == expected
@@ -144,3 +144,151 @@ def test_merge():
     assert bc.blocks[-1] == fork_subchain[-1]
 
 
+
+def test_validation_cache():
+    from cpos.core.storage import MemoryStorage
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    bc = BlockChain(params, genesis=GenesisBlock(), storage=MemoryStorage())
+    privkey = Ed25519PrivateKey.generate()
+    block = Block(parent_hash=bc.genesis.hash,
+                  transactionlist=TransactionList(),
+                  owner_pubkey=privkey.public_key().public_bytes_raw(),
+                  signed_node_hash=b"",
+                  round=1,
+                  index=1,
+                  ticket_number=1)
+    block.signed_node_hash = privkey.sign(block.node_hash)
+    block.update()
+
+    assert bc.validate_block(block) == 1
+    assert len(bc.validation_cache) == 1
+    # same proof, so the signature isn't verified again
+    assert bc.validate_block(block) == 1
+    assert len(bc.validation_cache) == 1
+
+    # a ticket the proof doesn't cover still fails on a cache hit
+    block.ticket_number = 2
+    assert bc.validate_block(block) is None
+
+    # replaying the signature on a different round is a miss, and fails
+    block.ticket_number = 1
+    block.round = 2
+    block.update()
+    assert bc.validate_block(block) is None
+    assert len(bc.validation_cache) == 2
+
+def test_validate_blocks():
+    from cpos.core.storage import MemoryStorage
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    bc = BlockChain(params, genesis=GenesisBlock(), storage=MemoryStorage(), validation_workers=4)
+    blocks = []
+    for i in range(8):
+        privkey = Ed25519PrivateKey.generate()
+        block = Block(parent_hash=bc.genesis.hash,
+                      transactionlist=TransactionList(),
+                      owner_pubkey=privkey.public_key().public_bytes_raw(),
+                      signed_node_hash=b"",
+                      round=1,
+                      index=1,
+                      ticket_number=1)
+        block.signed_node_hash = privkey.sign(block.node_hash)
+        block.update()
+        blocks.append(block)
+    # tamper with one signature and one ticket
+    blocks[3].signed_node_hash = bytes(64)
+    blocks[5].ticket_number = 2
+
+    expected = [bc.validate_block(block) for block in blocks]
+    bc.validation_cache.clear()
+    assert bc.validate_blocks(blocks) == expected
+    assert expected.count(None) == 2
+    assert len(bc.validation_cache) == 8
+
+def build_chain(bc: BlockChain, privkey: Ed25519PrivateKey, length: int, first_round: int = 1) -> list[Block]:
+    # appends `length` blocks to the chain by hand, without validation
+    blocks = []
+    for i in range(length):
+        index = bc.number_of_blocks()
+        block = Block(parent_hash=bc.get_last_block_hash(),
+                      transactionlist=TransactionList(),
+                      owner_pubkey=privkey.public_key().public_bytes_raw(),
+                      signed_node_hash=b"",
+                      round=first_round + i,
+                      index=index,
+                      ticket_number=1)
+        block.signed_node_hash = privkey.sign(block.node_hash)
+        block.update()
+        bc.insert_block(block, 0, 0)
+        blocks.append(block)
+    return blocks
+
+def memory_blockchain() -> BlockChain:
+    from cpos.core.storage import MemoryStorage
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    return BlockChain(params, genesis=GenesisBlock(), storage=MemoryStorage())
+
+def test_blocks_in_range():
+    bc = memory_blockchain()
+    blocks = build_chain(bc, Ed25519PrivateKey.generate(), 5)
+
+    start, received = bc.blocks_in_range(-2, 2)
+    assert start == 4
+    assert [block.hash for block in received] == [block.hash for block in blocks[3:]]
+    # the genesis block is never sent
+    start, received = bc.blocks_in_range(-10, 3)
+    assert start == 1
+    assert [block.hash for block in received] == [block.hash for block in blocks[:3]]
+    assert bc.blocks_in_range(6, 3) == (6, [])
+
+def test_block_locator():
+    bc = memory_blockchain()
+    blocks = build_chain(bc, Ed25519PrivateKey.generate(), 40)
+    locator = bc.block_locator()
+    indexes = [bc.find_common_ancestor([hash]) for hash in locator]
+    assert indexes == [40, 39, 38, 37, 36, 35, 34, 33, 32, 31, 29, 25, 17, 1, 0]
+
+def test_find_common_ancestor():
+    ours = memory_blockchain()
+    theirs = memory_blockchain()
+    shared = build_chain(ours, Ed25519PrivateKey.generate(), 30)
+    for block in shared:
+        theirs.insert_block(block, 0, 0)
+    build_chain(ours, Ed25519PrivateKey.generate(), 3, first_round=31)
+    build_chain(theirs, Ed25519PrivateKey.generate(), 20, first_round=31)
+
+    assert theirs.find_common_ancestor(ours.block_locator()) == 30
+    assert ours.find_common_ancestor(theirs.block_locator()) <= 30
+    assert ours.find_common_ancestor([b"unknown"]) is None
+
+def test_accepts_header():
+    bc = memory_blockchain()
+    privkey = Ed25519PrivateKey.generate()
+    build_chain(bc, privkey, 2)
+
+    block = Block(parent_hash=bc.get_last_block_hash(),
+                  transactionlist=TransactionList(),
+                  owner_pubkey=privkey.public_key().public_bytes_raw(),
+                  signed_node_hash=b"",
+                  round=3,
+                  index=3,
+                  ticket_number=1)
+    block.signed_node_hash = privkey.sign(block.node_hash)
+    block.update()
+    header = block.header()
+
+    assert bc.accepts_header(header)
+    # accepting a header doesn't touch the chain or the sortition counters
+    assert bc.number_of_blocks() == 3
+    assert bc.chain_index.unconfirmed_num_suc() == [(1, 0), (2, 0)]
+    assert bc.insert(block)
+    assert bc.chain_index.unconfirmed_num_suc() == [(1, 1), (2, 1), (3, 0)]
+    assert not bc.accepts_header(header)
+
+    # a valid header that loses to the block in place still counts, as it
+    # would have in insert()
+    header.round = 2
+    header.update()
+    header.signed_node_hash = privkey.sign(header.node_hash)
+    header.update()
+    assert not bc.accepts_header(header)
+    assert bc.chain_index.unconfirmed_num_suc() == [(1, 2), (2, 2), (3, 0)]
@@ -0,0 +1,66 @@
+from cpos.core.chainindex import ChainIndex, ChainEntry
+
+def make_entry(index: int, confirmed: int = 0) -> ChainEntry:
+    return ChainEntry(index=index,
+                      hash=bytes([index]) * 32,
+                      round=index,
+                      parent_hash=bytes([index - 1]) * 32 if index > 0 else b"\x00",
+                      proof_hash=bytes([0xFF - index]) * 32,
+                      confirmed=confirmed,
+                      num_suc=0)
+
+def make_index(length: int) -> ChainIndex:
+    index = ChainIndex()
+    index.append(make_entry(0, confirmed=1))
+    for i in range(1, length):
+        index.append(make_entry(i))
+    return index
+
+def test_lookup_by_index_and_hash():
+    index = make_index(4)
+    assert len(index) == 4
+    assert index.at(2).hash == bytes([2]) * 32
+    assert index.of_hash(bytes([3]) * 32).index == 3
+    assert index.at(4) is None
+    assert index.of_hash(b"missing") is None
+
+def test_truncate():
+    index = make_index(5)
+    index.truncate(2)
+    assert len(index) == 2
+    assert not index.contains(bytes([3]) * 32)
+    assert index.last().index == 1
+
+def test_successful_sortition_only_counts_unconfirmed():
+    index = make_index(4)
+    index.add_successful_sortition(3, 2)
+    assert [index.num_suc(entry) for entry in index.entries] == [0, 2, 2, 0]
+    index.confirm(bytes([1]) * 32)
+    index.add_successful_sortition(4, 1)
+    assert [index.num_suc(entry) for entry in index.entries] == [0, 2, 3, 1]
+
+def test_num_suc_of_reappended_blocks():
+    index = make_index(4)
+    index.add_successful_sortition(4, 5)
+    index.truncate(2)
+    # a block that replaces a deleted one starts counting from zero
+    index.append(make_entry(2))
+    assert index.num_suc(index.at(1)) == 5
+    assert index.num_suc(index.at(2)) == 0
+    index.add_successful_sortition(3, 1)
+    assert index.num_suc(index.at(2)) == 1
+    # blocks coming back from storage keep their stored counter
+    reintroduced = make_entry(3)
+    reintroduced.num_suc = 7
+    index.append(reintroduced)
+    assert index.num_suc(index.at(3)) == 7
+
+def test_confirmation_moves_oldest_unconfirmed():
+    index = make_index(4)
+    assert index.oldest_unconfirmed().index == 1
+    index.confirm(bytes([1]) * 32)
+    assert index.last_confirmed().index == 1
+    assert index.oldest_unconfirmed().index == 2
+    index.truncate(1)
+    assert index.oldest_unconfirmed() is None
+    assert index.last_confirmed().index == 0
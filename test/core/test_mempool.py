@@ -0,0 +1,81 @@
+import random
+import threading
+from cpos.core.mempool import Mempool, transaction_size, transactions_size
+
+def make_row(transaction_id: int, value: float) -> dict:
+    return {"transaction_id": transaction_id, "value": value, "data": "x" * 50}
+
+def test_reserve_by_value():
+    mempool = Mempool()
+    values = [random.uniform(0, 200) for _ in range(100)]
+    for i, value in enumerate(values):
+        assert mempool.add(make_row(i, value))
+    assert not mempool.add(make_row(0, 1000.0))
+    assert len(mempool) == 100
+
+    reserved = mempool.reserve(block_size=10**6)
+    assert [row["value"] for row in reserved] == sorted(values, reverse=True)
+    assert len(mempool) == 0
+    assert mempool.reserve(block_size=10**6) == []
+
+def test_reserve_size_accounting():
+    mempool = Mempool()
+    for i in range(10):
+        mempool.add(make_row(i, 50.0 - i))
+    row_size = transaction_size(make_row(0, 50.0))
+
+    # exactly what str() of the selected rows takes
+    reserved = mempool.reserve(block_size=transactions_size(3 * row_size, 3))
+    assert len(str(reserved)) == transactions_size(3 * row_size, 3)
+    assert [row["transaction_id"] for row in reserved] == [0, 1, 2]
+    assert mempool.reserve(block_size=transactions_size(row_size, 1) - 1) == []
+    assert len(mempool) == 7
+
+def test_commit_and_release():
+    mempool = Mempool()
+    for i in range(5):
+        mempool.add(make_row(i, float(i)))
+    first = [row["transaction_id"] for row in mempool.reserve(block_size=transactions_size(2 * transaction_size(make_row(0, 0.0)), 2))]
+    assert first == [4, 3]
+
+    mempool.release(first)
+    assert len(mempool) == 5
+    second = [row["transaction_id"] for row in mempool.reserve(block_size=10**6)]
+    assert second == [4, 3, 2, 1, 0]
+
+    mempool.commit(second[:2])
+    mempool.release(second[2:])
+    assert 4 not in mempool and 3 not in mempool
+    assert [row["transaction_id"] for row in mempool.reserve(block_size=10**6)] == [2, 1, 0]
+
+def test_eviction():
+    mempool = Mempool(capacity=10)
+    for i in range(10):
+        mempool.add(make_row(i, float(i)))
+    # not more valuable than anything in the pool
+    assert not mempool.add(make_row(10, 0.0))
+    # evicts the least valuable pending transaction
+    assert mempool.add(make_row(11, 50.0))
+    assert 0 not in mempool and len(mempool) == 10
+    # chosen transactions are never evicted
+    reserved = [row["transaction_id"] for row in mempool.reserve(block_size=10**6)]
+    for i in range(20, 30):
+        assert mempool.add(make_row(i, float(i)))
+    mempool.release(reserved)
+    assert all(transaction_id in mempool for transaction_id in reserved)
+
+def test_concurrent_adds():
+    mempool = Mempool()
+    def add_rows(start):
+        for i in range(start, start + 500):
+            mempool.add(make_row(i, float(i % 97)))
+    threads = [threading.Thread(target=add_rows, args=(start,)) for start in range(0, 2000, 500)]
+    for thread in threads:
+        thread.start()
+    reserved = []
+    while any(thread.is_alive() for thread in threads):
+        reserved += mempool.reserve(block_size=2000)
+    for thread in threads:
+        thread.join()
+    reserved += mempool.reserve(block_size=10**7)
+    assert sorted(row["transaction_id"] for row in reserved) == list(range(2000))
@@ -0,0 +1,55 @@
+from cpos.core.block import BlockHeader
+from cpos.core.missed import MissedBlockStore
+
+def make_header(i: int, round: int = 1) -> BlockHeader:
+    return BlockHeader(parent_hash=bytes(32),
+                       owner_pubkey=i.to_bytes(4, "little"),
+                       signed_node_hash=b"",
+                       round=round,
+                       index=1,
+                       ticket_number=1,
+                       transaction_hash=b"\x00")
+
+def test_blocks_and_peers_are_not_repeated():
+    store = MissedBlockStore(seed=0)
+    block = make_header(0)
+    store.add(block, b"peer a")
+    store.add(block, b"peer a")
+    store.add(block, b"peer b")
+    assert len(store) == 1
+    assert block.hash in store
+    assert sorted(store.peers) == [b"peer a", b"peer b"]
+
+def test_pop_random_peer():
+    store = MissedBlockStore(seed=0)
+    for i in range(3):
+        store.add(make_header(i), bytes([i]))
+    picked = [store.pop_random_peer() for _ in range(3)]
+    assert sorted(picked) == [b"\x00", b"\x01", b"\x02"]
+    assert not store.has_peers()
+    assert store.pop_random_peer() is None
+    # the blocks are still remembered
+    assert len(store) == 3
+    # a peer that sends another block can be picked again
+    store.add(make_header(3), b"\x00")
+    assert store.pop_random_peer() == b"\x00"
+
+def test_capacity():
+    store = MissedBlockStore(capacity=2)
+    store.add(make_header(0), b"peer a")
+    store.add(make_header(1), b"peer b")
+    store.add(make_header(2), b"peer b")
+    assert len(store) == 2
+    assert make_header(0).hash not in store
+    # peer a only sent the evicted block
+    assert store.peers == [b"peer b"]
+
+def test_expire():
+    store = MissedBlockStore(max_age=5)
+    store.add(make_header(0, round=1), b"peer a")
+    store.add(make_header(1, round=8), b"peer b")
+    store.expire(10)
+    assert len(store) == 1
+    assert store.peers == [b"peer b"]
+    store.clear()
+    assert len(store) == 0 and not store.has_peers()
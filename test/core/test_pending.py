@@ -0,0 +1,35 @@
+from cpos.core.pending import PendingRequests
+
+def test_unanswered_request_moves_to_next_peer():
+    requests = PendingRequests(timeout=1.0)
+    requests.request(b"block", b"peer a", now=0.0)
+    # later announcements are remembered instead of requested again
+    assert requests.add_source(b"block", b"peer b")
+    assert requests.add_source(b"block", b"peer a")
+    assert not requests.add_source(b"other", b"peer b")
+    assert len(requests) == 1
+
+    # peer a never answers
+    assert requests.expire(0.5) == []
+    assert requests.expire(1.0) == [(b"block", None, b"peer b")]
+    assert requests.expire(1.5) == []
+    # nobody else has it: dropped, so that the next announcement asks again
+    assert requests.expire(2.0) == []
+    assert b"block" not in requests
+
+def test_pop_and_fail():
+    requests = PendingRequests()
+    requests.request(b"block", b"peer a", now=0.0, item="header")
+    requests.add_source(b"block", b"peer b")
+    assert requests.get(b"block") == ("header", b"peer a")
+    assert requests.fail(b"block", now=0.0) == ("header", b"peer b")
+    assert requests.pop(b"block") == ("header", b"peer b")
+    assert requests.pop(b"block") is None
+    assert requests.fail(b"block", now=0.0) is None
+
+def test_capacity():
+    requests = PendingRequests(capacity=2)
+    for i in range(3):
+        requests.request(bytes([i]), b"peer", now=float(i))
+    assert b"\x00" not in requests
+    assert len(requests) == 2
@@ -1,4 +1,4 @@
-from cpos.core.sortition import binomial, cumulative_binom_dist, run_sortition
+from cpos.core.sortition import binomial, cumulative_binom_dist, _sortition_cdf, binomial_cdf, run_sortition, confirmation_threshold, fork_threshold, ThresholdTable
 from cpos.core.block import Block, GenesisBlock
 from cpos.core.transactions import TransactionList
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
@@ -18,6 +18,86 @@ def test_cumulative_binom_dist():
     error = abs(cumulative_binom_dist(120, 120, 0.1) - 1.0)
     assert error < 1e-8
 
+def test_binomial_cdf_matches_scalar():
+    cdf = binomial_cdf(40, 0.3)
+    for k in range(41):
+        assert abs(cdf[k] - cumulative_binom_dist(40, k, 0.3)) < 1e-12
+    assert binomial_cdf(5, 1.0)[4] == 0.0
+    assert binomial_cdf(5, 1.0)[5] == 1.0
+
+def test_large_stake_does_not_overflow():
+    # used to raise OverflowError in binomial()
+    assert abs(cumulative_binom_dist(20000, 20000, 0.01) - 1.0) < 1e-8
+    assert run_sortition(b"signature", 20000, 0.01) <= 20000
+    assert confirmation_threshold(total_stake=10000, tau=10, delta_r=3, threshold=1e-6) > 0
+    assert fork_threshold(total_stake=10000, tau=10, delta_r=3, threshold=0.95) <= 10
+
+def test_run_sortition_matches_linear_search():
+    for i in range(200):
+        signed_node_hash = sha256(i.to_bytes(4, "little")).digest()
+        for stake, p in [(1, 0.4), (3, 0.1), (10, 0.3), (50, 0.5)]:
+            q = int.from_bytes(sha256(signed_node_hash).digest(), byteorder="little", signed=False) / (1 << 256)
+            expected = 0
+            while expected < stake and q > cumulative_binom_dist(stake, expected, p):
+                expected += 1
+            assert run_sortition(signed_node_hash, stake, p) == expected
+
+# the exact-product CDF the sortition used before it moved to log space
+def baseline_cdf(n: int, k: int, p: float) -> float:
+    sum = 0
+    for i in range(0, k+1):
+        sum += binomial(n, i) * (p ** i) * ((1-p) ** (n-i))
+    return sum
+
+def test_sortition_cdf_matches_baseline():
+    # every entry, for the stakes and success probabilities (tau /
+    # total_stake) the protocol uses, must be bit-for-bit the same, or
+    # some hashes would draw a different number of tickets
+    for total_stake in (8, 10, 25, 50, 100):
+        for tau in (1, 2, 4, 10):
+            if tau > total_stake:
+                continue
+            p = tau / total_stake
+            for stake in list(range(1, 33)) + [50, 100]:
+                cdf = _sortition_cdf(stake, p)
+                assert list(cdf) == [baseline_cdf(stake, k, p) for k in range(stake + 1)]
+
+def test_thresholds_match_baseline():
+    for total_stake, tau in [(8, 4), (25, 10), (40, 5)]:
+        p = tau / total_stake
+        for delta_r in range(1, 7):
+            n = total_stake * delta_r
+            s = 1
+            while 1 - baseline_cdf(n, min(2*delta_r*s - 1, n), p) > 1e-6:
+                s += 1
+            assert confirmation_threshold(total_stake, tau, delta_r, 1e-6) == s
+            a = tau
+            while 1 - baseline_cdf(n, min(a*delta_r - 1, n), p) < 0.95:
+                a -= 1
+            assert fork_threshold(total_stake, tau, delta_r, 0.95) == a
+
+def test_threshold_table():
+    table = ThresholdTable(total_stake=8, tau=4)
+    for delta_r in range(1, 5):
+        assert table.confirmation_threshold(delta_r, 1e-6) == confirmation_threshold(8, 4, delta_r, 1e-6)
+        assert table.fork_threshold(delta_r, 0.95) == fork_threshold(8, 4, delta_r, 0.95)
+    assert len(table.confirmation) == 4
+
+def test_threshold_table_persistence(tmp_path):
+    path = str(tmp_path / "thresholds.json")
+    table = ThresholdTable(total_stake=8, tau=4)
+    table.precompute(3)
+    assert table.dirty
+    table.save(path)
+
+    loaded = ThresholdTable(total_stake=8, tau=4)
+    assert loaded.load(path)
+    assert loaded.confirmation == table.confirmation
+    assert loaded.fork == table.fork
+    assert not loaded.dirty
+    # tables computed for other parameters are ignored
+    assert not ThresholdTable(total_stake=9, tau=4).load(path)
+
 @pytest.mark.skip(reason="for visual inspection only")
 def test_total_ticket_distribution():
     gen = GenesisBlock()
@@ -0,0 +1,146 @@
+from cpos.core.block import Block, GenesisBlock
+from cpos.core.blockchain import BlockChain, BlockChainParameters
+from cpos.core.storage import MemoryStorage, SQLiteStorage
+from cpos.core.transactions import TransactionList
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+import pytest
+
+def make_row(index: int, confirmed: int = 0):
+    hash = bytes([index]) * 32
+    parent_hash = bytes([index - 1]) * 32 if index > 0 else b"\x00"
+    return [index, hash.hex(), index, parent_hash.hex(), hash.hex(), "", "", "", 0,
+            str([]), 0, 0, confirmed, 0, hash.hex(), 0, 0]
+
+@pytest.fixture(params=["memory", "sqlite"])
+def storage(request):
+    if request.param == "memory":
+        return MemoryStorage()
+    return SQLiteStorage(":memory:")
+
+def test_insert_and_read(storage):
+    assert storage.is_empty()
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1), make_row(2)])
+    assert not storage.is_empty()
+    assert storage.row_at(1)[0] == 1
+    assert storage.row_at(3) is None
+    assert [row[0] for row in storage.rows_since(1)] == [1, 2]
+    assert [row[0] for row in storage.first_rows(2)] == [0, 1]
+
+def test_delete_since(storage):
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1), make_row(2)])
+    storage.delete_since(1)
+    assert [row[0] for row in storage.all_rows()] == [0]
+
+def test_num_suc_and_confirmation(storage):
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1), make_row(2)])
+    storage.set_num_suc([(1, 3), (2, 1)])
+    storage.confirm(bytes([1]) * 32)
+    rows = storage.all_rows()
+    assert [row[12] for row in rows] == [1, 1, 0]
+    assert [row[15] for row in rows] == [0, 3, 1]
+
+def test_blockchain_on_memory_storage():
+    # p = tau/total_stake = 1, so every block passes the sortition
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    bc = BlockChain(params, genesis=GenesisBlock(), storage=MemoryStorage())
+    privkey = Ed25519PrivateKey.generate()
+    block = Block(parent_hash=bc.genesis.hash,
+                  transactionlist=TransactionList(),
+                  owner_pubkey=privkey.public_key().public_bytes_raw(),
+                  signed_node_hash=b"",
+                  round=1,
+                  index=1,
+                  ticket_number=1)
+    block.signed_node_hash = privkey.sign(block.node_hash)
+    block.update()
+
+    assert bc.insert(block)
+    assert not bc.insert(block)
+    assert bc.number_of_blocks() == 2
+    assert bc.get_last_block_hash() == block.hash
+    assert bc.block_by_index(-1).hash == block.hash
+
+def test_sqlite_transaction_rollback():
+    storage = SQLiteStorage(":memory:")
+    storage.insert_rows([make_row(0, confirmed=1)])
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            storage.insert_rows([make_row(1)])
+            raise RuntimeError("mutation failed halfway")
+    assert [row[0] for row in storage.all_rows()] == [0]
+
+def test_memory_transaction_rollback():
+    storage = MemoryStorage()
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1), make_row(2)])
+    before = storage.all_rows()
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            storage.set_num_suc([(1, 5)])
+            storage.delete_since(2)
+            storage.insert_rows([make_row(2), make_row(3)])
+            storage.set_num_suc([(2, 7)])
+            raise RuntimeError("mutation failed halfway")
+    assert storage.all_rows() == before
+    # rows changed by a committed transaction stay changed
+    with storage.transaction():
+        storage.set_num_suc([(1, 5)])
+    assert storage.row_at(1)[15] == 5
+
+def test_sqlite_group_commit(tmp_path):
+    path = str(tmp_path / "chain.db")
+    storage = SQLiteStorage(path, group_commit=True)
+    reader = SQLiteStorage(path)
+    with storage.transaction():
+        storage.insert_rows([make_row(0, confirmed=1), make_row(1)])
+    with storage.transaction():
+        storage.set_num_suc([(1, 1)])
+    assert reader.is_empty()
+    storage.flush()
+    assert [row[15] for row in reader.all_rows()] == [0, 1]
+
+def test_rows_since_limit(storage):
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1), make_row(2), make_row(3)])
+    assert [row[0] for row in storage.rows_since(1, 2)] == [1, 2]
+    assert [row[0] for row in storage.rows_since(3, 2)] == [3]
+
+def test_blockchain_reopens_sqlite_file(tmp_path):
+    path = str(tmp_path / "chain.db")
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    bc = BlockChain(params, genesis=GenesisBlock(timestamp=1000), storage=SQLiteStorage(path))
+    privkey = Ed25519PrivateKey.generate()
+    block = Block(parent_hash=bc.genesis.hash,
+                  transactionlist=TransactionList(),
+                  owner_pubkey=privkey.public_key().public_bytes_raw(),
+                  signed_node_hash=b"",
+                  round=1,
+                  index=1,
+                  ticket_number=1)
+    block.signed_node_hash = privkey.sign(block.node_hash)
+    block.update()
+    assert bc.insert(block)
+    bc.storage.close()
+
+    # the second run resumes the stored chain instead of inserting
+    # another genesis block
+    reopened = BlockChain(params, genesis=GenesisBlock(timestamp=1000), storage=SQLiteStorage(path))
+    assert reopened.number_of_blocks() == 2
+    assert reopened.get_last_block_hash() == block.hash
+    assert reopened.block_in_blockchain(block)
+    assert not reopened.insert(block)
+
+def test_blockchain_discards_chain_of_other_genesis(tmp_path):
+    path = str(tmp_path / "chain.db")
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    storage = SQLiteStorage(path)
+    storage.insert_rows([make_row(0, confirmed=1), make_row(1)])
+    storage.close()
+    # rows that don't start with our genesis block are discarded
+    bc = BlockChain(params, genesis=GenesisBlock(timestamp=1000), storage=SQLiteStorage(path))
+    assert bc.number_of_blocks() == 1
+    bc.storage.close()
+
+    # a run with another genesis timestamp starts over as well
+    reopened = BlockChain(params, genesis=GenesisBlock(timestamp=2000), storage=SQLiteStorage(path))
+    assert reopened.number_of_blocks() == 1
+    assert reopened.storage.row_at(0)[10] == 2000
+    assert reopened.get_last_block_hash() == reopened.genesis.hash
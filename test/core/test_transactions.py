@@ -0,0 +1,72 @@
+import sys
+import mysql.connector
+from cpos.core.transactions import select_transactions, MempoolClient
+
+def make_row(transaction_id: int, data: str) -> dict:
+    return {"transaction_id": transaction_id, "value": 100.0 - transaction_id, "data": data}
+
+def test_select_transactions():
+    rows = [make_row(i, "x" * 100) for i in range(10)]
+    row_size = sum(sys.getsizeof(value) for value in rows[0].values())
+
+    assert select_transactions(rows, block_size=10 * row_size) == rows
+    # stops at the first row that doesn't fit, keeping the value order
+    assert select_transactions(rows, block_size=3 * row_size + 1) == rows[:3]
+    assert select_transactions(rows, block_size=row_size - 1) == []
+    assert select_transactions([], block_size=row_size) == []
+
+def test_transaction_list_hash():
+    import datetime
+    from cpos.core.transactions import TransactionList, transaction_leaf
+    from cpos.util.merkle import IncrementalMerkleTree
+    assert TransactionList().get_hash() == b"\x00"
+
+    rows = [{"transaction_id": i, "data": "é, b]" * i, "timestamp": datetime.datetime(2024, 1, 1, 0, 0, i)} for i in range(5)]
+    built = TransactionList()
+    for row in rows:
+        built.append(row)
+    assert built.transactions == str(rows)
+
+    # a received list only has the str, and must hash the same
+    received = TransactionList()
+    received.set_transactions(str(rows))
+    assert received.get_hash() == built.get_hash()
+    assert received.get_hash() == IncrementalMerkleTree(transaction_leaf(repr(row)) for row in rows).root()
+
+    root = received.get_hash()
+    for index, row in enumerate(rows):
+        assert IncrementalMerkleTree.verify(transaction_leaf(repr(row)), index, received.proof(index), root)
+
+    received.set_transactions(str(rows[:4]))
+    assert received.get_hash() != root
+    # anything but a list is hashed as a whole
+    received.set_transactions("not a list")
+    assert received.get_hash() == transaction_leaf("not a list")
+
+def test_split_transactions():
+    import datetime
+    from cpos.core.transactions import split_transactions
+    rows = [{"id": "it's \"quoted\" \\", "data": "a, [b] (c) {d}", "timestamp": datetime.datetime(2024, 1, 1)}, 1, (2, 3)]
+    assert split_transactions(str(rows)) == [repr(row) for row in rows]
+    assert split_transactions("[]") == []
+    for malformed in ("", "[", "1, 2", "[1]]", "[(1]", "['1]", "[1] "):
+        assert split_transactions(malformed) is None
+
+def test_mempool_client_keeps_unmarked_ids():
+    client = MempoolClient(block_size=10**6)
+    rows = [make_row(i, "x") for i in range(3)]
+    calls = []
+    def fetch(chosen_ids):
+        calls.append(list(chosen_ids))
+        if len(calls) == 2:
+            raise mysql.connector.Error("connection lost")
+        return [row for row in rows if row["transaction_id"] not in chosen_ids]
+    client._fetch = fetch
+
+    assert client.take() == rows
+    # the update marking them as chosen fails...
+    assert client.take() == []
+    # ...so it is sent again with the next fetch
+    assert client.take() == []
+    client.close()
+    assert calls == [[], [0, 1, 2], [0, 1, 2], []]
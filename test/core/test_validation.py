@@ -0,0 +1,67 @@
+from concurrent.futures import Future
+from cpos.core.block import Block, GenesisBlock
+from cpos.core.blockchain import BlockChain, BlockChainParameters
+from cpos.core.storage import MemoryStorage
+from cpos.core.transactions import TransactionList
+from cpos.core.validation import ValidationPipeline
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+def make_blockchain() -> BlockChain:
+    params = BlockChainParameters(round_time=15.0, tolerance=2, tau=1, total_stake=1)
+    return BlockChain(params, genesis=GenesisBlock(), storage=MemoryStorage(), validation_workers=4)
+
+def make_block(bc: BlockChain, privkey: Ed25519PrivateKey) -> Block:
+    block = Block(parent_hash=bc.genesis.hash,
+                  transactionlist=TransactionList(),
+                  owner_pubkey=privkey.public_key().public_bytes_raw(),
+                  signed_node_hash=b"",
+                  round=1,
+                  index=1,
+                  ticket_number=1)
+    block.signed_node_hash = privkey.sign(block.node_hash)
+    block.update()
+    return block
+
+def test_prevalidate():
+    bc = make_blockchain()
+    block = make_block(bc, Ed25519PrivateKey.generate())
+    assert bc.prevalidate(block).result() == 1
+    assert len(bc.validation_cache) == 1
+    # cached proofs come back as finished futures
+    assert bc.prevalidate(block).done()
+
+    block.signed_node_hash = bytes(64)
+    block.update()
+    assert bc.prevalidate(block).result() is None
+    assert bc.validate_block(block) is None
+
+def test_pipeline_order():
+    bc = make_blockchain()
+    pipeline = ValidationPipeline(bc)
+    blocks = [make_block(bc, Ed25519PrivateKey.generate()) for _ in range(16)]
+    for i, block in enumerate(blocks):
+        pipeline.submit(block, i)
+    assert len(pipeline) == 16
+
+    ready = list(pipeline.ready(wait=True))
+    assert [context for _, context in ready] == list(range(16))
+    assert [block.hash for block, _ in ready] == [block.hash for block in blocks]
+    assert len(pipeline) == 0 and pipeline.head() is None
+    assert len(bc.validation_cache) == 16
+
+def test_pipeline_stops_at_pending_block():
+    bc = make_blockchain()
+    pipeline = ValidationPipeline(bc)
+    blocks = [make_block(bc, Ed25519PrivateKey.generate()) for _ in range(3)]
+    pipeline.submit(blocks[0], 0)
+    # hold the second block back, as if it were still being verified
+    pending = Future()
+    pipeline.queue.append((pending, blocks[1], 1))
+    pipeline.submit(blocks[2], 2)
+    pipeline.queue[0][0].result()
+    pipeline.queue[2][0].result()
+
+    assert [context for _, context in pipeline.ready()] == [0]
+    assert pipeline.head() is pending
+    pending.set_result(1)
+    assert [context for _, context in pipeline.ready()] == [1, 2]
@@ -0,0 +1,33 @@
+from cpos.p2p.peer import Peer
+from cpos.p2p.discovery.messages import Message, MessageParseError, Hello, PeerList, PeerListRequest, NotifyBeacon
+import pytest
+
+def test_round_trip():
+    peers = [Peer("10.0.0.1", 8888, b"a" * 32), Peer("10.0.0.2", 8889, b"b" * 32)]
+
+    hello = Message.deserialize(Hello(8888, b"a" * 32, "10.0.0.1").serialize())
+    assert isinstance(hello, Hello)
+    assert (hello.port, hello.id, hello.ip) == (8888, b"a" * 32, "10.0.0.1")
+
+    notify = Message.deserialize(NotifyBeacon(8888, b"a" * 32, "10.0.0.1").serialize())
+    assert isinstance(notify, NotifyBeacon)
+
+    request = Message.deserialize(PeerListRequest(b"a" * 32).serialize())
+    assert request.requester_id == b"a" * 32
+
+    peerlist = Message.deserialize(PeerList(peers).serialize())
+    assert [(p.ip, p.port, p.id) for p in peerlist.peers] == [(p.ip, p.port, p.id) for p in peers]
+
+def test_codes_are_integers():
+    assert Hello.code == 0x0
+    assert Message.deserialize(PeerListRequest(b"id").serialize()).code == 0x2
+
+def test_malformed_message():
+    with pytest.raises(MessageParseError):
+        Message.deserialize(b"\x01\x00\x01")
+    # peer address that isn't valid UTF-8
+    raw = bytearray(Hello(8888, b"id", "10.0.0.1").serialize())
+    address = raw.index(b"10.0.0.1")
+    raw[address:address + 2] = b"\xff\xfe"
+    with pytest.raises(MessageParseError):
+        Message.deserialize(bytes(raw))
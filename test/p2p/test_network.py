@@ -36,6 +36,21 @@ def test_basic_messaging():
     assert recv_msg.peer_id == sent_msg.peer_id
     assert recv_msg.peer_port == sent_msg.peer_port
 
+def test_read_batch():
+    a = Network(b"a", 8890, None, None)
+    b = Network(b"b", 8891, None, None)
+    a.connect("localhost", b.port, b.id)
+    sleep(1)
+    sent_msgs = [bytes([i]) * 16 for i in range(10)]
+    for msg in sent_msgs:
+        a.send(b.id, msg)
+    sleep(0.5)
+    # one poll, then everything that is queued (up to the limit)
+    assert b.read_batch(timeout=1000, max_messages=4) == sent_msgs[:4]
+    assert b.read_batch(timeout=1000) == sent_msgs[4:]
+    assert b.read_batch(timeout=0) == []
+    assert a.id in b.known_peers
+
 def main():
     test_basic_connectivity()
 
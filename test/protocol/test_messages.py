@@ -1,6 +1,10 @@
-from cpos.protocol.messages import Hello, BlockBroadcast
+from cpos.protocol.messages import (peek_block_hash, Message, MessageParseError, Hello, BlockBroadcast, ResyncRequest, ResyncResponse,
+                                    ResyncRangeRequest, ResyncRangeResponse, LocatorRequest, LocatorResponse,
+                                    HeaderBroadcast, BodyRequest, BodyResponse, InventoryAnnounce,
+                                    InventoryRequest, PeerForgetRequest, PeerList, WIRE_VERSION)
 from cpos.core.block import Block, GenesisBlock
 from cpos.core.transactions import TransactionList
+import pickle
 import pytest
 
 def test_hello_serialization():
@@ -10,14 +14,14 @@ def test_block_broadcast_serialization():
     gen = GenesisBlock()
     transactions = TransactionList()
     b = Block(parent_hash = gen.hash,
-              transactions = transactions,
+              transactionlist = transactions,
               owner_pubkey = b"testkey",
               signed_node_hash = b"1234",
               round = 1,
               index = 1,
               ticket_number = 1)
     original = Block(parent_hash = b.hash,
-                     transactions = transactions,
+                     transactionlist = transactions,
                      owner_pubkey = b"testkey2",
                      signed_node_hash = b"12345",
                      round = 2,
@@ -32,3 +36,104 @@ def test_block_broadcast_serialization():
     assert original.round == deserialized.round
     assert original.index == deserialized.index
     assert original.ticket_number == deserialized.ticket_number
+
+def make_block(index: int = 1) -> Block:
+    transactions = TransactionList()
+    transactions.set_transactions(str([{"transaction_id": 1, "value": "ação"}]))
+    return Block(parent_hash=bytes(32),
+                 transactionlist=transactions,
+                 owner_pubkey=bytes(range(32)),
+                 signed_node_hash=bytes(64),
+                 round=7,
+                 index=index,
+                 ticket_number=3)
+
+def test_round_trip():
+    block = make_block()
+    messages = [
+        Hello(b"peer_id", 8888),
+        PeerForgetRequest(b"peer_id"),
+        PeerList([("10.0.0.1", 8888, b"peer_id")]),
+        ResyncRequest(b"peer_id", -1),
+        ResyncResponse(block),
+        ResyncResponse(None),
+        ResyncRangeRequest(b"peer_id", -16, 16),
+        ResyncRangeResponse(4, [make_block(4), make_block(5)]),
+        LocatorRequest(b"peer_id", [bytes(32), b"\x00"]),
+        LocatorResponse(None, 10),
+        LocatorResponse(3, 10),
+        BodyRequest(b"peer_id", bytes(32)),
+        BodyResponse(b"peer_id", bytes(32), block.transactions),
+        BodyResponse(b"peer_id", bytes(32), None),
+        InventoryAnnounce(b"peer_id", [bytes(32)]),
+        InventoryRequest(b"peer_id", [bytes(32), b"\x01" * 32]),
+    ]
+    for msg in messages:
+        decoded = Message.deserialize(msg.serialize())
+        assert type(decoded) is type(msg)
+        for key, value in vars(msg).items():
+            if isinstance(value, Block):
+                assert getattr(decoded, key).hash == value.hash
+            elif isinstance(value, list) and value and isinstance(value[0], Block):
+                assert [b.hash for b in getattr(decoded, key)] == [b.hash for b in value]
+            else:
+                assert getattr(decoded, key) == value
+
+def test_malformed_messages():
+    raw = bytearray(BlockBroadcast(make_block(), b"peer_id").serialize())
+    with pytest.raises(MessageParseError):
+        Message.deserialize(bytes(raw[:-1]))
+    with pytest.raises(MessageParseError):
+        Message.deserialize(bytes(raw) + b"\x00")
+    with pytest.raises(MessageParseError):
+        Message.deserialize(b"\x01\xff")
+    with pytest.raises(MessageParseError):
+        Hello.deserialize(bytes(raw))
+    # the block hash comes right after the frame header; a block whose
+    # contents don't match it is rejected
+    raw[3] ^= 0xff
+    with pytest.raises(MessageParseError):
+        Message.deserialize(bytes(raw))
+    # pickles are no longer accepted
+    with pytest.raises(MessageParseError):
+        Message.deserialize(pickle.dumps(Hello(b"peer_id", 8888)))
+
+def test_peer_list_with_invalid_address():
+    raw = bytearray(PeerList([("10.0.0.1", 8888, b"id")]).serialize())
+    # frame header, peer count, then the address length and bytes
+    address = raw.index(b"10.0.0.1")
+    raw[address:address + 2] = b"\xff\xfe"
+    with pytest.raises(MessageParseError):
+        Message.deserialize(bytes(raw))
+
+def test_hostile_transactions():
+    # transactions are split without a parser, so deeply nested or huge
+    # expressions can't blow the stack or the memory of the receiver
+    payloads = ["[" + "1+" * 100000 + "1]", "-" * 200000, "[" * 100000 + "]" * 100000, "[" + "'\\" * 100000 + "]"]
+    for payload in payloads:
+        transactions = TransactionList()
+        transactions.set_transactions(payload)
+        block = Block(parent_hash=bytes(32),
+                      transactionlist=transactions,
+                      owner_pubkey=bytes(range(32)),
+                      signed_node_hash=bytes(64),
+                      round=7,
+                      index=1,
+                      ticket_number=3)
+        msg = Message.deserialize(BlockBroadcast(block, b"peer_id").serialize())
+        assert msg.block.hash == block.hash
+
+def test_header_broadcast():
+    block = make_block()
+    msg = Message.deserialize(HeaderBroadcast(block.header(), b"peer_id").serialize())
+    assert isinstance(msg, HeaderBroadcast)
+    assert msg.header.hash == block.hash
+    assert msg.header.transaction_hash == block.transaction_hash
+    assert len(msg.serialize()) < len(BlockBroadcast(block, b"peer_id").serialize())
+
+def test_peek_block_hash():
+    block = make_block()
+    assert peek_block_hash(BlockBroadcast(block, b"peer_id").serialize()) == block.hash
+    assert peek_block_hash(HeaderBroadcast(block.header(), b"peer_id").serialize()) == block.hash
+    assert peek_block_hash(Hello(b"peer_id", 8888).serialize()) is None
+    assert peek_block_hash(bytes([WIRE_VERSION, 0x02, 0x20]) + b"short") is None
@@ -0,0 +1,29 @@
+import logging
+from cpos.core.pending import PendingRequests
+from cpos.node import Node
+from cpos.protocol.messages import BodyRequest, BodyResponse
+
+# just enough of a node to handle body responses
+def make_node() -> tuple[Node, list]:
+    node = Node.__new__(Node)
+    node.id = b"self"
+    node.logger = logging.getLogger(__name__)
+    node.pending_bodies = PendingRequests(timeout=1.0)
+    sent = []
+    node.send_message = lambda peer_id, msg: sent.append((peer_id, msg))
+    return node, sent
+
+def test_body_response_from_other_peer_is_ignored():
+    node, sent = make_node()
+    node.pending_bodies.request(b"block", b"peer a", 0.0, "header")
+    node.pending_bodies.add_source(b"block", b"peer b")
+
+    # nobody but peer a can fail the request on its behalf
+    node.handle_body_response(BodyResponse(b"peer c", b"block", None))
+    node.handle_body_response(BodyResponse(b"peer b", b"block", None))
+    assert node.pending_bodies.get(b"block") == ("header", b"peer a")
+    assert sent == []
+
+    node.handle_body_response(BodyResponse(b"peer a", b"block", None))
+    assert node.pending_bodies.get(b"block") == ("header", b"peer b")
+    assert [(peer_id, type(msg)) for peer_id, msg in sent] == [(b"peer b", BodyRequest)]
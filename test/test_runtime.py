@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import Future
+from types import SimpleNamespace
+from cpos.core.validation import ValidationPipeline
+from cpos.node import Node
+from cpos.runtime import AsyncNodeRuntime
+
+def test_failing_task_halts_node():
+    node = SimpleNamespace(id=bytes(32), should_halt=False)
+    runtime = AsyncNodeRuntime(node)
+
+    async def receive():
+        raise RecursionError("handler blew up")
+
+    async def main():
+        runtime.halted = asyncio.Event()
+        task = asyncio.create_task(receive())
+        task.add_done_callback(runtime.on_task_done)
+        await asyncio.wait_for(runtime.halted.wait(), timeout=1)
+
+    asyncio.run(main())
+    assert node.should_halt
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+        self.sleeps: list[float] = []
+
+    def time(self) -> float:
+        return self.now
+
+    # wakes up a bit early on long sleeps, like a real timer may
+    async def sleep(self, delay: float):
+        self.sleeps.append(delay)
+        self.now += delay - 0.01 if delay > 0.5 else delay
+        await real_sleep(0)
+
+real_sleep = asyncio.sleep
+
+def test_rounds_start_on_round_boundaries(monkeypatch):
+    clock = FakeClock(12.3)
+    monkeypatch.setattr("cpos.runtime.time", clock.time)
+    monkeypatch.setattr("cpos.runtime.asyncio.sleep", clock.sleep)
+
+    bc = SimpleNamespace(genesis=SimpleNamespace(timestamp=0.0), parameters=SimpleNamespace(round_time=5.0), current_round=0)
+    def update_round():
+        bc.current_round = int((clock.now - bc.genesis.timestamp) // bc.parameters.round_time)
+    bc.update_round = update_round
+    started = []
+    node = SimpleNamespace(id=bytes(32), should_halt=False, bc=bc,
+                           on_new_round=lambda: started.append((bc.current_round, clock.now)),
+                           reached_total_rounds=lambda initial_round: bc.current_round >= initial_round + 3)
+    runtime = AsyncNodeRuntime(node)
+
+    async def main():
+        runtime.halted = asyncio.Event()
+        runtime.wakeup_resync = asyncio.Event()
+        runtime.initial_round = 2
+        await runtime.rounds()
+
+    asyncio.run(main())
+    assert node.should_halt
+    # the first round starts right away, the next ones on their boundary;
+    # waking up early just sleeps for the rest of the round
+    assert [round for round, _ in started] == [2, 3, 4]
+    assert [round(now, 6) for _, now in started] == [12.3, 15.0, 20.0]
+    assert [round(delay, 6) for delay in clock.sleeps] == [2.7, 0.01, 5.0, 0.01, 5.0, 0.01]
+
+class FakeSocket:
+    def __init__(self, frames: list):
+        self.frames = frames
+
+    async def recv_multipart(self):
+        if not self.frames:
+            await asyncio.Event().wait()
+        return self.frames.pop(0)
+
+def test_receive_drains_queue_in_one_wakeup():
+    queue = [b"second", b"third", b"fourth", b"fifth"]
+    def drain(max_messages: int) -> list[bytes]:
+        batch = queue[:max_messages]
+        del queue[:max_messages]
+        return batch
+    network = SimpleNamespace(accept=lambda frames: frames[2], drain=drain)
+    handled = []
+    node = SimpleNamespace(id=bytes(32), network=network, read_batch_size=3, handle_message=handled.append)
+    runtime = AsyncNodeRuntime(node)
+
+    async def main():
+        runtime.socket = FakeSocket([[b"peer", b"", b"first"]])
+        runtime.wakeup_validation = asyncio.Event()
+        runtime.wakeup_resync = asyncio.Event()
+        task = asyncio.create_task(runtime.receive())
+        # a single frame arrived, but everything queued behind it is
+        # handled before the task waits on the socket again
+        while not runtime.wakeup_resync.is_set():
+            await real_sleep(0)
+        assert handled == [b"first", b"second", b"third", b"fourth", b"fifth"]
+        assert runtime.wakeup_validation.is_set()
+        task.cancel()
+
+    asyncio.run(main())
+
+def test_insert_validated_keeps_arrival_order():
+    futures = [Future() for _ in range(3)]
+    bc = SimpleNamespace(prevalidate=lambda block: futures[block])
+    inserted = []
+    node = SimpleNamespace(id=bytes(32), validation=ValidationPipeline(bc),
+                           insert_received_block=lambda block, peer_id: inserted.append(block))
+    node.process_validated_blocks = lambda: Node.process_validated_blocks(node)
+    for block in range(3):
+        node.validation.submit(block, b"peer")
+    runtime = AsyncNodeRuntime(node)
+
+    async def main():
+        runtime.wakeup_validation = asyncio.Event()
+        runtime.wakeup_resync = asyncio.Event()
+        task = asyncio.create_task(runtime.insert_validated())
+        # later blocks verified first still wait for the oldest one
+        futures[2].set_result(1)
+        futures[1].set_result(1)
+        for _ in range(10):
+            await real_sleep(0)
+        assert inserted == []
+        futures[0].set_result(1)
+        while len(inserted) < 3:
+            await real_sleep(0)
+        assert inserted == [0, 1, 2]
+        assert runtime.wakeup_resync.is_set()
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(main(), timeout=5))
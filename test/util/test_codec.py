@@ -0,0 +1,51 @@
+from cpos.util.codec import Encoder, Decoder, CodecError
+import pytest
+
+def test_round_trip():
+    enc = Encoder()
+    enc.u8(255)
+    enc.u16(8888)
+    enc.u32(2**32 - 1)
+    enc.i64(-5)
+    enc.short_bytes(b"\x00" * 32)
+    enc.bytes(b"x" * 1000)
+    enc.str("ação")
+    enc.short_str("10.0.0.1")
+    enc.optional(None, enc.u8)
+    enc.optional(7, enc.u8)
+    enc.list([b"a", b"bc"], enc.short_bytes)
+
+    dec = Decoder(enc.getvalue())
+    assert dec.u8() == 255
+    assert dec.u16() == 8888
+    assert dec.u32() == 2**32 - 1
+    assert dec.i64() == -5
+    assert dec.short_bytes() == b"\x00" * 32
+    assert dec.bytes() == b"x" * 1000
+    assert dec.str() == "ação"
+    assert dec.short_str() == "10.0.0.1"
+    assert dec.optional(dec.u8) is None
+    assert dec.optional(dec.u8) == 7
+    assert dec.list(dec.short_bytes) == [b"a", b"bc"]
+    dec.finish()
+
+def test_views_do_not_copy():
+    raw = b"\x03abcrest"
+    dec = Decoder(raw)
+    view = dec.short_view()
+    assert view == b"abc"
+    assert view.obj is raw
+
+def test_errors():
+    with pytest.raises(CodecError):
+        Encoder().short_bytes(b"x" * 256)
+    with pytest.raises(CodecError):
+        Decoder(b"\x05abc").short_bytes()
+    with pytest.raises(CodecError):
+        Decoder(b"\x02\xff\xfe").short_str()
+    with pytest.raises(CodecError):
+        Decoder(b"\x01").u32()
+    dec = Decoder(b"\x01\x02")
+    dec.u8()
+    with pytest.raises(CodecError):
+        dec.finish()
@@ -0,0 +1,19 @@
+import random
+from cpos.util.fenwick import FenwickTree
+
+def test_prefix_sums():
+    tree = FenwickTree(capacity=4)
+    values = [0] * 100
+    random.seed(0)
+    for _ in range(500):
+        position = random.randrange(100)
+        delta = random.randint(-5, 5)
+        tree.add(position, delta)
+        values[position] += delta
+    for position in range(100):
+        assert tree.prefix_sum(position) == sum(values[:position + 1])
+
+def test_prefix_sum_past_the_end():
+    tree = FenwickTree(capacity=2)
+    tree.add(1, 3)
+    assert tree.prefix_sum(1000) == 3
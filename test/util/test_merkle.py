@@ -1,4 +1,6 @@
-from cpos.util.merkle import _is_power_of_two, MerkleTree
+from hashlib import sha256
+from cpos.util.merkle import _is_power_of_two, MerkleTree, IncrementalMerkleTree, MerkleBuilder, verify_proof
+import pytest
 
 def test_is_power_of_two():
     assert _is_power_of_two(256) == True
@@ -30,3 +32,94 @@ def test_different_data_padding_merkle_root():
     merkle1 = MerkleTree(data1, chunk_size=32)
     merkle2 = MerkleTree(data2, chunk_size=32)
     assert merkle1 != merkle2
+
+def test_parallel_root_matches_serial():
+    data = bytes(range(256)) * 40
+    chunk_size = 32
+    for count in (1, 2, 3, 5, 7, 9, 33, 255, 257):
+        payload = data[:count * chunk_size - 5]
+        serial = MerkleTree(payload, chunk_size=chunk_size)
+        assert serial.leaf_count == count
+        for workers in (2, 3, 4, 8):
+            parallel = MerkleTree(payload, chunk_size=chunk_size, workers=workers)
+            assert parallel.chunks == serial.chunks
+            assert parallel.merkle_root() == serial.merkle_root()
+
+def test_incremental_root_matches_merkle_tree():
+    chunk_size = 32
+    for size in (1, 2, 3, 5, 8, 13, 33):
+        data = bytes(range(256)) * 20
+        data = data[:size * chunk_size]
+        leaves = [sha256(data[i:i + chunk_size]).digest() for i in range(0, len(data), chunk_size)]
+        tree = IncrementalMerkleTree(leaves)
+        assert len(tree) == size
+        assert tree.root() == MerkleTree(data, chunk_size=chunk_size).merkle_root()
+
+def test_incremental_append():
+    leaves = [sha256(bytes([i])).digest() for i in range(20)]
+    tree = IncrementalMerkleTree()
+    with pytest.raises(ValueError):
+        tree.root()
+    for i, leaf in enumerate(leaves):
+        tree.append(leaf)
+        # same as building the tree from scratch
+        assert tree.root() == IncrementalMerkleTree(leaves[:i + 1]).root()
+
+def test_incremental_proofs():
+    leaves = [sha256(bytes([i])).digest() for i in range(11)]
+    tree = IncrementalMerkleTree(leaves)
+    root = tree.root()
+    for index, leaf in enumerate(leaves):
+        proof = tree.proof(index)
+        assert len(proof) == 4
+        assert IncrementalMerkleTree.verify(leaf, index, proof, root)
+        assert not IncrementalMerkleTree.verify(leaf, index ^ 1, proof, root)
+        assert not IncrementalMerkleTree.verify(sha256(leaf).digest(), index, proof, root)
+    with pytest.raises(IndexError):
+        tree.proof(11)
+
+def test_builder_matches_merkle_tree():
+    data = bytes(range(256)) * 40
+    for size in (1, 31, 32, 33, 100, 257, 1000, len(data)):
+        expected = MerkleTree(data[:size], chunk_size=32).merkle_root()
+        # in one go, and in pieces that don't line up with the chunks
+        assert MerkleBuilder.from_iterable([data[:size]], chunk_size=32).root() == expected
+        pieces = [data[i:min(i + 7, size)] for i in range(0, size, 7)]
+        assert MerkleBuilder.from_iterable(pieces, chunk_size=32).root() == expected
+
+def test_builder_tracked_proofs():
+    data = bytes(range(256)) * 10
+    leaves = [sha256(data[i:i + 32]).digest() for i in range(0, len(data), 32)]
+    track = [0, 1, 37, 63, 64, 79]
+    builder = MerkleBuilder.from_iterable([data], chunk_size=32, track=track + [500])
+    root = builder.root()
+    for index in track:
+        proof = builder.proof(index)
+        assert proof == IncrementalMerkleTree(leaves).proof(index)
+        assert verify_proof(leaves[index], index, proof, root)
+    with pytest.raises(KeyError):
+        builder.proof(2)
+    with pytest.raises(IndexError):
+        builder.proof(500)
+
+def test_builder_from_file(tmp_path):
+    data = bytes(range(256)) * 100 + b"tail"
+    path = tmp_path / "payload"
+    path.write_bytes(data)
+    builder = MerkleBuilder.from_file(str(path), chunk_size=1024, track=[25])
+    assert builder.root() == MerkleTree(data, chunk_size=1024).merkle_root()
+    assert verify_proof(sha256(data[25 * 1024:]).digest(), 25, builder.proof(25), builder.root())
+
+    empty = tmp_path / "empty"
+    empty.write_bytes(b"")
+    with pytest.raises(ValueError):
+        MerkleBuilder.from_file(str(empty))
+
+def test_parallel_merkle_root():
+    data = bytes(range(256)) * 300
+    for size in (1, 100, 4096, 4097, len(data)):
+        serial = MerkleTree(data[:size], chunk_size=512)
+        parallel = MerkleTree(data[:size], chunk_size=512, workers=4)
+        assert parallel.chunks == serial.chunks
+        leaves = [sha256(data[i:min(i + 512, size)]).digest() for i in range(0, size, 512)]
+        assert serial.merkle_root() == parallel.merkle_root() == IncrementalMerkleTree(leaves).root()
@@ -0,0 +1,35 @@
+from hashlib import sha256
+from cpos.util.seen import SeenFilter
+
+def key(i: int) -> bytes:
+    return sha256(i.to_bytes(4, "little")).digest()
+
+def test_add_and_contains():
+    seen = SeenFilter(capacity=16)
+    assert key(0) not in seen
+    assert seen.add(key(0))
+    assert key(0) in seen
+    assert not seen.add(key(0))
+    # short keys (like the genesis hash) work too
+    assert seen.add(b"\x00")
+    assert b"\x00" in seen
+
+def test_memoryview_keys():
+    seen = SeenFilter(capacity=16)
+    raw = b"\x01\x02" + key(1) + b"rest"
+    seen.add(key(1))
+    assert memoryview(raw)[2:34] in seen
+    assert not seen.add(memoryview(raw)[2:34])
+
+def test_eviction_without_false_negatives():
+    capacity = 64
+    seen = SeenFilter(capacity=capacity)
+    for i in range(1000):
+        seen.add(key(i))
+        # keep refreshing an old key; it must never be forgotten
+        seen.add(key(-1 % 2**32))
+        assert key(-1 % 2**32) in seen
+        for j in range(max(0, i - capacity + 2), i + 1):
+            assert key(j) in seen
+    assert len(seen) == capacity
+    assert key(0) not in seen